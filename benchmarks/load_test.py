@@ -0,0 +1,340 @@
+# End-to-end load test: concurrent analysts working on an upgrade, completely offline.
+#
+# The tool and a stand-in for the MITRE and GitHub servers run in local HTTP servers. Every analyst is a thread
+# that repeatedly opens the overview and change pages, navigates between changes, edits statuses and sometimes
+# exports the spreadsheet.
+#
+# Usage:
+#   python benchmarks/load_test.py [--analysts 8] [--duration 30] [--techniques 500] [--output results.json]
+import argparse, json, os, platform, random, shutil, tempfile, threading, time
+from datetime import datetime
+from os import path
+
+import requests
+import synthetic_data as sd
+from standin_server import StandInData, create_app, start_server
+from run_benchmarks import BENCHMARK_DIR, REPO_DIR, FROM_VERSION, TO_VERSION, check_matched, count_imported_changes, get_commit
+
+STATUSES = ["Done", "In Progress", "Not Done"]
+
+# Maximum number of SQL statements per request of the main routes (endpoint -> budget). The load test fails if a
+# route needs more, e.g. because a relationship is suddenly loaded lazily in a loop.
+QUERY_BUDGETS = {
+    "homepage": 2, "upgrade": 1, "change": 1, "links": 3, "change_status": 2, "change_evaluation_status": 2,
+    "change_reasoning_and_measures": 2, "technique_history_api": 1, "search": 1, "facets": 7, "export_report": 2
+}
+
+
+
+'''
+=====================================================================================
+| Collects the latency of every request of all analysts.                            |
+=====================================================================================
+'''
+class Recorder():
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies: dict = {} # Action -> list of seconds.
+        self.errors: dict = {} # Action -> number of failed requests.
+
+
+
+    '''
+    =====================================================================================
+    | Records the latency of a request and whether it failed.                           |
+    =====================================================================================
+    '''
+    def record(self, action: str, seconds: float, ok: bool) -> None:
+        with self.lock:
+            self.latencies.setdefault(action, []).append(seconds)
+            if not ok:
+                self.errors[action] = self.errors.get(action, 0) + 1
+
+
+
+    '''
+    =====================================================================================
+    | Sends a request, records its latency and returns the response (None if the        |
+    | request failed completely).                                                       |
+    =====================================================================================
+    '''
+    def request(self, session: requests.Session, action: str, method: str, url: str, expected: tuple = (200,), **kwargs):
+        start = time.perf_counter()
+
+        try:
+            response = session.request(method, url, timeout=120, **kwargs)
+        except requests.RequestException:
+            self.record(action, time.perf_counter() - start, False)
+            return None
+
+        self.record(action, time.perf_counter() - start, response.status_code in expected)
+        return response
+
+
+
+'''
+=====================================================================================
+| Returns the percentile (0-100) of a sorted list with the nearest-rank method.     |
+=====================================================================================
+'''
+def percentile(values: list, p: float) -> float:
+    index = max(0, min(len(values) - 1, int(round(p / 100 * len(values) + 0.5)) - 1))
+    return values[index]
+
+
+
+'''
+=====================================================================================
+| Simulates a single analyst until the end time is reached:                         |
+| overview -> change page -> previous/next links -> status edit, and with a small   |
+| probability an export that is polled until the file is ready.                     |
+=====================================================================================
+'''
+def analyst(base_url: str, mitre_ids: list, recorder: Recorder, end_time: float, export_ratio: float, seed: int) -> None:
+    rng = random.Random(seed)
+    session = requests.Session()
+    upgrade_url = f"{base_url}/upgrade/{FROM_VERSION}-{TO_VERSION}"
+
+    while time.perf_counter() < end_time:
+        recorder.request(session, "overview", "GET", upgrade_url)
+
+        mitre_id = rng.choice(mitre_ids)
+        data = {"from_version": FROM_VERSION, "to_version": TO_VERSION, "mitre_id": mitre_id}
+
+        recorder.request(session, "change_page", "GET", f"{upgrade_url}/{mitre_id}")
+        recorder.request(session, "links", "POST", f"{base_url}/api/links", json={**data, "filter": "All"})
+        recorder.request(session, "status_edit", "POST", f"{base_url}/api/change-status", expected=(204,), json={**data, "status": rng.choice(STATUSES)})
+
+        if rng.random() >= export_ratio:
+            continue
+
+        # The export runs in the background. Its end-to-end time includes polling until the job is done.
+        start = time.perf_counter()
+        response = recorder.request(session, "export_start", "POST", f"{base_url}/api/export-file", expected=(202,), json=data)
+        if response is None or response.status_code != 202:
+            continue
+
+        # Only the latest job of an upgrade is kept. If another analyst has started a newer export in the meantime,
+        # the job is gone (404) and the newer export contains the changes as well.
+        status_url = base_url + response.json()["status_url"]
+        status = "running"
+        while status == "running" and time.perf_counter() < end_time + 60:
+            time.sleep(0.2)
+            response = recorder.request(session, "export_status", "GET", status_url, expected=(200, 404))
+            if response is None:
+                status = "failed"
+            elif response.status_code == 404:
+                status = "done"
+            else:
+                status = response.json()["status"]
+
+        recorder.record("export_end_to_end", time.perf_counter() - start, status == "done")
+
+
+
+'''
+=====================================================================================
+| Requests the main routes once with the query checks of the tool in strict mode    |
+| and returns the number of SQL statements per route. Raises QueryBudgetExceeded if |
+| a route exceeds its budget in QUERY_BUDGETS, possible N+1 queries are logged.     |
+| The requests are sent with the test client, so they run in this thread and the    |
+| statements can be assigned to them. Runs after the analysts, because the engine   |
+| events would slow down the measured requests.                                     |
+=====================================================================================
+'''
+def check_query_budgets(app, engine, mitre_id: str) -> dict:
+    from query_monitor import QueryMonitor
+
+    monitor = QueryMonitor(slow_query_ms=1000, n_plus_one_threshold=5, budgets=QUERY_BUDGETS, strict=True)
+    monitor.instrument_engine(engine)
+    client = app.test_client()
+
+    data = {"from_version": FROM_VERSION, "to_version": TO_VERSION, "mitre_id": mitre_id}
+    routes = [
+        ("homepage", "GET", "/", None),
+        ("upgrade", "GET", f"/upgrade/{FROM_VERSION}-{TO_VERSION}", None),
+        ("change", "GET", f"/upgrade/{FROM_VERSION}-{TO_VERSION}/{mitre_id}", None),
+        ("links", "POST", "/api/links", {**data, "filter": "All"}),
+        ("change_status", "POST", "/api/change-status", {**data, "status": "In Progress"}),
+        ("change_evaluation_status", "POST", "/api/change-evaluation-status", {**data, "target": "client-status", "value": "partial"}),
+        ("change_reasoning_and_measures", "POST", "/api/change-reasoning-and-measures", {**data, "target": "client-reasoning", "text": "Load test"}),
+        ("technique_history_api", "GET", f"/api/technique/{mitre_id}/history", None),
+        ("search", "GET", f"/api/search?q={mitre_id}", None),
+        ("facets", "GET", f"/api/facets/{FROM_VERSION}-{TO_VERSION}?status=Done", None),
+        ("export_report", "GET", f"/api/export-report/{FROM_VERSION}-{TO_VERSION}", None)
+    ]
+
+    counts = {}
+    for endpoint, method, url, body in routes:
+        with monitor.expect_queries(QUERY_BUDGETS[endpoint]) as statements:
+            response = client.open(url, method=method, json=body)
+
+        if response.status_code >= 400:
+            raise Exception(f"{endpoint} failed with status {response.status_code}: {response.get_data(as_text=True)[:200]}")
+
+        # Logs possible N+1 queries.
+        monitor.check(endpoint, statements)
+        counts[endpoint] = len(statements)
+
+    return counts
+
+
+
+'''
+=====================================================================================
+| Starts the stand-in server and the tool in a temporary working directory,         |
+| initiates the upgrade, uploads a synthetic spreadsheet, checks that its rows have |
+| been imported and runs the analysts. Returns the results.                         |
+=====================================================================================
+'''
+def run_load_test(analysts: int, duration: float, techniques: int, export_ratio: float, seed: int) -> dict:
+    standin_server, standin_url = start_server(create_app(StandInData(techniques, seed, ["v16.1", FROM_VERSION, TO_VERSION])))
+
+    work_dir = tempfile.mkdtemp(prefix="ese-load-test-")
+    previous_dir = os.getcwd()
+    os.chdir(work_dir)
+
+    # The modules of the tool have to be imported after changing the working directory, because the DB path is
+    # relative. The base URLs are set before ese is imported, since the releases are fetched on startup.
+    import helper as hp
+    hp.MITRE_BASE_URL = hp.GITHUB_API_URL = hp.RAW_GITHUB_URL = standin_url
+
+    import ese
+    ese.app.template_folder = path.join(REPO_DIR, "templates")
+    ese.app.static_folder = path.join(REPO_DIR, "static")
+    app_server, base_url = start_server(ese.app)
+
+    print(f"Load test with {analysts} analysts for {duration} s in {work_dir}")
+
+    session = requests.Session()
+    response = session.post(f"{base_url}/upgrade/initiate", data={"version_select": FROM_VERSION})
+    if response.status_code != 200:
+        raise Exception(f"Initiating the upgrade failed: {response.text}")
+
+    sheet = path.join(work_dir, "source.xlsx")
+    sheet_ids = sd.generate_mitre_ids(techniques)[::2]
+    sd.generate_sheet(sheet, sheet_ids, seed)
+    with open(sheet, "rb") as f:
+        response = session.post(
+            f"{base_url}/api/upload-file",
+            data={"from_version": FROM_VERSION, "to_version": TO_VERSION},
+            files={"file": ("source.xlsx", f)}
+        )
+    if response.status_code != 200:
+        raise Exception(f"Uploading the spreadsheet failed: {response.text}")
+
+    # The analysts open the changes that are listed in the overview. Techniques with sub-techniques are not listed.
+    mitre_ids = [c.mitre_id for c in hp.get_changes(FROM_VERSION, TO_VERSION, ese.db)]
+
+    # The analysts should work on imported evaluations, so all listed techniques of the file must have matched.
+    check_matched("upload", count_imported_changes(ese.db), len(set(mitre_ids) & set(sheet_ids)))
+    ese.db.remove()
+
+    recorder = Recorder()
+    start = time.perf_counter()
+    threads = [
+        threading.Thread(target=analyst, args=(base_url, mitre_ids, recorder, start + duration, export_ratio, seed + i))
+        for i in range(analysts)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    query_counts = check_query_budgets(ese.app, ese.engine, mitre_ids[0])
+    print("SQL statements per request:", json.dumps(query_counts))
+
+    app_server.shutdown()
+    standin_server.shutdown()
+    ese.db.remove()
+    os.chdir(previous_dir)
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+    results = {}
+    for action, latencies in sorted(recorder.latencies.items()):
+        latencies = sorted(latencies)
+        results[action] = {
+            "requests": len(latencies),
+            "errors": recorder.errors.get(action, 0),
+            "throughput": len(latencies) / elapsed,
+            "p50": percentile(latencies, 50),
+            "p90": percentile(latencies, 90),
+            "p99": percentile(latencies, 99),
+            "max": latencies[-1]
+        }
+
+    # The end-to-end export time is not a single request.
+    requests_total = sum(result["requests"] for action, result in results.items() if action != "export_end_to_end")
+    return {
+        "elapsed": elapsed, "requests": requests_total, "throughput": requests_total / elapsed, "actions": results,
+        "query_counts": query_counts
+    }
+
+
+
+'''
+=====================================================================================
+| Prints the throughput and the latency percentiles of every action.                |
+=====================================================================================
+'''
+def print_results(results: dict) -> None:
+    print(f"{'action':20} {'requests':>9} {'errors':>7} {'req/s':>8} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+
+    for action, result in results["actions"].items():
+        print(
+            f"{action:20} {result['requests']:9} {result['errors']:7} {result['throughput']:8.1f} "
+            f"{result['p50'] * 1000:9.1f} {result['p90'] * 1000:9.1f} {result['p99'] * 1000:9.1f} {result['max'] * 1000:9.1f}"
+        )
+
+    print(f"Total: {results['requests']} requests in {results['elapsed']:.1f} s ({results['throughput']:.1f} requests/s)")
+
+
+
+'''
+=====================================================================================
+| Parses the arguments, runs the load test and saves the results as JSON.           |
+=====================================================================================
+'''
+def main():
+    parser = argparse.ArgumentParser(description="Offline end-to-end load test with concurrent analysts.")
+    parser.add_argument("--analysts", type=int, default=8, help="Number of concurrent analysts.")
+    parser.add_argument("--duration", type=float, default=30, help="Duration of the load test in seconds.")
+    parser.add_argument("--techniques", type=int, default=500, help="Number of techniques (sub-techniques are added).")
+    parser.add_argument("--export-ratio", type=float, default=0.02, help="Probability that an analyst exports after an edit.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the synthetic data and the analysts.")
+    parser.add_argument("--output", help="JSON file for the results (default: benchmarks/results/load-<time>-<commit>.json).")
+    args = parser.parse_args()
+
+    commit = get_commit()
+    output = args.output or path.join(
+        BENCHMARK_DIR, "results", f"load-{datetime.now().strftime('%Y%m%d-%H%M%S')}-{commit or 'unknown'}.json"
+    )
+    output = path.abspath(output)
+
+    results = run_load_test(args.analysts, args.duration, args.techniques, args.export_ratio, args.seed)
+
+    report = {
+        "commit": commit,
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "parameters": {
+            "analysts": args.analysts, "duration": args.duration, "techniques": args.techniques,
+            "export_ratio": args.export_ratio, "seed": args.seed
+        },
+        "results": results
+    }
+
+    os.makedirs(path.dirname(output), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=4)
+
+    print_results(results)
+    print(f"Results saved to {output}")
+
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,332 @@
+# Benchmarks for the expensive parts of the tool. Runs completely offline with synthetic data.
+#
+# Usage:
+#   python benchmarks/run_benchmarks.py [--techniques 1000] [--repeat 3] [--output results.json] [--compare old.json]
+import argparse, json, os, platform, random, shutil, statistics, subprocess, tempfile, time
+from datetime import datetime
+from os import path
+
+import synthetic_data as sd
+
+BENCHMARK_DIR = path.dirname(path.abspath(__file__))
+REPO_DIR = path.dirname(BENCHMARK_DIR)
+
+# Versions of the synthetic upgrade.
+FROM_VERSION = "v17.0"
+TO_VERSION = "v18.0"
+
+
+
+'''
+=====================================================================================
+| Fake response of requests.get() that returns the synthetic JSON files instead of  |
+| downloading them from MITRE.                                                      |
+=====================================================================================
+'''
+class OfflineResponse():
+
+    def __init__(self, data: dict):
+        self.data: dict = data
+        self.status_code: int = 200
+
+
+
+    '''
+    =====================================================================================
+    | Returns the synthetic JSON data.                                                  |
+    =====================================================================================
+    '''
+    def json(self) -> dict:
+        return self.data
+
+
+
+    '''
+    =====================================================================================
+    | The synthetic response never fails.                                               |
+    =====================================================================================
+    '''
+    def raise_for_status(self) -> None:
+        pass
+
+
+
+    '''
+    =====================================================================================
+    | Like requests.Response, a successful response is truthy.                          |
+    =====================================================================================
+    '''
+    def __bool__(self) -> bool:
+        return True
+
+
+
+'''
+=====================================================================================
+| Runs a function several times and returns the timings in seconds.                 |
+| setup() is called before every run and is not measured.                           |
+=====================================================================================
+'''
+def measure(function, repeat: int, setup=None) -> dict:
+    timings = []
+
+    for _ in range(repeat):
+        if setup:
+            setup()
+
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+
+    return {
+        "min": min(timings),
+        "median": statistics.median(timings),
+        "mean": statistics.mean(timings),
+        "runs": timings
+    }
+
+
+
+'''
+=====================================================================================
+| Returns the number of changes whose evaluation has been imported from the         |
+| spreadsheet file. Every row of the synthetic spreadsheet has a client reasoning,  |
+| changes without a row in the file get an empty reasoning.                         |
+=====================================================================================
+'''
+def count_imported_changes(db) -> int:
+    # Imported here, because the DB path of the tool is relative to the working directory.
+    from table_definitions import MITREChange
+    from sqlalchemy import func, select
+
+    return db.scalar(select(func.count()).select_from(MITREChange).where(MITREChange.client_reasoning != ""))
+
+
+
+'''
+=====================================================================================
+| Reads the rows of a spreadsheet file like the tool does (MITRE ID -> row).        |
+=====================================================================================
+'''
+def read_sheet_rows(file_path: str):
+    from xlsx import XLSXHandler
+    from ods import ODSHandler
+
+    handler = XLSXHandler if file_path.endswith(".xlsx") else ODSHandler
+    return handler(file_path=file_path, sheet_name=sd.SHEET_NAME, db=None, read_only=True).rows
+
+
+
+'''
+=====================================================================================
+| Checks that the rows of a synthetic spreadsheet file have matched the expected    |
+| number of techniques. Otherwise the benchmarks would only time the path for       |
+| techniques that are not in the file, e.g. if the MITRE IDs can't be read.         |
+=====================================================================================
+'''
+def check_matched(name: str, matched: int, expected: int) -> None:
+    if matched != expected:
+        raise Exception(f"{name}: {matched} techniques matched the spreadsheet file, but {expected} were expected.")
+
+
+
+'''
+=====================================================================================
+| Returns the current git commit of the repository or None if it's not available.   |
+=====================================================================================
+'''
+def get_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=REPO_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+
+'''
+=====================================================================================
+| Runs all benchmarks in a temporary working directory and returns the results.     |
+| The tool uses the relative folders "db" and "sheets", so nothing in the           |
+| repository is touched.                                                            |
+=====================================================================================
+'''
+def run_benchmarks(techniques: int, repeat: int, seed: int) -> dict:
+    work_dir = tempfile.mkdtemp(prefix="ese-benchmarks-")
+    previous_dir = os.getcwd()
+    os.chdir(work_dir)
+    os.mkdir("db")
+    os.mkdir("sheets")
+
+    # The modules have to be imported after changing the working directory, because the DB path is relative.
+    import helper as hp
+    from table_definitions import MITREChange, SpreadsheetImport, create_tables, get_db_connection
+    from sqlalchemy import delete
+
+    create_tables()
+    db = get_db_connection()
+    results = {}
+
+    # Synthetic changelog and bundle. requests.get() is replaced, so parse_version_changes() runs offline.
+    mitre_ids = sd.generate_mitre_ids(techniques)
+    bundle = sd.generate_bundle(mitre_ids, seed)
+    changelog = sd.generate_changelog(bundle, seed)
+    hp.get = lambda url, **kwargs: OfflineResponse(changelog if url.endswith("changelog.json") else bundle)
+
+    print(f"Benchmarking with {len(mitre_ids)} techniques and sub-techniques in {work_dir}")
+
+    changes = []
+    def parse():
+        changes[:] = hp.parse_version_changes(FROM_VERSION, TO_VERSION)
+    results["parse_version_changes"] = measure(parse, repeat)
+
+    def clear_changes():
+        db.execute(delete(MITREChange))
+        db.commit()
+
+    # Objects can only be added to a session once, so every run inserts fresh copies of the parsed changes.
+    columns = [column.name for column in MITREChange.__table__.columns if column.name != "change_id"]
+    def insert():
+        db.add_all(MITREChange(**{column: getattr(c, column) for column in columns}) for c in changes)
+        db.commit()
+    results["db_insert"] = measure(insert, repeat, setup=clear_changes)
+
+    results["get_changes"] = measure(lambda: hp.get_changes(FROM_VERSION, TO_VERSION, db), repeat)
+
+    # Navigation to the previous and next change for a sample of changes, like clicking through the upgrade.
+    rng = random.Random(seed)
+    sample = rng.sample(hp.get_changes(FROM_VERSION, TO_VERSION, db), min(50, len(changes)))
+    def navigate():
+        for c in sample:
+            hp.get_previous_change(db, c, "All")
+            hp.get_next_change(db, c, "All")
+    results["navigation_prev_next"] = measure(navigate, repeat)
+
+    # Spreadsheets with all techniques except every tenth, so the export has to add rows as well.
+    sheet_ids = [mitre_id for i, mitre_id in enumerate(mitre_ids) if i % 10]
+
+    for file_ext in ("xlsx", "ods"):
+        source = path.join(work_dir, f"source.{file_ext}")
+        sd.generate_sheet(source, sheet_ids, seed)
+
+        file_path = path.join("sheets", f"mitreattck_eval_{FROM_VERSION}_{TO_VERSION}.{file_ext}")
+        other_file_path = path.join("sheets", f"mitreattck_eval_{FROM_VERSION}_{TO_VERSION}.{'ods' if file_ext == 'xlsx' else 'xlsx'}")
+
+        # Every import starts cold: no cached rows and no previous import of the same file.
+        def prepare_import():
+            hp.sheet_cache.clear()
+            db.execute(delete(SpreadsheetImport))
+            db.commit()
+            with open(source, "rb") as src, open(file_path, "wb") as dst:
+                dst.write(src.read())
+            if path.exists(other_file_path):
+                os.remove(other_file_path)
+
+        # Before anything is timed, check that the rows of the file match the techniques in the DB. Only the changes in
+        # the overview are imported and exported (techniques with sub-techniques are not listed).
+        listed_ids = {c.mitre_id for c in hp.get_changes(FROM_VERSION, TO_VERSION, db)}
+        prepare_import()
+        hp.import_file(file_path, FROM_VERSION, TO_VERSION, db)
+        check_matched(f"import_file_{file_ext}", count_imported_changes(db), len(listed_ids & set(sheet_ids)))
+
+        results[f"import_file_{file_ext}"] = measure(
+            lambda: hp.import_file(file_path, FROM_VERSION, TO_VERSION, db), repeat, setup=prepare_import
+        )
+
+        # Re-uploading the identical file.
+        results[f"import_file_{file_ext}_unchanged"] = measure(
+            lambda: hp.import_file(file_path, FROM_VERSION, TO_VERSION, db), repeat
+        )
+
+        # Every tenth technique is edited by the analyst before the export.
+        for c in hp.get_changes(FROM_VERSION, TO_VERSION, db)[::10]:
+            c.client_reasoning = f"Edited {rng.random()}"
+        db.commit()
+
+        # The export must only add the techniques that are not in the file. If the existing rows weren't found, every
+        # technique would be added again.
+        hp.sheet_cache.clear()
+        source_ids = listed_ids.intersection(read_sheet_rows(file_path))
+        export_ids = listed_ids.intersection(read_sheet_rows(hp.export_file(FROM_VERSION, TO_VERSION, db)))
+        check_matched(f"export_file_{file_ext}", len(export_ids) - len(source_ids), len(listed_ids - set(sheet_ids)))
+
+        results[f"export_file_{file_ext}"] = measure(
+            lambda: hp.export_file(FROM_VERSION, TO_VERSION, db), repeat, setup=hp.sheet_cache.clear
+        )
+
+    db.close()
+
+    os.chdir(previous_dir)
+    shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+
+'''
+=====================================================================================
+| Prints the results and, if a previous result file is given, the change of the     |
+| median time of every benchmark.                                                   |
+=====================================================================================
+'''
+def print_results(results: dict, previous: dict | None) -> None:
+    previous_results = previous.get("results", {}) if previous else {}
+
+    for name, result in results.items():
+        line = f"{name:32} median {result['median'] * 1000:10.1f} ms   min {result['min'] * 1000:10.1f} ms"
+
+        if name in previous_results:
+            ratio = result["median"] / previous_results[name]["median"]
+            line += f"   {ratio:6.2f}x vs {previous.get('commit') or 'previous'}"
+
+        print(line)
+
+
+
+'''
+=====================================================================================
+| Parses the arguments, runs the benchmarks and saves the results as JSON.          |
+=====================================================================================
+'''
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks with synthetic ATT&CK data.")
+    parser.add_argument("--techniques", type=int, default=1000, help="Number of techniques (sub-techniques are added).")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of runs per benchmark.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the synthetic data.")
+    parser.add_argument("--output", help="JSON file for the results (default: benchmarks/results/<time>-<commit>.json).")
+    parser.add_argument("--compare", help="JSON file of a previous run to compare against.")
+    args = parser.parse_args()
+
+    commit = get_commit()
+    output = args.output or path.join(
+        BENCHMARK_DIR, "results", f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{commit or 'unknown'}.json"
+    )
+    output = path.abspath(output)
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+
+    results = run_benchmarks(args.techniques, args.repeat, args.seed)
+
+    report = {
+        "commit": commit,
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "parameters": {"techniques": args.techniques, "repeat": args.repeat, "seed": args.seed},
+        "results": results
+    }
+
+    os.makedirs(path.dirname(output), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=4)
+
+    print_results(results, previous)
+    print(f"Results saved to {output}")
+
+
+
+if __name__ == "__main__":
+    main()
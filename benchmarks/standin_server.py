@@ -0,0 +1,198 @@
+# Local stand-in for attack.mitre.org, api.github.com and raw.githubusercontent.com with synthetic data.
+#
+# Usage:
+#   python benchmarks/standin_server.py [--port 8001] [--techniques 1000]
+#
+# Then start the tool against the stand-in server:
+#   ESE_MITRE_BASE_URL=http://localhost:8001 ESE_GITHUB_API_URL=http://localhost:8001 ESE_RAW_GITHUB_URL=http://localhost:8001 python ese.py
+import argparse, json, threading
+from flask import Flask, Response, abort
+from werkzeug.serving import make_server, WSGIRequestHandler
+
+import synthetic_data as sd
+
+# Versions of the synthetic releases. Every version can be upgraded to the next one.
+VERSIONS = ["v16.0", "v16.1", "v17.0", "v18.0"]
+
+# ATT&CK domains -> (share of the techniques, first technique number). Like the real domains, mobile and ICS are much
+# smaller than enterprise and their MITRE IDs don't overlap with enterprise.
+DOMAINS = {"enterprise-attack": (1, 1000), "mobile-attack": (0.25, 10000), "ics-attack": (0.125, 20000)}
+
+
+
+'''
+=====================================================================================
+| Synthetic releases, changelogs and bundles of all domains. Every bundle is        |
+| generated once and kept as serialized JSON, so the stand-in server is never the   |
+| bottleneck of a load test.                                                        |
+=====================================================================================
+'''
+class StandInData():
+
+    def __init__(self, techniques: int, seed: int = 0, versions: list = VERSIONS):
+        self.mitre_ids: dict = { # Domain -> MITRE IDs.
+            domain: sd.generate_mitre_ids(max(1, int(techniques * share)), first=first)
+            for domain, (share, first) in DOMAINS.items()
+        }
+        self.seed: int = seed
+        self.versions: list = versions
+        self.lock = threading.Lock()
+
+        # (version, domain) -> serialized bundle, (from version, to version) -> serialized changelog.
+        self.bundles: dict = {}
+        self.changelogs: dict = {}
+
+
+
+    '''
+    =====================================================================================
+    | Returns the GitHub releases of mitre/cti, newest first like the GitHub API.       |
+    =====================================================================================
+    '''
+    def releases(self) -> bytes:
+        return json.dumps([{"tag_name": f"ATT&CK-{version}"} for version in reversed(self.versions)]).encode()
+
+
+
+    '''
+    =====================================================================================
+    | Returns the bundle of a version and domain or None if it doesn't exist.           |
+    =====================================================================================
+    '''
+    def bundle(self, version: str, domain: str) -> bytes | None:
+        if version not in self.versions or domain not in self.mitre_ids:
+            return None
+
+        with self.lock:
+            if (version, domain) not in self.bundles:
+                self.bundles[(version, domain)] = json.dumps(self.generate_bundle(version, domain)).encode()
+
+            return self.bundles[(version, domain)]
+
+
+
+    '''
+    =====================================================================================
+    | Returns the changelog of all domains between two consecutive versions or None     |
+    | if there's no such upgrade.                                                       |
+    =====================================================================================
+    '''
+    def changelog(self, from_version: str, to_version: str) -> bytes | None:
+        if from_version not in self.versions or to_version not in self.versions:
+            return None
+
+        if self.versions.index(to_version) != self.versions.index(from_version) + 1:
+            return None
+
+        with self.lock:
+            if (from_version, to_version) not in self.changelogs:
+                changelog = {}
+                for domain in self.mitre_ids:
+                    changelog |= sd.generate_changelog(self.generate_bundle(to_version, domain), self.version_seed(to_version), domain)
+
+                self.changelogs[(from_version, to_version)] = json.dumps(changelog).encode()
+
+            return self.changelogs[(from_version, to_version)]
+
+
+
+    '''
+    =====================================================================================
+    | Every version gets its own seed, so the bundles of the versions differ.           |
+    =====================================================================================
+    '''
+    def version_seed(self, version: str) -> int:
+        return self.seed * 1000 + self.versions.index(version)
+
+
+
+    '''
+    =====================================================================================
+    | Generates the bundle of a version and domain.                                     |
+    =====================================================================================
+    '''
+    def generate_bundle(self, version: str, domain: str = "enterprise-attack") -> dict:
+        return sd.generate_bundle(self.mitre_ids[domain], self.version_seed(version))
+
+
+
+'''
+=====================================================================================
+| Creates the Flask app of the stand-in server. The paths are the same as on the    |
+| real servers, so only the base URLs of the tool have to be changed.               |
+=====================================================================================
+'''
+def create_app(data: StandInData) -> Flask:
+    app = Flask(__name__)
+
+    def json_response(body: bytes | None) -> Response:
+        if body is None:
+            abort(404)
+        return Response(body, mimetype="application/json")
+
+    @app.route("/repos/mitre/cti/releases")
+    def releases():
+        return json_response(data.releases())
+
+    @app.route("/docs/changelogs/<from_version>-<to_version>/changelog.json")
+    def changelog(from_version, to_version):
+        return json_response(data.changelog(from_version, to_version))
+
+    @app.route("/mitre-attack/attack-stix-data/master/<domain>/<file_name>")
+    def bundle(domain, file_name):
+        # The file name is <domain>-<version without "v">.json, e.g. mobile-attack-18.0.json.
+        if not file_name.startswith(f"{domain}-") or not file_name.endswith(".json"):
+            abort(404)
+
+        return json_response(data.bundle(f"v{file_name[len(domain) + 1:-5]}", domain))
+
+    return app
+
+
+
+'''
+=====================================================================================
+| Request handler that doesn't log every request, since the load test sends         |
+| thousands of them.                                                                |
+=====================================================================================
+'''
+class QuietRequestHandler(WSGIRequestHandler):
+
+    def log_request(self, *args, **kwargs) -> None:
+        pass
+
+
+
+'''
+=====================================================================================
+| Serves a WSGI app in a background thread. Port 0 picks a free port. Returns the   |
+| server (call shutdown() to stop it) and its base URL.                             |
+=====================================================================================
+'''
+def start_server(app, port: int = 0) -> tuple:
+    server = make_server("127.0.0.1", port, app, threaded=True, request_handler=QuietRequestHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+
+'''
+=====================================================================================
+| Parses the arguments and runs the stand-in server until it's stopped.             |
+=====================================================================================
+'''
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the MITRE and GitHub servers.")
+    parser.add_argument("--port", type=int, default=8001, help="Port of the server.")
+    parser.add_argument("--techniques", type=int, default=1000, help="Number of techniques (sub-techniques are added).")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the synthetic data.")
+    args = parser.parse_args()
+
+    app = create_app(StandInData(args.techniques, args.seed))
+    app.run(host="localhost", port=args.port, threaded=True)
+
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+# Generates synthetic MITRE ATT&CK data and ESE spreadsheets for the benchmarks.
+import json, random, sys
+from os import path
+
+# The benchmarks import the modules of the tool from the parent directory.
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+from constants import *
+from openpyxl import Workbook
+from odf.opendocument import OpenDocumentSpreadsheet
+from odf.table import Table, TableRow, TableCell
+from odf.text import P
+
+TACTICS = [
+    "reconnaissance", "resource-development", "initial-access", "execution", "persistence",
+    "privilege-escalation", "defense-evasion", "credential-access", "discovery", "lateral-movement",
+    "collection", "command-and-control", "exfiltration", "impact"
+]
+PLATFORMS = ["Windows", "Linux", "macOS", "Network", "Containers", "IaaS", "SaaS", "Office Suite", "Identity Provider"]
+WORDS = (
+    "adversaries may abuse the system to execute commands gain access persist escalate privileges evade "
+    "defenses discover information move laterally collect data exfiltrate impact services accounts processes "
+    "credentials network traffic registry files scheduled tasks remote protocols cloud identity"
+).split()
+CHANGE_CATEGORIES = ["major_version_changes", "minor_version_changes", "other_version_changes", "additions"]
+EVALUATION_STATUSES = ["not evaluated", "partial", "completed", "n.a."]
+
+
+
+'''
+=====================================================================================
+| Returns a random text with the given number of words.                             |
+=====================================================================================
+'''
+def random_text(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+
+'''
+=====================================================================================
+| Returns the MITRE IDs of the synthetic techniques. Every fourth technique has     |
+| sub-techniques (e.g. T1003 with T1003.001 and T1003.002). The numbers start at    |
+| first, so the IDs of different domains don't overlap.                             |
+=====================================================================================
+'''
+def generate_mitre_ids(techniques: int, sub_techniques: int = 2, first: int = 1000) -> list:
+    mitre_ids = []
+
+    for i in range(techniques):
+        mitre_id = f"T{first + i}"
+        mitre_ids.append(mitre_id)
+
+        if i % 4 == 0:
+            mitre_ids.extend(f"{mitre_id}.{j:03d}" for j in range(1, sub_techniques + 1))
+
+    return mitre_ids
+
+
+
+'''
+=====================================================================================
+| Returns a STIX attack-pattern object like the ones in enterprise-attack-*.json.   |
+=====================================================================================
+'''
+def generate_attack_pattern(rng: random.Random, mitre_id: str) -> dict:
+    return {
+        "type": "attack-pattern",
+        "id": f"attack-pattern--{mitre_id}",
+        "name": random_text(rng, 3)[:-1],
+        "description": random_text(rng, 80),
+        "kill_chain_phases": [
+            {"kill_chain_name": "mitre-attack", "phase_name": phase}
+            for phase in rng.sample(TACTICS, rng.randint(1, 3))
+        ],
+        "x_mitre_platforms": rng.sample(PLATFORMS, rng.randint(1, 4)),
+        "external_references": [
+            {
+                "source_name": "mitre-attack",
+                "external_id": mitre_id,
+                "url": f"https://attack.mitre.org/techniques/{mitre_id.replace('.', '/')}"
+            }
+        ]
+    }
+
+
+
+'''
+=====================================================================================
+| Returns a synthetic enterprise-attack-*.json bundle with all techniques and       |
+| sub-techniques.                                                                   |
+=====================================================================================
+'''
+def generate_bundle(mitre_ids: list, seed: int = 0) -> dict:
+    rng = random.Random(seed)
+
+    return {
+        "type": "bundle",
+        "id": "bundle--synthetic",
+        "objects": [generate_attack_pattern(rng, mitre_id) for mitre_id in mitre_ids]
+    }
+
+
+
+'''
+=====================================================================================
+| Returns a synthetic changelog.json in which every technique of the bundle has     |
+| been changed. The changes are spread over the change categories and contain a     |
+| detailed_diff with the old and the new description, like the real changelog.      |
+| The techniques are listed under the given domain (e.g. "mobile-attack").          |
+=====================================================================================
+'''
+def generate_changelog(bundle: dict, seed: int = 0, domain: str = "enterprise-attack") -> dict:
+    rng = random.Random(seed)
+    techniques = {category: [] for category in CHANGE_CATEGORIES}
+
+    for i, attack_pattern in enumerate(bundle["objects"]):
+        category = CHANGE_CATEGORIES[i % len(CHANGE_CATEGORIES)]
+        technique = dict(attack_pattern)
+
+        if category != "additions":
+            technique["detailed_diff"] = json.dumps({
+                "values_changed": {
+                    "root['description']": {
+                        "old_value": random_text(rng, 80),
+                        "new_value": attack_pattern["description"]
+                    },
+                    "root['name']": {
+                        "old_value": random_text(rng, 3)[:-1],
+                        "new_value": attack_pattern["name"]
+                    }
+                }
+            })
+
+        if i % 3 == 0:
+            technique["changelog_mitigations"] = {"new": [f"M{1000 + i} {random_text(rng, 4)}"], "dropped": []}
+
+        techniques[category].append(technique)
+
+    return {domain: {"techniques": techniques}}
+
+
+
+'''
+=====================================================================================
+| Returns the 25 values of an evaluated row in the ESE spreadsheet, aligned with    |
+| the column indices in constants.py.                                               |
+=====================================================================================
+'''
+def generate_sheet_row(rng: random.Random, mitre_id: str) -> list:
+    row = [""] * 25
+    row[COL_MITREID] = mitre_id
+    row[2] = rng.choice(TACTICS).replace("-", " ").title()
+    row[3] = random_text(rng, 3)[:-1]
+
+    for criticality, criticality_sum, status, reasoning, measures in [
+        (COL_CLIENT_CRITICALITY, COL_CLIENT_CRITICALITY_SUM, COL_CLIENT_EVALUATION_STATUS, COL_CLIENT_REASONING, COL_CLIENT_MEASURES),
+        (COL_INFRASTRUCTURE_CRITICALITY, COL_INFRASTRUCTURE_CRITICALITY_SUM, COL_INFRASTRUCTURE_EVALUATION_STATUS, COL_INFRASTRUCTURE_REASONING, COL_INFRASTRUCTURE_MEASURES),
+        (COL_SERVICE_CRITICALITY, COL_SERVICE_CRITICALITY_SUM, COL_SERVICE_EVALUATION_STATUS, COL_SERVICE_REASONING, COL_SERVICE_MEASURES)
+    ]:
+        row[criticality] = rng.randint(0, 3)
+        row[criticality_sum] = row[criticality] + rng.randint(0, 3) if row[criticality] else 0
+        row[status] = rng.choice(EVALUATION_STATUSES)
+        row[reasoning] = random_text(rng, 12)
+        row[measures] = random_text(rng, 8)
+
+    for cia in (COL_CONFIDENTIALITY, COL_INTEGRITY, COL_AVAILABILITY):
+        row[cia] = "x" if rng.random() < 0.5 else ""
+
+    return row
+
+
+
+'''
+=====================================================================================
+| Writes a synthetic ESE spreadsheet (.xlsx or .ods) with one evaluated row per     |
+| MITRE ID. Every 50 rows there's an empty row.                                     |
+|                                                                                   |
+| The MITRE IDs are plain values. In the real ESE spreadsheet they are HYPERLINK    |
+| formulas, but Excel stores the value of every formula as well, and the tool reads |
+| these values. openpyxl can't write the values of formulas, so formulas would be   |
+| read as empty cells and no row would match.                                       |
+=====================================================================================
+'''
+def generate_sheet(file_path: str, mitre_ids: list, seed: int = 0) -> None:
+    rng = random.Random(seed)
+    rows = []
+
+    for i, mitre_id in enumerate(mitre_ids):
+        rows.append(generate_sheet_row(rng, mitre_id))
+        if i % 50 == 49:
+            rows.append(None)
+
+    if file_path.endswith(".xlsx"):
+        write_xlsx(file_path, rows)
+    elif file_path.endswith(".ods"):
+        write_ods(file_path, rows)
+    else:
+        raise ValueError(f"Unsupported file type: {file_path}")
+
+
+
+'''
+=====================================================================================
+| Writes the rows to an XLSX file. None is written as an empty row.                 |
+=====================================================================================
+'''
+def write_xlsx(file_path: str, rows: list) -> None:
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.title = SHEET_NAME
+    sheet.append([f"Column {i}" for i in range(25)])
+
+    for row in rows:
+        if row is None:
+            sheet.append([None])
+            continue
+
+        sheet.append([None if value == "" else value for value in row])
+
+    workbook.save(file_path)
+
+
+
+'''
+=====================================================================================
+| Writes the rows to an ODS file. None is written as an empty row. Like files saved |
+| by LibreOffice, every row ends with a repeated empty cell and the sheet ends with |
+| a repeated empty row.                                                             |
+=====================================================================================
+'''
+def write_ods(file_path: str, rows: list) -> None:
+    document = OpenDocumentSpreadsheet()
+    table = Table(name=SHEET_NAME)
+    document.spreadsheet.addElement(table)
+
+    header = TableRow()
+    for i in range(25):
+        header.addElement(create_ods_cell(f"Column {i}"))
+    table.addElement(header)
+
+    for row in rows:
+        table_row = TableRow()
+
+        if row is not None:
+            for value in row:
+                table_row.addElement(create_ods_cell(value))
+
+        table_row.addElement(TableCell(numbercolumnsrepeated=1000))
+        table.addElement(table_row)
+
+    end = TableRow(numberrowsrepeated=1048000)
+    end.addElement(TableCell(numbercolumnsrepeated=1024))
+    table.addElement(end)
+
+    document.save(file_path)
+
+
+
+'''
+=====================================================================================
+| Creates an ODS cell for a number or a text.                                       |
+=====================================================================================
+'''
+def create_ods_cell(value) -> TableCell:
+    cell = TableCell()
+
+    if isinstance(value, int):
+        cell.setAttribute("valuetype", "float")
+        cell.setAttribute("value", value)
+        cell.addElement(P(text=str(value)))
+    elif value:
+        cell.setAttribute("valuetype", "string")
+        cell.addElement(P(text=value))
+
+    return cell
@@ -1,3 +1,5 @@
+import os
+
 # Column indices for the ODS/XLSX file.
 COL_MITREID = 1
 COL_CLIENT_CRITICALITY = 4
@@ -18,4 +20,36 @@ COL_SERVICE_CRITICALITY_SUM = 20
 COL_SERVICE_EVALUATION_STATUS = 21
 COL_SERVICE_REASONING = 23
 COL_SERVICE_MEASURES = 24
-SHEET_NAME = "MITRE ATT&CK"
\ No newline at end of file
+SHEET_NAME = "MITRE ATT&CK"
+
+# Base URLs of the MITRE website, the GitHub API and raw.githubusercontent.com. They can be changed with the environment
+# variables ESE_MITRE_BASE_URL, ESE_GITHUB_API_URL and ESE_RAW_GITHUB_URL, e.g. to use the local stand-in server of the load test.
+MITRE_BASE_URL = os.environ.get("ESE_MITRE_BASE_URL", "https://attack.mitre.org").rstrip("/")
+GITHUB_API_URL = os.environ.get("ESE_GITHUB_API_URL", "https://api.github.com").rstrip("/")
+RAW_GITHUB_URL = os.environ.get("ESE_RAW_GITHUB_URL", "https://raw.githubusercontent.com").rstrip("/")
+
+# ATT&CK domains that can be ingested (key in the changelog and name of the bundle -> display name).
+DOMAINS = {"enterprise-attack": "Enterprise", "mobile-attack": "Mobile", "ics-attack": "ICS"}
+DEFAULT_DOMAIN = "enterprise-attack"
+
+# Maximum size of an uploaded spreadsheet file in bytes. Can be changed with the environment variable ESE_MAX_UPLOAD_SIZE.
+MAX_UPLOAD_SIZE = int(os.environ.get("ESE_MAX_UPLOAD_SIZE", 50 * 1024 * 1024))
+
+# Names of the exported columns, e.g. for the report of the changed cells.
+COLUMN_NAMES = {
+    COL_CLIENT_CRITICALITY: "Client Criticality",
+    COL_CLIENT_EVALUATION_STATUS: "Client Evaluation Status",
+    COL_CLIENT_REASONING: "Client Reasoning",
+    COL_CLIENT_MEASURES: "Client Measures",
+    COL_INFRASTRUCTURE_CRITICALITY: "Infrastructure Criticality",
+    COL_INFRASTRUCTURE_EVALUATION_STATUS: "Infrastructure Evaluation Status",
+    COL_INFRASTRUCTURE_REASONING: "Infrastructure Reasoning",
+    COL_INFRASTRUCTURE_MEASURES: "Infrastructure Measures",
+    COL_SERVICE_CRITICALITY: "Service Criticality",
+    COL_SERVICE_EVALUATION_STATUS: "Service Evaluation Status",
+    COL_SERVICE_REASONING: "Service Reasoning",
+    COL_SERVICE_MEASURES: "Service Measures",
+    COL_CONFIDENTIALITY: "Confidentiality",
+    COL_INTEGRITY: "Integrity",
+    COL_AVAILABILITY: "Availability"
+}
@@ -3,15 +3,21 @@
 | IMPORTS                                                                           |
 =====================================================================================
 '''
-from flask import Flask, render_template, request, abort, url_for, jsonify, send_file
+from flask import Flask, Response, render_template, request, abort, url_for, jsonify, send_file
 from sqlalchemy import select
 from markdown import markdown
 from table_definitions import *
 import helper as hp
 from pathlib import Path
 from os import path
+from multiprocessing import current_process, freeze_support
 from ods import ODSException
 from xlsx import XLSXException
+from export_jobs import ExportJobs
+from metrics import metrics, METRICS_ENABLED
+from query_monitor import query_monitor, QUERY_DEBUG_ENABLED
+from snapshot import SnapshotException, export_snapshot, import_snapshot, get_snapshot_filename
+import maintenance
 
 
 
@@ -26,16 +32,33 @@ app = Flask(
     static_folder=hp.get_resource_path("static")
 )
 
+# The ingestion parses the ATT&CK domains in worker processes (see helper.parse_version_changes()).
+# The executable created with PyInstaller starts itself again for every worker, freeze_support() then runs the worker
+# instead of the tool.
+if __name__ == "__main__":
+    freeze_support()
+
 # Create 'db' folder if it doesn't exist and 'sheets' for uploaded XLSX/ODS files.
 Path("db").mkdir(exist_ok=True)
 Path("sheets").mkdir(exist_ok=True)
 
 # Get a DB session object and create all tables in the DB if not already happened.
-db = get_db_connection()
-create_tables()
+# The Flask server handles requests in several threads, so every thread uses its own session.
+db = get_scoped_db_connection()
+
+# Exports run in background threads, so large files don't block the request.
+export_jobs = ExportJobs()
 
-# Get all versions and check if any new versions are released.
-app.config["new_versions"] = hp.get_mitre_versions_api(db)
+# The worker processes import this module again, but only need the helper functions. So the DB is only set up and
+# new versions are only fetched in the main process.
+if current_process().name == "MainProcess":
+    create_tables()
+
+    # Get all versions and check if any new versions are released.
+    app.config["new_versions"] = hp.get_mitre_versions_api(db)
+
+# Uploads that are bigger than this are rejected before they are read.
+app.config["MAX_CONTENT_LENGTH"] = hp.MAX_UPLOAD_SIZE
 
 # Disable caching so the page is always reloaded and shows the most recent data.
 # Else, if you change the status of a Change and go back to Overview, the change is not directly shown due to caching.
@@ -49,6 +72,30 @@ def add_header(response):
 
 
 
+'''
+=====================================================================================
+| Returns a JSON message if an uploaded file is bigger than MAX_UPLOAD_SIZE, so the |
+| frontend can show the error like any other upload error.                          |
+=====================================================================================
+'''
+@app.errorhandler(413)
+def file_too_large(error):
+    return jsonify({"message": f"The file is too large. The maximum size is {hp.MAX_UPLOAD_SIZE // (1024 * 1024)} MB."}), 413
+
+
+
+'''
+=====================================================================================
+| Closes the session of the request thread after every request. Uncommitted changes |
+| of a failed request are rolled back, so they don't leak into the next request.    |
+=====================================================================================
+'''
+@app.teardown_appcontext
+def remove_db_session(exception):
+    db.remove()
+
+
+
 '''
 =====================================================================================
 | Custom Jinja filter for parsing Markdown text.                                    |
@@ -85,7 +132,9 @@ def homepage():
         "homepage.html",
         title="Home",
         versions=versions,
-        upgrades=upgrades
+        upgrades=upgrades,
+        domains=hp.DOMAINS,
+        default_domain=hp.DEFAULT_DOMAIN
     )
 
 
@@ -93,15 +142,21 @@ def homepage():
 '''
 =====================================================================================
 | This function initialises an upgrade by:                                          |
-| - Getting all the changes from the JSON changelog on the MITRE website.           |
+| - Getting all the changes from the JSON changelog on the MITRE website for the    |
+|   selected ATT&CK domains (enterprise, mobile, ICS).                              |
 | - Parsing the JSON file.                                                          |
 | - Storing all changes to database to be able to track the progress.               |
+| - Optionally copying the evaluations of the most recent completed upgrade.        |
 =====================================================================================
 '''
 @app.route("/upgrade/initiate", methods=['POST'])
 def initiate_upgrade():
-    # Get the user selected version.
+    # Get the user selected version and ATT&CK domains.
     version_select = request.form.get("version_select")
+    domains = request.form.getlist("domains") or [hp.DEFAULT_DOMAIN]
+
+    if any(domain not in hp.DOMAINS for domain in domains):
+        return jsonify({"message": "Unknown ATT&CK domain."}), 400
 
     # If the current upgrade is already in progress, don't fetch the data again.
     if hp.upgrade_exists(version_select, db):
@@ -112,7 +167,7 @@ def initiate_upgrade():
         from_version, to_version = hp.get_versions_db(version_select, db)
 
         # If the current upgrade does not exist, get it from the MITRE site, parse it and store it in the DB.
-        result = hp.parse_version_changes(from_version.name, to_version.name)
+        result = hp.parse_version_changes(from_version.name, to_version.name, domains)
     except Exception as e:
         return jsonify({"message": str(e)}), 400
     
@@ -121,9 +176,23 @@ def initiate_upgrade():
         db.add(c)
 
     db.commit()
+
+    # Store the tactics and platforms of the new changes for filtering.
+    fill_missing_facet_rows()
+
+    # Optionally copy the evaluations of the most recent completed upgrade to the new upgrade.
+    carried_forward = ""
+    if request.form.get("carry_forward"):
+        source = hp.get_latest_completed_upgrade(from_version, db)
+
+        if source:
+            copied = hp.carry_forward_evaluations(from_version.name, to_version.name, source[0], source[1], db)
+            carried_forward = f" Copied the evaluations of {copied} techniques from {source[0]} to {source[1]}."
+        else:
+            carried_forward = " There is no completed upgrade to copy the evaluations from."
     
     return jsonify({
-        "message": f"Successfully got the changelog from {from_version.name} to {to_version.name}. Click <a href=\"{url_for("upgrade", from_version=from_version.name, to_version=to_version.name)}\" target=\"_blank\">Link</a> to continue.",
+        "message": f"Successfully got the changelog from {from_version.name} to {to_version.name}.{carried_forward} Click <a href=\"{url_for("upgrade", from_version=from_version.name, to_version=to_version.name)}\" target=\"_blank\">Link</a> to continue.",
         "url": url_for("upgrade", from_version=from_version.name, to_version=to_version.name),
         "url_text": f"{from_version.name} to {to_version.name}"
     }), 200
@@ -289,10 +358,8 @@ def change_classification():
     elif target == "availability":
         change.availability = not change.availability
 
-    # After each change, calculate the sums again.
-    change.client_criticality_sum = hp.client_sum(change)
-    change.infra_criticality_sum = hp.infra_sum(change)
-    change.service_criticality_sum = hp.service_sum(change)
+    # After each change, calculate the sums again. The pending changes are flushed before the UPDATE.
+    hp.recalculate_sums(db, from_version, to_version, mitre_id)
     db.commit()
 
     return jsonify({
@@ -327,12 +394,12 @@ def upload_file():
 
     # Import the file into the DB.
     try:
-        hp.import_file(file_path, from_version, to_version, db)
+        imported = hp.import_file(file_path, from_version, to_version, db)
     except Exception as e:
         return jsonify({"message": str(e)}), 400
     
     return jsonify({
-        "message": "Successfully loaded and read file. Database is updated. Refresh the site to see the changes."
+        "message": f"Successfully loaded and read file. {imported} techniques have been updated. Refresh the site to see the changes."
     }), 200
 
 
@@ -340,8 +407,9 @@ def upload_file():
 '''
 =====================================================================================
 | Handles the export of the SQLite database. All changes are exported to their      |
-| respective spreadsheet file (.ods or .xlsx). When the export file is created      |
-| a download link is returned to the user.                                          |
+| respective spreadsheet file (.ods or .xlsx). The export runs in the background,   |
+| so the ID of the export job is returned immediately. The frontend then polls the  |
+| status of the job and gets the download link once the file has been created.      |
 =====================================================================================
 '''
 @app.route("/api/export-file", methods=['POST'])
@@ -350,26 +418,70 @@ def export_file():
     from_version = data.get("from_version")
     to_version = data.get("to_version")
 
-    # Export spreadsheet file of a specific upgrade.
-    try:
-        hp.export_file(from_version, to_version, db)
-    except (XLSXException, ODSException) as e:
-        return jsonify({"message": str(e)}), 400
+    if not hp.get_spreadsheet_filename(from_version, to_version):
+        return jsonify({"message": "Please upload a spreadsheet file before exporting."}), 400
+
+    # Start the export of the upgrade (or get the export that is already running).
+    job = export_jobs.start(from_version, to_version)
 
     return jsonify({
-        "message": "File has been successfully exported.",
+        "message": "Export has been started.",
+        "job_id": job.job_id,
+        "status_url": url_for('export_status', job_id=job.job_id),
         "download_url": url_for('download_exported_file', from_version=from_version, to_version=to_version)
-    })
+    }), 202
+
+
+
+'''
+=====================================================================================
+| Returns the status and the progress of an export job.                             |
+=====================================================================================
+'''
+@app.route("/api/export-status/<job_id>")
+def export_status(job_id):
+    job = export_jobs.get(job_id)
+
+    if not job:
+        abort(404)
+
+    status = job.to_dict()
+    if job.status == "done":
+        status["download_url"] = url_for('download_exported_file', from_version=job.from_version, to_version=job.to_version)
+        status["report_url"] = url_for('export_report', from_version=job.from_version, to_version=job.to_version)
+
+    return jsonify(status), 200
+
+
+
+'''
+=====================================================================================
+| Returns a "changes only" report: all cells that the export changes compared to    |
+| the imported spreadsheet file.                                                    |
+=====================================================================================
+'''
+@app.route("/api/export-report/<from_version>-<to_version>")
+def export_report(from_version, to_version):
+    try:
+        report = hp.get_export_report(from_version, to_version, db)
+    except Exception as e:
+        return jsonify({"message": str(e)}), 400
+
+    return jsonify({"changes": report}), 200
 
 
 
 '''
 =====================================================================================
 | Returns the exported file to the user for download.                               |
+| While an export of the upgrade is running, the previous export is not returned.   |
 =====================================================================================
 '''
 @app.route("/api/download-file/<from_version>-<to_version>")
 def download_exported_file(from_version, to_version):
+    if export_jobs.is_running(from_version, to_version):
+        return jsonify({"message": "The export is still running."}), 409
+
     file = Path(path.join("sheets", f"EXPORT_{hp.get_spreadsheet_filename(from_version, to_version)}"))
 
     if (not file.exists()):
@@ -449,6 +561,263 @@ def change_reasoning_and_measures():
 
 
 
+'''
+=====================================================================================
+| Shows how a technique has changed across all upgrades and how it has been         |
+| evaluated in every upgrade.                                                       |
+=====================================================================================
+'''
+@app.route("/technique/<mitre_id>")
+def technique_history(mitre_id):
+    history = hp.get_technique_history(mitre_id, db)
+
+    if not history:
+        abort(404)
+
+    return render_template(
+        "technique.html",
+        title=f"{mitre_id} History",
+        mitre_id=mitre_id,
+        history=history
+    )
+
+
+
+'''
+=====================================================================================
+| Returns the history of a technique across all upgrades as JSON.                   |
+=====================================================================================
+'''
+@app.route("/api/technique/<mitre_id>/history")
+def technique_history_api(mitre_id):
+    history = hp.get_technique_history(mitre_id, db)
+
+    if not history:
+        return jsonify({"message": f"{mitre_id} is not part of any upgrade."}), 404
+
+    return jsonify({"mitre_id": mitre_id, "history": history}), 200
+
+
+
+'''
+=====================================================================================
+| Full-text search over the descriptions, reasoning and measures of all changes.    |
+| Parameters: q (search text), from_version and to_version (optional, limit the     |
+| search to an upgrade) and limit (default 50, max. 200).                           |
+=====================================================================================
+'''
+@app.route("/api/search")
+def search():
+    search_text = request.args.get("q", "").strip()
+    from_version = request.args.get("from_version") or None
+    to_version = request.args.get("to_version") or None
+
+    if not search_text:
+        return jsonify({"message": "Please enter a search term."}), 400
+
+    try:
+        limit = min(max(int(request.args.get("limit", 50)), 1), 200)
+    except ValueError:
+        return jsonify({"message": "Invalid limit."}), 400
+
+    try:
+        results = hp.search_changes(db, search_text, from_version, to_version, limit)
+    except Exception as e:
+        return jsonify({"message": f"Search failed: {e}"}), 400
+
+    # Link to the change page of every result.
+    for result in results:
+        result["url"] = url_for("change", from_version=result["from_version"], to_version=result["to_version"], mitre_id=result["mitre_id"])
+
+    return jsonify({"results": results}), 200
+
+
+
+'''
+=====================================================================================
+| Returns the changes of an upgrade filtered by tactic, platform, category, status  |
+| and criticality together with the facet counts, e.g.                              |
+| /api/facets/v17.0-v18.0?tactic=Execution&tactic=Persistence&platform=Linux        |
+=====================================================================================
+'''
+@app.route("/api/facets/<from_version>-<to_version>")
+def facets(from_version, to_version):
+    filters = {facet: request.args.getlist(facet) for facet in ("tactic", "platform", "category", "status", "domain", "criticality")}
+
+    try:
+        result = hp.get_faceted_changes(from_version, to_version, filters, db)
+    except ValueError:
+        return jsonify({"message": "Invalid criticality."}), 400
+
+    for change in result["changes"]:
+        change["url"] = url_for("change", from_version=from_version, to_version=to_version, mitre_id=change["mitre_id"])
+
+    return jsonify(result), 200
+
+
+
+'''
+=====================================================================================
+| Streams a compressed snapshot of an upgrade (changes, evaluations and status) for |
+| download. The snapshot can be imported on another machine with /api/snapshot.     |
+=====================================================================================
+'''
+@app.route("/api/snapshot/<from_version>-<to_version>")
+def download_snapshot(from_version, to_version):
+    exists = db.execute(
+        select(MITREChange.change_id) \
+        .where(MITREChange.from_version == from_version, MITREChange.to_version == to_version) \
+        .limit(1)
+    ).first()
+
+    if not exists:
+        abort(404)
+
+    return Response(
+        export_snapshot(from_version, to_version),
+        mimetype="application/gzip",
+        headers={"Content-Disposition": f"attachment; filename={get_snapshot_filename(from_version, to_version)}"}
+    )
+
+
+
+'''
+=====================================================================================
+| Imports a snapshot of an upgrade. An existing upgrade is only replaced if the     |
+| form field "replace" is set.                                                      |
+=====================================================================================
+'''
+@app.route("/api/snapshot", methods=['POST'])
+def upload_snapshot():
+    file = request.files.get("file")
+
+    if not file:
+        return jsonify({"message": "Please select a snapshot file."}), 400
+
+    try:
+        from_version, to_version, imported = import_snapshot(file.stream, replace=bool(request.form.get("replace")))
+    except SnapshotException as e:
+        return jsonify({"message": str(e)}), 400
+
+    return jsonify({
+        "message": f"Successfully imported {imported} changes from {from_version} to {to_version}.",
+        "url": url_for("upgrade", from_version=from_version, to_version=to_version)
+    }), 200
+
+
+
+'''
+=====================================================================================
+| Returns the DB size, the row counts of all upgrades and the archived upgrades.    |
+=====================================================================================
+'''
+@app.route("/api/maintenance")
+def maintenance_report():
+    return jsonify(maintenance.get_database_report()), 200
+
+
+
+'''
+=====================================================================================
+| Archives an upgrade (from_version and to_version) or, if no upgrade is given, all |
+| finished upgrades except the most recent one ("all": true archives it as well).   |
+| Unfinished upgrades are only archived with "force": true.                         |
+=====================================================================================
+'''
+@app.route("/api/maintenance/archive", methods=['POST'])
+def maintenance_archive():
+    data = request.get_json(silent=True) or {}
+    from_version = data.get("from_version")
+    to_version = data.get("to_version")
+
+    # The session of this request must not hold the DB while the changes are deleted.
+    db.remove()
+
+    try:
+        if from_version and to_version:
+            maintenance.archive_upgrade(from_version, to_version, bool(data.get("force")))
+            archived = [(from_version, to_version)]
+        else:
+            archived = maintenance.archive_finished_upgrades(keep_latest=not data.get("all"))
+    except (maintenance.MaintenanceException, SnapshotException) as e:
+        return jsonify({"message": str(e)}), 400
+
+    return jsonify({
+        "message": f"Archived {len(archived)} upgrades.",
+        "archived": [{"from_version": f, "to_version": t} for f, t in archived],
+        "report": maintenance.get_database_report()
+    }), 200
+
+
+
+'''
+=====================================================================================
+| Loads an archived upgrade (from_version and to_version) back into the DB.         |
+=====================================================================================
+'''
+@app.route("/api/maintenance/restore", methods=['POST'])
+def maintenance_restore():
+    data = request.get_json(silent=True) or {}
+    from_version = data.get("from_version")
+    to_version = data.get("to_version")
+
+    db.remove()
+
+    try:
+        restored = maintenance.restore_upgrade(from_version, to_version)
+    except (maintenance.MaintenanceException, SnapshotException) as e:
+        return jsonify({"message": str(e)}), 400
+
+    return jsonify({
+        "message": f"Restored {restored} changes from {from_version} to {to_version}.",
+        "url": url_for("upgrade", from_version=from_version, to_version=to_version)
+    }), 200
+
+
+
+'''
+=====================================================================================
+| Runs ANALYZE, PRAGMA optimize and VACUUM and returns the DB size before and       |
+| after.                                                                            |
+=====================================================================================
+'''
+@app.route("/api/maintenance/optimize", methods=['POST'])
+def maintenance_optimize():
+    # VACUUM fails while this thread holds an open transaction.
+    db.remove()
+
+    try:
+        sizes = maintenance.optimize_database()
+    except Exception as e:
+        return jsonify({"message": f"Optimizing the DB failed: {e}"}), 400
+
+    return jsonify(sizes), 200
+
+
+
+'''
+=====================================================================================
+| Optional instrumentation (ESE_METRICS=1): timings of requests, SQL queries,       |
+| templates and helper functions in the Server-Timing header and on /metrics.       |
+| Has to happen after all routes and filters are registered.                        |
+=====================================================================================
+'''
+if METRICS_ENABLED:
+    metrics.instrument(app, engine, hp)
+
+
+
+'''
+=====================================================================================
+| Optional query checks for development and CI (ESE_QUERY_DEBUG=1): slow-query log  |
+| with query plans, N+1 detection and query budgets per endpoint.                   |
+=====================================================================================
+'''
+if QUERY_DEBUG_ENABLED:
+    query_monitor.instrument(app, engine)
+
+
+
 '''
 =====================================================================================
 | Start the flask server in debug mode and on port 8000.                            |
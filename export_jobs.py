@@ -0,0 +1,141 @@
+# Background jobs for exporting spreadsheet files.
+from table_definitions import get_db_connection
+import helper as hp
+import threading, uuid
+
+
+
+'''
+=====================================================================================
+| A single export of an upgrade that runs in a background thread.                   |
+| The progress is updated by the export functions while the job is running.         |
+=====================================================================================
+'''
+class ExportJob():
+
+    def __init__(self, from_version: str, to_version: str):
+        self.job_id: str = uuid.uuid4().hex
+        self.from_version: str = from_version
+        self.to_version: str = to_version
+
+        # "running", "done" or "failed".
+        self.status: str = "running"
+
+        # "rows" while the rows are written, "saving" while the file is written to disk.
+        self.phase: str = "rows"
+        self.rows_processed: int = 0
+        self.rows_total: int = 0
+        self.message: str = ""
+
+
+
+    '''
+    =====================================================================================
+    | Callback for the export functions. Updates the progress of the job.               |
+    =====================================================================================
+    '''
+    def update_progress(self, rows_processed: int, rows_total: int, phase: str) -> None:
+        self.rows_processed = rows_processed
+        self.rows_total = rows_total
+        self.phase = phase
+
+
+
+    '''
+    =====================================================================================
+    | Exports the upgrade. Runs in its own thread with its own DB session, since a      |
+    | session must not be shared between threads.                                       |
+    =====================================================================================
+    '''
+    def run(self) -> None:
+        db = get_db_connection()
+
+        try:
+            hp.export_file(self.from_version, self.to_version, db, progress=self.update_progress)
+            self.status = "done"
+            self.message = "File has been successfully exported."
+        except Exception as e:
+            self.status = "failed"
+            self.message = str(e)
+        finally:
+            db.close()
+
+
+
+    '''
+    =====================================================================================
+    | Returns the progress of the job as a dictionary for the frontend.                 |
+    =====================================================================================
+    '''
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "phase": self.phase,
+            "rows_processed": self.rows_processed,
+            "rows_total": self.rows_total,
+            "message": self.message
+        }
+
+
+
+'''
+=====================================================================================
+| Keeps track of all export jobs.                                                   |
+| There's at most one running job per upgrade. Exports of different upgrades run    |
+| at the same time, each one writes to its own temporary file (see                  |
+| helper.export_file()).                                                            |
+=====================================================================================
+'''
+class ExportJobs():
+
+    def __init__(self):
+        self.jobs: dict = {} # Job ID -> ExportJob.
+        self.latest: dict = {} # (from_version, to_version) -> latest ExportJob of the upgrade.
+        self.lock = threading.Lock()
+
+
+
+    '''
+    =====================================================================================
+    | Starts a new export of an upgrade. If an export of the upgrade is already         |
+    | running (e.g. the user clicked the button twice), the running job is returned.    |
+    =====================================================================================
+    '''
+    def start(self, from_version: str, to_version: str) -> ExportJob:
+        with self.lock:
+            job = self.latest.get((from_version, to_version))
+            if job and job.status == "running":
+                return job
+
+            # Only the latest job of an upgrade is kept.
+            if job:
+                del self.jobs[job.job_id]
+
+            job = ExportJob(from_version, to_version)
+            self.jobs[job.job_id] = job
+            self.latest[(from_version, to_version)] = job
+
+        threading.Thread(target=job.run, daemon=True).start()
+        return job
+
+
+
+    '''
+    =====================================================================================
+    | Returns a job by its ID or None if the job doesn't exist.                         |
+    =====================================================================================
+    '''
+    def get(self, job_id: str) -> ExportJob | None:
+        return self.jobs.get(job_id)
+
+
+
+    '''
+    =====================================================================================
+    | Checks if an export of an upgrade is currently running.                           |
+    =====================================================================================
+    '''
+    def is_running(self, from_version: str, to_version: str) -> bool:
+        job = self.latest.get((from_version, to_version))
+        return job is not None and job.status == "running"
@@ -1,16 +1,20 @@
 from table_definitions import *
-from sqlalchemy import select, asc
+from sqlalchemy import select, asc, desc, text, update, func, case
 from sqlalchemy.orm import Session
 from requests import get
 from glom import glom
-import json, re, zipfile, sys
+import difflib, html, json, multiprocessing, os, re, tempfile, zipfile, sys
+from concurrent.futures import ProcessPoolExecutor
 from os import path
 from pathlib import Path
 from werkzeug.datastructures import FileStorage
 from constants import *
 from ods import *
 from xlsx import *
-from io import BytesIO
+from sheet_cache import sheet_cache, hash_rows
+from row_store import RowStore
+from typing import Callable
+from datetime import datetime
 
 
 
@@ -35,20 +39,21 @@ def get_resource_path(relative_path):
 
 '''
 =====================================================================================
-| This function parses the JSON changelog and fills all fields of the MITREChange   |
-| object. The function then returns a list of MITREChange objects.                  |
+| This function gets the JSON changelog and parses the changed techniques of all    |
+| given ATT&CK domains (see constants.DOMAINS). The function then returns a list of |
+| MITREChange objects.                                                              |
+|                                                                                   |
+| Every domain has its own bundle, which is downloaded and parsed in its own worker |
+| process, so the smaller mobile and ICS domains add almost no time to the          |
+| enterprise domain. A single domain (or all domains on a machine with one CPU) is  |
+| parsed in this process, since a worker would only add its start-up time.          |
 =====================================================================================
 '''
-def parse_version_changes(from_version: str, to_version: str) -> list:
-    result = []
+def parse_version_changes(from_version: str, to_version: str, domains: tuple = (DEFAULT_DOMAIN,)) -> list:
     try:
-        changelog = get(f"https://attack.mitre.org/docs/changelogs/{from_version}-{to_version}/changelog.json", timeout=10)
+        changelog = get(f"{MITRE_BASE_URL}/docs/changelogs/{from_version}-{to_version}/changelog.json", timeout=10)
         changelog.raise_for_status()
-
-        # Get the whole Enterprise attack matrix.
-        attack_data = get(f"https://raw.githubusercontent.com/mitre-attack/attack-stix-data/master/enterprise-attack/enterprise-attack-{to_version[1:]}.json", timeout=10)
-        attack_data.raise_for_status()
-        attack_data = attack_data.json()
+        changelog = changelog.json()
     except:
         raise Exception("Request failed or timed out. Try again later.")
 
@@ -56,13 +61,64 @@ def parse_version_changes(from_version: str, to_version: str) -> list:
     if not changelog:
         raise Exception("Version not supported!")
 
-    # Get all modified enterprise techniques from the changelog if available.
-    modified_techniques = glom(changelog.json(), "enterprise-attack.techniques", default=None)
+    # Get all modified techniques of each domain from the changelog if available.
+    jobs = []
+    for domain in domains:
+        modified_techniques = glom(changelog, f"{domain}.techniques", default=None)
+
+        if modified_techniques:
+            bundle_url = f"{RAW_GITHUB_URL}/mitre-attack/attack-stix-data/master/{domain}/{domain}-{to_version[1:]}.json"
+            jobs.append((domain, modified_techniques, from_version, to_version, bundle_url))
 
     # If no changes were made.
-    if not modified_techniques:
+    if not jobs:
         raise Exception("No changes to any techniques.")
 
+    # Worker processes only pay off if there are several domains and several CPUs.
+    if len(jobs) == 1 or (os.cpu_count() or 1) < 2:
+        results = [parse_domain_changes(*job) for job in jobs]
+    else:
+        # "spawn" instead of "fork", since the Flask server runs several threads. Windows only supports "spawn" anyway.
+        with ProcessPoolExecutor(max_workers=min(len(jobs), os.cpu_count()), mp_context=multiprocessing.get_context("spawn")) as executor:
+            results = list(executor.map(parse_domain_changes, *zip(*jobs)))
+
+    return [MITREChange(**change) for changes in results for change in changes]
+
+
+
+'''
+=====================================================================================
+| Downloads the bundle of a domain and parses the changed techniques of the domain. |
+| Fills all fields of a MITREChange object for each technique and returns them as   |
+| dicts, so they can be sent back from a worker process.                            |
+=====================================================================================
+'''
+def parse_domain_changes(domain: str, modified_techniques: dict, from_version: str, to_version: str, bundle_url: str) -> list:
+    result = []
+    try:
+        # Get the whole attack matrix of the domain.
+        attack_data = get(bundle_url, timeout=10)
+        attack_data.raise_for_status()
+        attack_data = attack_data.json()
+    except:
+        raise Exception("Request failed or timed out. Try again later.")
+
+    # Index the techniques and sub-techniques (attack patterns) of the bundle by MITRE ID once. The bundle contains
+    # thousands of objects (mitigations, relationships, ...), so they aren't searched again for every changed technique.
+    attack_patterns = {}
+    sub_technique_counts = {}
+    for object in attack_data.get("objects", []):
+        if object.get("type") != "attack-pattern":
+            continue
+
+        external_ids = {ref.get("external_id") or "" for ref in object.get("external_references", [])}
+        for external_id in external_ids:
+            attack_patterns.setdefault(external_id, object)
+
+        # A sub-technique (e.g. T1003.001) is counted for its parent technique (T1003).
+        for parent_id in {external_id.split(".")[0] for external_id in external_ids if "." in external_id}:
+            sub_technique_counts[parent_id] = sub_technique_counts.get(parent_id, 0) + 1
+
     # Parse the JSON file.
     # The techniques in the changelog are categorized (e.g. major change, addition, deletion, minor change, ...).
     # Iterate through all categories.
@@ -113,50 +169,37 @@ def parse_version_changes(from_version: str, to_version: str) -> list:
             # If sub-technique, get the name of the parent technique.
             if "." in mitre_id:
                 parent_id = mitre_id.split('.')[0]
-                parent_technique = next(
-                    (
-                        # Iterate over all objects (e.g. mitigations, techniques, sub-techniques, ...)
-                        object for object in attack_data.get("objects")
-                        
-                        # Only select techniques and sub-techniques...
-                        if object.get("type") == "attack-pattern"
-                        
-                        # ...and the technique that has the parent_id.
-                        and any(ref.get("external_id") == parent_id for ref in object.get("external_references", []))
-                    ), {})
+                parent_technique = attack_patterns.get(parent_id, {})
                 
                 technique_name = parent_technique.get("name", "")
                 sub_technique_name = technique.get("name")
 
                 # Sub-Techniques don't have any further sub-techniques.
-                sub_techniques = []
+                nr_sub_techniques = 0
             
             # If not a sub-technique.
             else:
                 technique_name = technique.get("name")
                 sub_technique_name = ""
                 # Check if a parent technique has any sub-techniques.
-                sub_techniques = [
-                    object for object in attack_data.get("objects", [])
-                    if object.get("type") == "attack-pattern"
-                    and any(f"{mitre_id}." in ref.get("external_id", "") for ref in object.get("external_references", []))
-                ]
+                nr_sub_techniques = sub_technique_counts.get(mitre_id, 0)
 
             # Fill out all necessary fields of the MITREChange object.
-            change = MITREChange(
+            change = dict(
                 mitre_id = mitre_id,
                 url = url,
                 tactics = tactics,
                 technique = technique_name,
                 sub_technique = sub_technique_name,
-                nr_sub_techniques = len(sub_techniques),
+                nr_sub_techniques = nr_sub_techniques,
                 old_description = old_description,
                 new_description = new_description,
                 other_changes = other_changes,
                 change_category = change_category,
                 from_version = from_version,
                 to_version = to_version,
-                platforms = platforms
+                platforms = platforms,
+                domain = domain
             )
 
             result.append(change)
@@ -229,6 +272,60 @@ def upgrade_exists(from_version: str, db: Session) -> bool:
 
 
 
+'''
+=====================================================================================
+| Returns the most recent completed upgrade (all changes "Done") up to the version  |
+| current_version as (from_version, to_version), or None if there's no such         |
+| upgrade.                                                                          |
+=====================================================================================
+'''
+def get_latest_completed_upgrade(current_version: MITREVersion, db: Session) -> tuple[str, str] | None:
+    row = db.execute(
+        select(MITREChange.from_version, MITREChange.to_version) \
+        .join(MITREVersion, MITREVersion.name == MITREChange.to_version) \
+        .where(
+            (MITREVersion.major < current_version.major) |
+            ((MITREVersion.major == current_version.major) & (MITREVersion.minor <= current_version.minor))
+        ) \
+        .group_by(MITREChange.from_version, MITREChange.to_version, MITREVersion.major, MITREVersion.minor) \
+        .having(func.sum(case((MITREChange.status != "Done", 1), else_=0)) == 0) \
+        .order_by(desc(MITREVersion.major), desc(MITREVersion.minor)) \
+        .limit(1)
+    ).first()
+
+    return (row[0], row[1]) if row else None
+
+
+
+'''
+=====================================================================================
+| Copies the evaluations (criticality, CIA, reasoning, measures, ...) of an earlier |
+| upgrade to the changes of a new upgrade with the same MITRE ID. This is done with |
+| a single UPDATE ... FROM statement in the DB, so no spreadsheet file has to be    |
+| exported and imported again. Returns the number of changes that were updated.     |
+=====================================================================================
+'''
+def carry_forward_evaluations(from_version: str, to_version: str, source_from_version: str, source_to_version: str, db: Session) -> int:
+    target = MITREChange.__table__
+    source = target.alias("source")
+
+    result = db.execute(
+        update(target) \
+        .values({column: source.c[column] for column in CARRIED_FORWARD_COLUMNS}) \
+        .where(
+            (target.c.from_version == from_version) &
+            (target.c.to_version == to_version) &
+            (source.c.from_version == source_from_version) &
+            (source.c.to_version == source_to_version) &
+            (source.c.mitre_id == target.c.mitre_id)
+        )
+    )
+    db.commit()
+
+    return result.rowcount
+
+
+
 '''
 =====================================================================================
 | Get all changes from a specific upgrade.                                          |
@@ -366,6 +463,225 @@ def get_next_change(db: Session, current_change: MITREChange, filter: str) -> MI
 
 
 
+'''
+=====================================================================================
+| Returns the number of words that have been added to and removed from a            |
+| description, as a measure of how much the description has changed.                |
+=====================================================================================
+'''
+def get_description_diff_size(old_description: str, new_description: str) -> tuple[int, int]:
+    old_words = (old_description or "").split()
+    new_words = (new_description or "").split()
+
+    # Additions have no old description, so the whole description is new.
+    if not old_words:
+        return len(new_words), 0
+
+    added = removed = 0
+    for tag, old_start, old_end, new_start, new_end in difflib.SequenceMatcher(None, old_words, new_words, autojunk=False).get_opcodes():
+        if tag in ("replace", "delete"):
+            removed += old_end - old_start
+        if tag in ("replace", "insert"):
+            added += new_end - new_start
+
+    return added, removed
+
+
+
+'''
+=====================================================================================
+| Returns the history of a technique across all upgrades in the DB, oldest upgrade  |
+| first: the change category, the size of the description diff and the evaluation   |
+| of every upgrade. All upgrades are loaded with one query on the MITRE ID index.   |
+=====================================================================================
+'''
+def get_technique_history(mitre_id: str, db: Session) -> list:
+    changes = db.scalars(
+        select(MITREChange) \
+        .outerjoin(MITREVersion, MITREVersion.name == MITREChange.to_version) \
+        .where(MITREChange.mitre_id == mitre_id) \
+        .order_by(asc(MITREVersion.major), asc(MITREVersion.minor))
+    ).all()
+
+    history = []
+    for c in changes:
+        words_added, words_removed = get_description_diff_size(c.old_description, c.new_description)
+
+        history.append({
+            "from_version": c.from_version,
+            "to_version": c.to_version,
+            "technique": c.technique,
+            "sub_technique": c.sub_technique,
+            "change_category": c.change_category,
+            "status": c.status,
+            "description_words_added": words_added,
+            "description_words_removed": words_removed,
+            "evaluation": {column: getattr(c, column) for column in CARRIED_FORWARD_COLUMNS}
+        })
+
+    return history
+
+
+
+'''
+=====================================================================================
+| Converts the text the user has entered into an FTS5 query. Every word is quoted,  |
+| so characters like "-", "." or ":" (e.g. in "T1027.003") are not interpreted as   |
+| FTS5 syntax. All words must match, the last word also matches as a prefix, so     |
+| results already show up while the user is typing.                                 |
+=====================================================================================
+'''
+def build_search_query(search_text: str) -> str | None:
+    words = [f'"{word.replace('"', '""')}"' for word in search_text.split()]
+
+    if not words:
+        return None
+
+    words[-1] += "*"
+    return " ".join(words)
+
+
+
+'''
+=====================================================================================
+| Searches the descriptions, reasoning and measures of all changes with the FTS5    |
+| index (see table_definitions.create_search_index()). The search can be limited to |
+| an upgrade. The results are ranked with BM25: matches in the MITRE ID and the     |
+| technique name count more than matches in long descriptions. Every result has a   |
+| snippet of the best matching column with the matches marked with <mark>.          |
+=====================================================================================
+'''
+def search_changes(db: Session, search_text: str, from_version: str = None, to_version: str = None, limit: int = 50) -> list:
+    match = build_search_query(search_text)
+    if not match:
+        return []
+
+    # Weights of the columns in the order of SEARCH_COLUMNS.
+    weights = ", ".join(str(w) for w in [10.0, 5.0, 5.0, 1.0, 1.0, 2.0, 2.0, 2.0, 2.0, 2.0, 2.0])
+
+    # The snippet is escaped afterwards, so the markers must not be HTML.
+    statement = text(f"""
+        SELECT c.mitre_id, c.technique, c.sub_technique, c.change_category, c.from_version, c.to_version, c.status,
+               snippet(mitre_changes_fts, -1, char(2), char(3), '...', 16) AS snippet,
+               bm25(mitre_changes_fts, {weights}) AS rank
+        FROM mitre_changes_fts
+        JOIN mitre_changes AS c ON c.change_id = mitre_changes_fts.rowid
+        WHERE mitre_changes_fts MATCH :match
+          AND (:from_version IS NULL OR c.from_version = :from_version)
+          AND (:to_version IS NULL OR c.to_version = :to_version)
+        ORDER BY rank
+        LIMIT :limit
+    """)
+
+    rows = db.execute(statement, {"match": match, "from_version": from_version, "to_version": to_version, "limit": limit}).all()
+
+    return [
+        {
+            "mitre_id": row.mitre_id,
+            "technique": row.technique,
+            "sub_technique": row.sub_technique,
+            "change_category": row.change_category,
+            "from_version": row.from_version,
+            "to_version": row.to_version,
+            "status": row.status,
+            "snippet": html.escape(row.snippet or "").replace("\x02", "<mark>").replace("\x03", "</mark>"),
+            "rank": row.rank
+        }
+        for row in rows
+    ]
+
+
+
+'''
+=====================================================================================
+| Returns the SQL condition of a facet filter. Several values of the same facet are |
+| combined with OR (e.g. tactic=Execution or tactic=Persistence).                   |
+=====================================================================================
+'''
+def get_facet_condition(facet: str, values: list):
+    if facet == "tactic":
+        return MITREChange.change_id.in_(select(ChangeTactic.change_id).where(ChangeTactic.tactic.in_(values)))
+    if facet == "platform":
+        return MITREChange.change_id.in_(select(ChangePlatform.change_id).where(ChangePlatform.platform.in_(values)))
+    if facet == "category":
+        return MITREChange.change_category.in_(values)
+    if facet == "status":
+        return MITREChange.status.in_(values)
+    if facet == "domain":
+        return MITREChange.domain.in_(values)
+    if facet == "criticality":
+        return MAX_CRITICALITY.in_([int(v) for v in values])
+
+    raise ValueError(f"Unknown facet: {facet}")
+
+
+
+'''
+=====================================================================================
+| Returns the changes of an upgrade that match the filters and the facet counts.    |
+| filters maps a facet (tactic, platform, category, status, domain, criticality) to |
+| a list of values. The counts of a facet are calculated with the filters of all    |
+| other facets, so they show how many changes each value would return. The          |
+| criticality facet is the highest client/infrastructure/service criticality of a   |
+| change.                                                                           |
+=====================================================================================
+'''
+def get_faceted_changes(from_version: str, to_version: str, filters: dict, db: Session) -> dict:
+    # Same changes as in the overview (see get_changes()).
+    base_condition = (MITREChange.from_version == from_version) & (MITREChange.to_version == to_version) & (MITREChange.nr_sub_techniques == 0)
+    conditions = {facet: get_facet_condition(facet, values) for facet, values in filters.items() if values}
+
+    changes = db.scalars(
+        select(MITREChange) \
+        .where(base_condition, *conditions.values()) \
+        .order_by(
+            asc(MITREChange.tactics),
+            asc(MITREChange.technique),
+            asc(MITREChange.sub_technique)
+        )
+    ).all()
+
+    facet_columns = {
+        "tactic": ChangeTactic.tactic,
+        "platform": ChangePlatform.platform,
+        "category": MITREChange.change_category,
+        "status": MITREChange.status,
+        "domain": MITREChange.domain,
+        "criticality": MAX_CRITICALITY
+    }
+
+    facets = {}
+    for facet, column in facet_columns.items():
+        query = select(column, func.count()).where(base_condition, *[c for f, c in conditions.items() if f != facet])
+
+        if facet == "tactic":
+            query = query.join(MITREChange, MITREChange.change_id == ChangeTactic.change_id)
+        elif facet == "platform":
+            query = query.join(MITREChange, MITREChange.change_id == ChangePlatform.change_id)
+
+        facets[facet] = {str(value): count for value, count in db.execute(query.group_by(column).order_by(column)).all()}
+
+    return {
+        "changes": [
+            {
+                "mitre_id": c.mitre_id,
+                "technique": c.technique,
+                "sub_technique": c.sub_technique,
+                "tactics": c.tactics,
+                "change_category": c.change_category,
+                "status": c.status,
+                "domain": c.domain,
+                "client_criticality_sum": c.client_criticality_sum,
+                "infra_criticality_sum": c.infra_criticality_sum,
+                "service_criticality_sum": c.service_criticality_sum
+            }
+            for c in changes
+        ],
+        "facets": facets
+    }
+
+
+
 '''
 =====================================================================================
 | This function checks if the user has already uploaded a spreadsheet file for      |
@@ -412,7 +728,7 @@ def get_mitre_versions_db(db: Session):
 '''
 def get_mitre_versions_api(db: Session):
     # Github API allows us to fetch all releases up from v8.0. Versions below were not pushed to Github by MITRE.
-    req = get("https://api.github.com/repos/mitre/cti/releases")
+    req = get(f"{GITHUB_API_URL}/repos/mitre/cti/releases")
 
     # If error, exit the function. Happens mainly due to Githubs API rate limits.
     if req.status_code >= 400:
@@ -442,34 +758,17 @@ def get_mitre_versions_api(db: Session):
 
 '''
 =====================================================================================
-| The following functions calculate the client, infrastructure and service          |
-| criticality sum.                                                                  |
+| Calculates the client, infrastructure and service criticality sums of all changes |
+| of an upgrade (or of a single change) with one UPDATE statement. The sums are     |
+| defined in table_definitions.CRITICALITY_SUMS.                                    |
 =====================================================================================
 '''
-def client_sum(change: MITREChange) -> int:
-    if change.client_criticality == 0:
-        return 0
-
-    sum = change.confidentiality + change.integrity + change.availability + change.client_criticality
-    return sum
-
-
+def recalculate_sums(db: Session, from_version: str, to_version: str, mitre_id: str = None) -> None:
+    condition = (MITREChange.from_version == from_version) & (MITREChange.to_version == to_version)
+    if mitre_id is not None:
+        condition &= (MITREChange.mitre_id == mitre_id)
 
-def infra_sum(change: MITREChange) -> int:
-    if change.infra_criticality == 0:
-        return 0
-
-    sum = change.confidentiality + change.integrity + change.availability + change.infra_criticality
-    return sum
-
-
-
-def service_sum(change: MITREChange) -> int:
-    if change.service_criticality == 0:
-        return 0
-
-    sum = change.confidentiality + change.integrity + change.availability + change.service_criticality
-    return sum
+    db.execute(update(MITREChange).where(condition).values(CRITICALITY_SUMS))
 
 
 
@@ -477,38 +776,31 @@ def service_sum(change: MITREChange) -> int:
 =====================================================================================
 | Checks if a file type is valid (XLSX or ODS). The function checks both the file   |
 | extension and the mimetype by reading the contents of the file.                   |
+|                                                                                   |
+| The file is checked on disk. zipfile only reads the central directory at the end  |
+| of the file and the small "mimetype" entry, not the whole file.                   |
 =====================================================================================
 '''
-def is_xlsx_or_ods(file: FileStorage) -> Boolean:
-    # Make sure the pointer is set to the start.
-    file.seek(0)
-
-    # Convert the file to BytesIO to ensure the stream can be read by zipfile library.
-    data = file.read()
-    file.seek(0)
-    bio = BytesIO(data)
-    
-    # Get the file extension.
-    file_ext = file.filename.lower().split(".")[-1]
-    
+def is_xlsx_or_ods(file_path: str, file_ext: str) -> Boolean:
     # If extension not ods or xlsx.
     if file_ext not in ("ods", "xlsx"):
         return False
 
     # Reading the file.
     try:
-        with zipfile.ZipFile(bio, 'r') as f:
+        with zipfile.ZipFile(file_path, 'r') as f:
             # List of filenames in the ZIP archive.
             files = f.namelist()
             
             # ODS has a file called 'mimetype'
-            if "mimetype" in files:
-                mimetype = f.read("mimetype").decode("utf-8").strip()
+            if file_ext == "ods" and "mimetype" in files:
+                with f.open("mimetype") as m:
+                    mimetype = m.read(100).decode("utf-8", errors="replace").strip()
                 if mimetype == "application/vnd.oasis.opendocument.spreadsheet":
                     return True
             
             # XLSX has a file called 'xl/workbook.xml'.
-            if "xl/workbook.xml" in files:
+            if file_ext == "xlsx" and "xl/workbook.xml" in files:
                 return True
             
             return False
@@ -522,17 +814,34 @@ def is_xlsx_or_ods(file: FileStorage) -> Boolean:
 =====================================================================================
 | This function constructs a unique filename, checks if the filetype is valid,      |
 | removes any other spreadsheet files that may exist and saves it to local disk.    |
+|                                                                                   |
+| The upload is written to a temporary file in "sheets/" first. It is only renamed  |
+| to its final name if it's valid, so an invalid upload never replaces the current  |
+| file of the upgrade.                                                              |
 =====================================================================================
 '''
 def handle_upload(file: FileStorage, from_version: str, to_version: str):
-    file_ext = file.filename.split(".")[-1]
+    file_ext = file.filename.lower().split(".")[-1]
 
-    if not is_xlsx_or_ods(file):
+    if file_ext not in ("ods", "xlsx"):
         raise Exception("Unsupported Filetype")
     
     file_name = f"mitreattck_eval_{from_version}_{to_version}"
     file_path = path.join("sheets", f"{file_name}.{file_ext}")
-    file.save(file_path)
+
+    # Copy the upload to disk in chunks. Large uploads are already spooled to disk by Werkzeug, so the file is never read into memory.
+    fd, temp_path = tempfile.mkstemp(dir="sheets", prefix=f".{file_name}.", suffix=".upload")
+    os.close(fd)
+
+    try:
+        file.save(temp_path)
+
+        if not is_xlsx_or_ods(temp_path, file_ext):
+            raise Exception("Unsupported Filetype")
+
+        os.replace(temp_path, file_path)
+    finally:
+        Path(temp_path).unlink(missing_ok=True)
 
     # If an ods file exists and a xlsx file is uploaded remove the ods file and vice versa.
     # If a xlsx file exists and a xlsx file is uploaded, it simply gets overwritten.
@@ -555,20 +864,105 @@ def handle_upload(file: FileStorage, from_version: str, to_version: str):
 | Wrapper for the import function of the file. This function determines the file    |
 | type and calls the correct import function for each file type.                    |
 | The spreadsheet file will be imported into the local SQLite DB.                   |
+|                                                                                   |
+| Analysts often upload the same file again. The hash of the file and the hashes of |
+| its rows are stored for every upgrade:                                            |
+| - If the file is identical to the last upload, nothing is imported.               |
+| - If the file has changed, only the techniques whose row has changed (or has been |
+|   added or removed) are imported again.                                           |
+| Returns the number of techniques that have been imported.                         |
 =====================================================================================
 '''
-def import_file(file_path: str, from_version: str, to_version: str, db: Session):
+def import_file(file_path: str, from_version: str, to_version: str, db: Session) -> int:
     file_ext = file_path.split(".")[-1]
+    file_name = path.basename(file_path)
+
+    # Reuse the rows if the same file has already been read. The last part of the key is the hash of the file.
+    cache_key = sheet_cache.key(file_path, SHEET_NAME)
+    file_hash = cache_key[-1]
+
+    previous_import = db.get(SpreadsheetImport, (from_version, to_version))
+    if previous_import and previous_import.file_name == file_name and previous_import.file_hash == file_hash:
+        return 0
+
+    rows = sheet_cache.get(cache_key)
+
+    if file_ext == "xlsx":
+        handler = XLSXHandler(file_path=file_path, sheet_name=SHEET_NAME, db=db, read_only=True, rows=rows)
+    elif file_ext == "ods":
+        handler = ODSHandler(file_path=file_path, sheet_name=SHEET_NAME, db=db, read_only=True, rows=rows)
+
+    sheet_cache.put(cache_key, handler.rows)
+
     changes = get_changes(from_version, to_version, db)
+    row_hashes = hash_rows(handler.rows)
+
+    # Only import the techniques whose row differs from the last upload of the same file type.
+    previous_row_hashes = load_json(previous_import.row_hashes) if previous_import and previous_import.file_name == file_name else None
+    if previous_row_hashes is not None:
+        changes = [c for c in changes if row_hashes.get(c.mitre_id) != previous_row_hashes.get(c.mitre_id)]
 
     if file_ext == "xlsx":
-        handler = XLSXHandler(file_path=file_path, sheet_name=SHEET_NAME, db=db)
         handler.import_xlsx(changes)
-
     elif file_ext == "ods":
-        handler = ODSHandler(file_path=file_path, sheet_name=SHEET_NAME, db=db)
         handler.import_ods(changes)
 
+    # The sums in the file are not imported, they are calculated from the imported criticality and CIA values.
+    recalculate_sums(db, from_version, to_version)
+
+    # Remember the revision of the import. Only changes modified after this point have to be exported.
+    # After a partial import the revision is kept: techniques that have been edited since then and were not imported
+    # again still differ from the file. The techniques that were imported again are compared cell by cell on export.
+    if previous_row_hashes is None:
+        imported_at = datetime.now()
+        revision = get_latest_revision(db)
+    else:
+        imported_at = previous_import.imported_at
+        revision = previous_import.revision
+
+    db.merge(SpreadsheetImport(
+        from_version=from_version,
+        to_version=to_version,
+        file_name=file_name,
+        imported_at=imported_at,
+        revision=revision,
+        file_hash=file_hash,
+        row_hashes=json.dumps(row_hashes)
+    ))
+    db.commit()
+
+    return len(changes)
+
+
+
+'''
+=====================================================================================
+| Returns the revision of the last import of the spreadsheet file of an upgrade or  |
+| None if no file has been imported yet.                                            |
+=====================================================================================
+'''
+def get_import_revision(from_version: str, to_version: str, db: Session) -> int | None:
+    spreadsheet_import = db.get(SpreadsheetImport, (from_version, to_version))
+    return spreadsheet_import.revision if spreadsheet_import else None
+
+
+
+'''
+=====================================================================================
+| Filters the changes that have to be written to the spreadsheet file: techniques   |
+| that are not in the file yet and techniques that have been modified since the     |
+| file was imported. If the revision of the import is unknown, all changes are      |
+| returned.                                                                         |
+=====================================================================================
+'''
+def get_modified_changes(changes: list, rows: RowStore, import_revision: int | None) -> list:
+    if import_revision is None:
+        return list(changes)
+
+    return [
+        c for c in changes
+        if c.mitre_id not in rows or (c.revision or 0) > import_revision
+    ]
 
 
 '''
@@ -576,11 +970,23 @@ def import_file(file_path: str, from_version: str, to_version: str, db: Session)
 | Wrapper for the export function of the file. This function determines the file    |
 | type and calls the correct export function for each file type.                    |
 | The function then writes the exported spreadsheet file to disk.                   |
+|                                                                                   |
+| The file is written to a temporary file first, which is renamed once the export   |
+| is complete. This way multiple exports can run at the same time and a download    |
+| never gets a half-written file.                                                   |
+| The progress of the export is reported to the optional progress callback.         |
+|                                                                                   |
+| Only techniques that have been modified since the import (and new techniques) are |
+| exported, and only the cells that actually differ are written. All other rows of  |
+| the file stay exactly as they are.                                                |
 =====================================================================================
 '''
-def export_file(from_version: str, to_version: str, db: Session) -> str:
+def export_file(from_version: str, to_version: str, db: Session, progress: Callable = None) -> str:
     # Get the current spreadsheet file for this upgrade.
     file_name = get_spreadsheet_filename(from_version, to_version)
+    if not file_name:
+        raise Exception("No spreadsheet file has been imported for this upgrade.")
+
     file_ext = file_name.split(".")[-1]
     file_path = path.join("sheets", file_name)
 
@@ -589,10 +995,95 @@ def export_file(from_version: str, to_version: str, db: Session) -> str:
 
     # Get all changes that were made during this upgrade.
     changes = get_changes(from_version, to_version, db)
+    import_revision = get_import_revision(from_version, to_version, db)
+
+    # Reuse the rows from the last import or export if the file hasn't changed since.
+    cache_key = sheet_cache.key(file_path, SHEET_NAME)
+    rows = sheet_cache.get(cache_key)
+
+    fd, temp_path = tempfile.mkstemp(dir="sheets", prefix=f".{export_name}.", suffix=".tmp")
+    os.close(fd)
+
+    try:
+        if file_ext == "xlsx":
+            handler = XLSXHandler(file_path=file_path, sheet_name=SHEET_NAME, db=db, rows=rows)
+            changes = get_modified_changes(changes, handler.rows, import_revision)
+            handler.export_xlsx(file_path=temp_path, changes=changes, progress=progress)
+        elif file_ext == "ods":
+            # The ODS file is not loaded completely. Only the changed rows are rewritten in content.xml.
+            handler = ODSHandler(file_path=file_path, sheet_name=SHEET_NAME, db=db, read_only=True, rows=rows)
+            try:
+                handler.export_ods_streaming(
+                    file_path=temp_path, changes=get_modified_changes(changes, handler.rows, import_revision), progress=progress
+                )
+
+            # If content.xml can't be patched, load the whole document and export it. The rows are read again from
+            # the document, so the row indices are the ones of the DOM.
+            except ODSException:
+                handler = ODSHandler(file_path=file_path, sheet_name=SHEET_NAME, db=db, rows=RowStore())
+                handler.rows = handler.read_rows(col_limit=25)
+                handler.export_ods(
+                    file_path=temp_path, changes=get_modified_changes(changes, handler.rows, import_revision), progress=progress
+                )
+
+        # Replace the previous export in one step.
+        os.replace(temp_path, export_path)
+    finally:
+        Path(temp_path).unlink(missing_ok=True)
+
+    sheet_cache.put(cache_key, handler.rows)
+    return export_path
+
+
+
+'''
+=====================================================================================
+| Returns a report of all cells that the next export will change, without writing   |
+| the file. New techniques are listed with all of their values.                     |
+=====================================================================================
+'''
+def get_export_report(from_version: str, to_version: str, db: Session) -> list:
+    file_name = get_spreadsheet_filename(from_version, to_version)
+    if not file_name:
+        raise Exception("No spreadsheet file has been imported for this upgrade.")
+
+    file_ext = file_name.split(".")[-1]
+    file_path = path.join("sheets", file_name)
+
+    # Reuse the rows from the last import or export if the file hasn't changed since.
+    cache_key = sheet_cache.key(file_path, SHEET_NAME)
+    rows = sheet_cache.get(cache_key)
 
     if file_ext == "xlsx":
-        handler = XLSXHandler(file_path=file_path, sheet_name=SHEET_NAME, db=db)
-        handler.export_xlsx(file_path=export_path, changes=changes)
+        handler = XLSXHandler(file_path=file_path, sheet_name=SHEET_NAME, db=db, read_only=True, rows=rows)
     elif file_ext == "ods":
-        handler = ODSHandler(file_path=file_path, sheet_name=SHEET_NAME, db=db)
-        handler.export_ods(file_path=export_path, changes=changes)
\ No newline at end of file
+        handler = ODSHandler(file_path=file_path, sheet_name=SHEET_NAME, db=db, read_only=True, rows=rows)
+
+    sheet_cache.put(cache_key, handler.rows)
+
+    changes = get_changes(from_version, to_version, db)
+    changes = get_modified_changes(changes, handler.rows, get_import_revision(from_version, to_version, db))
+
+    report = []
+    for c in changes:
+        addition = c.mitre_id not in handler.rows
+
+        if addition:
+            cells = [(col_index, None, value) for col_index, value in handler.export_values(c)]
+        else:
+            cells = handler.diff_values(c)
+
+        # Techniques that have been modified but are equal to the file again are not listed.
+        if not cells:
+            continue
+
+        report.append({
+            "mitre_id": c.mitre_id,
+            "addition": addition,
+            "cells": [
+                {"column": COLUMN_NAMES[col_index], "old_value": old_value, "new_value": new_value}
+                for col_index, old_value, new_value in cells
+            ]
+        })
+
+    return report
\ No newline at end of file
@@ -0,0 +1,263 @@
+# Maintenance of the DB: archiving finished upgrades, VACUUM/ANALYZE and a report of the DB size.
+#
+# Usage:
+#   python maintenance.py report
+#   python maintenance.py archive [--from-version v16.1 --to-version v17.0] [--all]
+#   python maintenance.py restore --from-version v16.1 --to-version v17.0
+#   python maintenance.py optimize
+from table_definitions import *
+from snapshot import export_snapshot, import_snapshot, get_snapshot_filename
+from sqlalchemy import delete
+from pathlib import Path
+from os import path
+import argparse, os
+
+# Archived upgrades are stored as snapshots in this folder.
+ARCHIVE_DIR = path.join("db", "archive")
+
+
+
+'''
+=====================================================================================
+| Custom Exception that will be raised if a maintenance task can't be done.         |
+=====================================================================================
+'''
+class MaintenanceException(Exception):
+    pass
+
+
+
+'''
+=====================================================================================
+| Returns the path of the archive file of an upgrade.                               |
+=====================================================================================
+'''
+def get_archive_path(from_version: str, to_version: str) -> str:
+    return path.join(ARCHIVE_DIR, get_snapshot_filename(from_version, to_version))
+
+
+
+'''
+=====================================================================================
+| Returns all upgrades in the DB with their number of changes, the number of done   |
+| changes and whether the upgrade is finished (all changes "Done"), oldest first.   |
+=====================================================================================
+'''
+def get_upgrade_row_counts() -> list:
+    with engine.connect() as connection:
+        rows = connection.execute(
+            select(
+                MITREChange.from_version,
+                MITREChange.to_version,
+                func.count(),
+                func.sum(case((MITREChange.status == "Done", 1), else_=0))
+            ) \
+            .outerjoin(MITREVersion, MITREVersion.name == MITREChange.to_version) \
+            .group_by(MITREChange.from_version, MITREChange.to_version, MITREVersion.major, MITREVersion.minor) \
+            .order_by(MITREVersion.major, MITREVersion.minor, MITREChange.to_version)
+        ).all()
+
+    return [
+        {"from_version": from_version, "to_version": to_version, "changes": changes, "done": done, "finished": changes == done}
+        for from_version, to_version, changes, done in rows
+    ]
+
+
+
+'''
+=====================================================================================
+| Returns the size of the DB, the space that VACUUM would free, the row counts of   |
+| all upgrades and the archived upgrades.                                           |
+=====================================================================================
+'''
+def get_database_report() -> dict:
+    with engine.connect() as connection:
+        page_size = connection.exec_driver_sql("PRAGMA page_size").scalar()
+        page_count = connection.exec_driver_sql("PRAGMA page_count").scalar()
+        free_pages = connection.exec_driver_sql("PRAGMA freelist_count").scalar()
+
+    archived = []
+    if path.isdir(ARCHIVE_DIR):
+        for file_name in sorted(os.listdir(ARCHIVE_DIR)):
+            archived.append({"file_name": file_name, "size": path.getsize(path.join(ARCHIVE_DIR, file_name))})
+
+    return {
+        "database_size": page_size * page_count,
+        "free_size": page_size * free_pages,
+        "upgrades": get_upgrade_row_counts(),
+        "archived": archived
+    }
+
+
+
+'''
+=====================================================================================
+| Archives an upgrade: its snapshot is written to the archive folder and all its    |
+| changes are deleted from the DB. The triggers remove the search index entries,    |
+| tactics and platforms of the changes. Only finished upgrades are archived, unless |
+| force is True. The snapshot is written completely before anything is deleted.     |
+| Returns the path of the archive file.                                             |
+=====================================================================================
+'''
+def archive_upgrade(from_version: str, to_version: str, force: bool = False) -> str:
+    upgrade = next(
+        (u for u in get_upgrade_row_counts() if u["from_version"] == from_version and u["to_version"] == to_version),
+        None
+    )
+
+    if not upgrade:
+        raise MaintenanceException(f"The upgrade from {from_version} to {to_version} doesn't exist.")
+
+    if not upgrade["finished"] and not force:
+        raise MaintenanceException(f"The upgrade from {from_version} to {to_version} is not finished ({upgrade['done']} of {upgrade['changes']} changes done).")
+
+    Path(ARCHIVE_DIR).mkdir(parents=True, exist_ok=True)
+    archive_path = get_archive_path(from_version, to_version)
+    temp_path = f"{archive_path}.tmp"
+
+    with open(temp_path, "wb") as f:
+        for chunk in export_snapshot(from_version, to_version):
+            f.write(chunk)
+
+    os.replace(temp_path, archive_path)
+
+    # The hashes of the imported spreadsheet file belong to the deleted changes, so they are deleted as well.
+    with engine.begin() as connection:
+        connection.execute(
+            delete(MITREChange) \
+            .where(MITREChange.from_version == from_version, MITREChange.to_version == to_version)
+        )
+        connection.execute(
+            delete(SpreadsheetImport) \
+            .where(SpreadsheetImport.from_version == from_version, SpreadsheetImport.to_version == to_version)
+        )
+
+    return archive_path
+
+
+
+'''
+=====================================================================================
+| Archives all finished upgrades. The most recent finished upgrade is kept if       |
+| keep_latest is True, so its evaluations can still be carried forward to the next  |
+| upgrade. Returns the archived upgrades as (from_version, to_version).             |
+=====================================================================================
+'''
+def archive_finished_upgrades(keep_latest: bool = True) -> list:
+    finished = [u for u in get_upgrade_row_counts() if u["finished"]]
+
+    if keep_latest:
+        finished = finished[:-1]
+
+    for upgrade in finished:
+        archive_upgrade(upgrade["from_version"], upgrade["to_version"])
+
+    return [(u["from_version"], u["to_version"]) for u in finished]
+
+
+
+'''
+=====================================================================================
+| Loads an archived upgrade back into the DB and deletes its archive file.          |
+| Returns the number of restored changes.                                           |
+=====================================================================================
+'''
+def restore_upgrade(from_version: str, to_version: str) -> int:
+    archive_path = get_archive_path(from_version, to_version)
+
+    if not path.exists(archive_path):
+        raise MaintenanceException(f"There is no archive of the upgrade from {from_version} to {to_version}.")
+
+    with open(archive_path, "rb") as f:
+        _, _, restored = import_snapshot(f)
+
+    os.remove(archive_path)
+
+    return restored
+
+
+
+'''
+=====================================================================================
+| Optimizes the DB:                                                                 |
+| - ANALYZE collects the statistics the query planner uses to choose indexes.       |
+| - The full-text index is merged into as few segments as possible.                 |
+| - PRAGMA optimize lets SQLite do any further optimizations it considers useful.   |
+| - VACUUM rebuilds the DB file, which gives the space of deleted rows back to the  |
+|   file system.                                                                    |
+| VACUUM can't run inside a transaction and needs a moment without other writers.   |
+| Returns the size of the DB before and after.                                      |
+=====================================================================================
+'''
+def optimize_database() -> dict:
+    size_before = get_database_report()["database_size"]
+
+    with engine.begin() as connection:
+        connection.exec_driver_sql("ANALYZE")
+
+        if connection.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'mitre_changes_fts'")).first():
+            connection.exec_driver_sql("INSERT INTO mitre_changes_fts(mitre_changes_fts) VALUES ('optimize')")
+
+        connection.exec_driver_sql("PRAGMA optimize")
+
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        connection.exec_driver_sql("VACUUM")
+
+    return {"size_before": size_before, "size_after": get_database_report()["database_size"]}
+
+
+
+'''
+=====================================================================================
+| Prints the DB report in a readable form.                                          |
+=====================================================================================
+'''
+def print_report(report: dict) -> None:
+    print(f"DB size: {report['database_size'] / 1024 / 1024:.1f} MB ({report['free_size'] / 1024 / 1024:.1f} MB free)")
+
+    for upgrade in report["upgrades"]:
+        finished = " (finished)" if upgrade["finished"] else ""
+        print(f"  {upgrade['from_version']} to {upgrade['to_version']}: {upgrade['changes']} changes, {upgrade['done']} done{finished}")
+
+    for archive in report["archived"]:
+        print(f"  Archived: {archive['file_name']} ({archive['size'] / 1024:.0f} KB)")
+
+
+
+'''
+=====================================================================================
+| Parses the arguments and runs a maintenance task. Run from the folder that        |
+| contains the db folder of the tool.                                               |
+=====================================================================================
+'''
+def main():
+    parser = argparse.ArgumentParser(description="Maintenance of the ESE database.")
+    parser.add_argument("task", choices=["report", "archive", "restore", "optimize"], help="Maintenance task.")
+    parser.add_argument("--from-version", help="Upgrade to archive or restore (default for archive: all finished upgrades).")
+    parser.add_argument("--to-version", help="Upgrade to archive or restore.")
+    parser.add_argument("--all", action="store_true", help="Also archive the most recent finished upgrade.")
+    parser.add_argument("--force", action="store_true", help="Archive the upgrade even if it isn't finished.")
+    args = parser.parse_args()
+
+    create_tables()
+
+    try:
+        if args.task == "archive" and args.from_version:
+            print(f"Archived to {archive_upgrade(args.from_version, args.to_version, args.force)}")
+        elif args.task == "archive":
+            for from_version, to_version in archive_finished_upgrades(keep_latest=not args.all):
+                print(f"Archived {from_version} to {to_version}")
+        elif args.task == "restore":
+            print(f"Restored {restore_upgrade(args.from_version, args.to_version)} changes")
+        elif args.task == "optimize":
+            sizes = optimize_database()
+            print(f"DB size: {sizes['size_before'] / 1024 / 1024:.1f} MB -> {sizes['size_after'] / 1024 / 1024:.1f} MB")
+    except MaintenanceException as e:
+        parser.exit(1, f"{e}\n")
+
+    print_report(get_database_report())
+
+
+
+if __name__ == "__main__":
+    main()
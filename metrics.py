@@ -0,0 +1,328 @@
+# Opt-in instrumentation of requests, SQL queries, template rendering and helper functions.
+from flask import Flask, Response, g, request, template_rendered, before_render_template
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from types import ModuleType
+import functools, inspect, os, threading, time
+
+# Instrumentation is disabled by default, so there's no overhead. Enable it with ESE_METRICS=1.
+METRICS_ENABLED = os.environ.get("ESE_METRICS", "").lower() in ("1", "true", "yes")
+
+
+
+'''
+=====================================================================================
+| Collects timings of the current request and aggregated metrics of all requests.   |
+|                                                                                   |
+| The timings of the current request are stored per thread (Flask handles every     |
+| request in its own thread) by category: "sql", "template", "markdown" and         |
+| "helper". They are sent to the browser in the Server-Timing header. In addition,  |
+| all timings are summed up over all requests and can be read in the Prometheus     |
+| text format from /metrics.                                                        |
+=====================================================================================
+'''
+class Metrics():
+
+    def __init__(self):
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+        # (metric name, labels) -> [sum of seconds, count]. Labels are a tuple of (name, value) pairs.
+        self.summaries: dict = {}
+
+        # (metric name, labels) -> count.
+        self.counters: dict = {}
+
+
+
+    '''
+    =====================================================================================
+    | Starts collecting the timings of a new request in the current thread.             |
+    =====================================================================================
+    '''
+    def start_request(self) -> None:
+        self.local.timings = {} # Category -> [seconds, count].
+        self.local.helper_depth = 0
+
+
+
+    '''
+    =====================================================================================
+    | Stops collecting the timings of the current request and returns them.             |
+    =====================================================================================
+    '''
+    def finish_request(self) -> dict:
+        timings = getattr(self.local, "timings", None) or {}
+        self.local.timings = None
+        return timings
+
+
+
+    '''
+    =====================================================================================
+    | Adds a duration to a category of the current request. Outside of a request (e.g.  |
+    | in an export job) only the aggregated metrics are updated.                        |
+    =====================================================================================
+    '''
+    def add_timing(self, category: str, seconds: float) -> None:
+        timings = getattr(self.local, "timings", None)
+        if timings is None:
+            return
+
+        timing = timings.setdefault(category, [0.0, 0])
+        timing[0] += seconds
+        timing[1] += 1
+
+
+
+    '''
+    =====================================================================================
+    | Adds a duration to an aggregated metric (sum and count).                          |
+    =====================================================================================
+    '''
+    def observe(self, name: str, labels: dict, seconds: float) -> None:
+        key = (name, tuple(sorted(labels.items())))
+
+        with self.lock:
+            summary = self.summaries.setdefault(key, [0.0, 0])
+            summary[0] += seconds
+            summary[1] += 1
+
+
+
+    '''
+    =====================================================================================
+    | Increments an aggregated counter.                                                 |
+    =====================================================================================
+    '''
+    def increment(self, name: str, labels: dict, value: int = 1) -> None:
+        key = (name, tuple(sorted(labels.items())))
+
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+
+
+    '''
+    =====================================================================================
+    | Returns the endpoint of the current request or "background" outside of a          |
+    | request.                                                                          |
+    =====================================================================================
+    '''
+    def current_endpoint(self) -> str:
+        if getattr(self.local, "timings", None) is None:
+            return "background"
+
+        return getattr(self.local, "endpoint", None) or "unknown"
+
+
+
+    '''
+    =====================================================================================
+    | Counts and times all SQL statements that are executed by the engine.              |
+    =====================================================================================
+    '''
+    def instrument_engine(self, engine: Engine) -> None:
+        @event.listens_for(engine, "before_cursor_execute")
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+        @event.listens_for(engine, "after_cursor_execute")
+        def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            seconds = time.perf_counter() - conn.info["query_start"].pop()
+            endpoint = self.current_endpoint()
+
+            self.add_timing("sql", seconds)
+            self.observe("ese_sql_query_duration_seconds", {"endpoint": endpoint}, seconds)
+
+
+
+    '''
+    =====================================================================================
+    | Replaces all functions of a module (e.g. helper) with a wrapper that times them.  |
+    | Functions of the module that call each other use the wrappers as well, since the  |
+    | module attributes are replaced. Only the outermost call is added to the "helper"  |
+    | timing of the request, so nested calls are not counted twice.                     |
+    =====================================================================================
+    '''
+    def instrument_module(self, module: ModuleType) -> None:
+        for name, function in inspect.getmembers(module, inspect.isfunction):
+            if function.__module__ != module.__name__:
+                continue
+
+            setattr(module, name, self.timed(function, f"{module.__name__}.{name}"))
+
+
+
+    '''
+    =====================================================================================
+    | Returns a wrapper that times a function.                                          |
+    =====================================================================================
+    '''
+    def timed(self, function, name: str):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            depth = getattr(self.local, "helper_depth", 0)
+            self.local.helper_depth = depth + 1
+            start = time.perf_counter()
+
+            try:
+                return function(*args, **kwargs)
+            finally:
+                seconds = time.perf_counter() - start
+                self.local.helper_depth = depth
+
+                self.observe("ese_function_duration_seconds", {"function": name}, seconds)
+                if depth == 0:
+                    self.add_timing("helper", seconds)
+
+        return wrapper
+
+
+
+    '''
+    =====================================================================================
+    | Registers the request hooks, the template signals, the timing of the Markdown     |
+    | filter and the /metrics endpoint.                                                 |
+    =====================================================================================
+    '''
+    def instrument_app(self, app: Flask) -> None:
+        @app.before_request
+        def before_request():
+            self.start_request()
+            self.local.endpoint = request.endpoint
+            g.metrics_start = time.perf_counter()
+
+        @app.after_request
+        def after_request(response: Response) -> Response:
+            # The /metrics endpoint itself is not measured.
+            if request.endpoint == "metrics":
+                self.finish_request()
+                return response
+
+            seconds = time.perf_counter() - g.get("metrics_start", time.perf_counter())
+            timings = self.finish_request()
+            endpoint = request.endpoint or "unknown"
+
+            self.observe("ese_request_duration_seconds", {"endpoint": endpoint, "method": request.method}, seconds)
+            self.increment("ese_requests_total", {"endpoint": endpoint, "method": request.method, "status": str(response.status_code)})
+            self.increment("ese_sql_queries_total", {"endpoint": endpoint}, timings.get("sql", [0.0, 0])[1])
+
+            response.headers["Server-Timing"] = self.server_timing(timings, seconds)
+            return response
+
+        # Template rendering is measured between these two signals.
+        def before_render(sender, template, context, **extra):
+            self.local.template_start = time.perf_counter()
+
+        def rendered(sender, template, context, **extra):
+            start = getattr(self.local, "template_start", None)
+            if start is None:
+                return
+
+            seconds = time.perf_counter() - start
+            self.add_timing("template", seconds)
+            self.observe("ese_template_render_duration_seconds", {"template": template.name or "unknown"}, seconds)
+
+        before_render_template.connect(before_render, app, weak=False)
+        template_rendered.connect(rendered, app, weak=False)
+
+        # Markdown is rendered by a Jinja filter while the template is rendered.
+        if "markdown" in app.jinja_env.filters:
+            markdown_filter = app.jinja_env.filters["markdown"]
+
+            @functools.wraps(markdown_filter)
+            def timed_markdown_filter(text):
+                start = time.perf_counter()
+                try:
+                    return markdown_filter(text)
+                finally:
+                    seconds = time.perf_counter() - start
+                    self.add_timing("markdown", seconds)
+                    self.observe("ese_markdown_render_duration_seconds", {}, seconds)
+
+            app.jinja_env.filters["markdown"] = timed_markdown_filter
+
+        app.add_url_rule("/metrics", "metrics", lambda: Response(self.render_prometheus(), mimetype="text/plain; version=0.0.4"))
+
+
+
+    '''
+    =====================================================================================
+    | Instruments the whole tool: requests, SQL queries, templates and helper           |
+    | functions.                                                                        |
+    =====================================================================================
+    '''
+    def instrument(self, app: Flask, engine: Engine, helper_module: ModuleType) -> None:
+        self.instrument_engine(engine)
+        self.instrument_module(helper_module)
+        self.instrument_app(app)
+
+
+
+    '''
+    =====================================================================================
+    | Returns the Server-Timing header for the timings of a request, e.g.:              |
+    | sql;dur=12.3;desc="5 queries", template;dur=4.5, total;dur=20.1                   |
+    =====================================================================================
+    '''
+    @staticmethod
+    def server_timing(timings: dict, total_seconds: float) -> str:
+        entries = []
+
+        for category, (seconds, count) in timings.items():
+            description = f"{count} queries" if category == "sql" else f"{count} calls"
+            entries.append(f'{category};dur={seconds * 1000:.1f};desc="{description}"')
+
+        entries.append(f"total;dur={total_seconds * 1000:.1f}")
+        return ", ".join(entries)
+
+
+
+    '''
+    =====================================================================================
+    | Returns all aggregated metrics in the Prometheus text format. Durations are       |
+    | exported as summaries (_sum and _count).                                          |
+    =====================================================================================
+    '''
+    def render_prometheus(self) -> str:
+        with self.lock:
+            summaries = dict(self.summaries)
+            counters = dict(self.counters)
+
+        lines = []
+
+        for metric in sorted({name for name, _ in summaries}):
+            lines.append(f"# TYPE {metric} summary")
+            for (name, labels), (seconds, count) in sorted(summaries.items()):
+                if name == metric:
+                    lines.append(f"{metric}_sum{self.format_labels(labels)} {seconds:.6f}")
+                    lines.append(f"{metric}_count{self.format_labels(labels)} {count}")
+
+        for metric in sorted({name for name, _ in counters}):
+            lines.append(f"# TYPE {metric} counter")
+            for (name, labels), value in sorted(counters.items()):
+                if name == metric:
+                    lines.append(f"{metric}{self.format_labels(labels)} {value}")
+
+        return "\n".join(lines) + "\n"
+
+
+
+    '''
+    =====================================================================================
+    | Formats labels for the Prometheus text format, e.g. {endpoint="upgrade"}.         |
+    =====================================================================================
+    '''
+    @staticmethod
+    def format_labels(labels: tuple) -> str:
+        if not labels:
+            return ""
+
+        escaped = [(name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for name, value in labels]
+        return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+
+# Metrics that are shared by the whole tool.
+metrics = Metrics()
@@ -1,11 +1,39 @@
 # Functions for reading and writing data to and from the ODS file.
 from odf.opendocument import load, OpenDocument
 from odf.table import Table, TableRow, TableCell
-from odf.namespaces import OFFICENS, TABLENS
+from odf.namespaces import OFFICENS, TABLENS, TEXTNS
 from odf.text import P
+from odf.element import Element, Text
 from constants import *
+from row_store import RowStore, StoredRow
 from table_definitions import *
-from sqlalchemy import Sequence
+from sqlalchemy import Sequence, update
+from typing import Callable
+from xml.etree import ElementTree
+from xml.etree.ElementTree import iterparse
+from xml.sax.saxutils import escape, quoteattr
+import copy, html, re, shutil, zipfile
+
+# Tags and attributes as they are named by ElementTree when parsing content.xml directly.
+TAG_TABLE = f"{{{TABLENS}}}table"
+TAG_TABLE_ROW = f"{{{TABLENS}}}table-row"
+TAG_TABLE_CELL = f"{{{TABLENS}}}table-cell"
+TAG_P = f"{{{TEXTNS}}}p"
+ATTR_TABLE_NAME = f"{{{TABLENS}}}name"
+ATTR_COLUMNS_REPEATED = f"{{{TABLENS}}}number-columns-repeated"
+ATTR_ROWS_REPEATED = f"{{{TABLENS}}}number-rows-repeated"
+ATTR_FORMULA = f"{{{TABLENS}}}formula"
+
+# Elements that can contain rows of a worksheet.
+ROW_GROUPS = {(TABLENS, "table-header-rows"), (TABLENS, "table-row-group"), (TABLENS, "table-rows")}
+
+# Attributes of a cell that contain its value, datatype or formula.
+VALUE_ATTRIBUTES = {
+    (OFFICENS, "value"), (OFFICENS, "string-value"), (OFFICENS, "date-value"), (OFFICENS, "boolean-value"),
+    (OFFICENS, "time-value"), (OFFICENS, "currency"), (OFFICENS, "value-type"), (TABLENS, "formula")
+}
+ATTR_VALUE_TYPE = f"{{{OFFICENS}}}value-type"
+ATTR_VALUE = f"{{{OFFICENS}}}value"
 
 
 
@@ -26,23 +54,29 @@ class ODSException(Exception):
 '''
 class ODSHandler():
     
-    def __init__(self, file_path: str, sheet_name: str, db: Session):
+    def __init__(self, file_path: str, sheet_name: str, db: Session, read_only: bool = False, rows: RowStore = None):
         self.file_path: str = file_path
+        self.sheet_name: str = sheet_name
+        self.db: Session = db
+
+        # Row values, only for reading. Reading them from content.xml is much faster than reading them from the DOM.
+        # Rows that have already been read (e.g. from the cache) can be passed, so the file doesn't have to be read again.
+        self.rows: RowStore = rows if rows is not None else self.stream_rows(col_limit=25)
+
+        # For imports and the streaming export the file is only read, so there's no need to load the whole document.
+        if read_only:
+            return
+
         self.doc: OpenDocument = load(file_path)
         self.sheet: Table = self.get_sheet(sheet_name)
 
         # ODS row objects for directly manipulating the file.
-        self.rows_ods = self.sheet.getElementsByType(TableRow)
-
-        # Row values, only for reading.
-        self.rows: dict = self.read_rows(col_limit=25)
+        self.rows_ods: list = self.get_rows()
 
-        # Cleaning up empty rows and cells.
-        self.remove_empty_cells()
-        self.remove_empty_rows()
-        self.expand_cells()
+        # The document is not cleaned up as a whole. Only rows that are changed get their cells expanded (see get_row_cells())
+        # and empty rows are only removed before new rows are added (see export_ods()).
+        self.row_cells: dict = {}
 
-        self.db: Session = db
 
 
     '''
@@ -61,34 +95,125 @@ class ODSHandler():
 
     '''
     =====================================================================================
-    | Reads all rows from the worksheet and returns it as a list of lists.              |
+    | Returns all row elements of the worksheet in the order they appear in the file.   |
+    | Unlike getElementsByType(), the cells of the rows are not searched, only the      |
+    | worksheet and the groups of rows.                                                 |
     =====================================================================================
     '''
-    def read_rows(self, col_limit: int) -> dict:
-        # Use a hashtable instead of a list for faster lookups.
-        rows = {}
+    def get_rows(self, parent: Element = None) -> list:
+        rows = []
+
+        for node in (parent or self.sheet).childNodes:
+            qname = getattr(node, "qname", None)
+            if qname == (TABLENS, "table-row"):
+                rows.append(node)
+
+            # Rows can be grouped (e.g. header rows).
+            elif qname in ROW_GROUPS:
+                rows.extend(self.get_rows(node))
+
+        return rows
+
+
+
+    '''
+    =====================================================================================
+    | Reads all rows from the worksheet and returns them as a RowStore with the MITRE   |
+    | ID as key. The whole document is not loaded for this. content.xml is parsed       |
+    | directly from the ODS file (which is a zip file) row by row, and every row is     |
+    | discarded as soon as its values have been read.                                   |
+    |                                                                                   |
+    | Repeated cells are only expanded up to col_limit and repeated rows are never      |
+    | expanded, so huge empty areas at the end of the sheet cost nearly nothing.        |
+    | The row index is the position of the row element in the worksheet, the same as    |
+    | in get_rows(). Tables inside of cells (sub-tables) are part of their cell, their  |
+    | rows are not rows of the worksheet.                                               |
+    =====================================================================================
+    '''
+    def stream_rows(self, col_limit: int) -> RowStore:
+        rows = RowStore()
+        sheet_found = False
+        in_sheet = False
+        row_index = -1
+
+        # Number of open tables. Only tables with depth 1 are worksheets, deeper tables are sub-tables in cells.
+        depth = 0
+
+        # Parents of the current element, so finished rows can be removed from the tree again.
+        parents = []
+
+        with zipfile.ZipFile(self.file_path) as archive, archive.open("content.xml") as content:
+            for event, element in iterparse(content, events=("start", "end")):
+                if event == "start":
+                    if element.tag == TAG_TABLE:
+                        depth += 1
+                        if depth == 1:
+                            in_sheet = element.get(ATTR_TABLE_NAME) == self.sheet_name
+                            sheet_found = sheet_found or in_sheet
+
+                    parents.append(element)
+                    continue
+
+                parents.pop()
+
+                if element.tag == TAG_TABLE:
+                    depth -= 1
+
+                    # All rows of the worksheet have been read, the rest of the document is not needed.
+                    if depth == 0 and in_sheet:
+                        break
+                    continue
 
-        for row_index, row in enumerate(self.sheet.getElementsByType(TableRow)):
+                # Rows of sub-tables are read together with the cell that contains them.
+                if element.tag != TAG_TABLE_ROW or depth > 1:
+                    continue
+
+                if in_sheet:
+                    row_index += 1
+                    row_data = self.stream_row_values(element, col_limit)
+
+                    # Use the MITRE-ID as key.
+                    rows.add(row_data[COL_MITREID], row_data, row_index)
+
+                # Free the memory of the row.
+                element.clear()
+                if parents:
+                    parents[-1].remove(element)
+
+        if not sheet_found:
+            raise ODSException(f"Worksheet \"{self.sheet_name}\" not found.")
+
+        return rows
+
+
+
+    '''
+    =====================================================================================
+    | Reads all rows from the loaded document like stream_rows(). Used if the rows from |
+    | content.xml can't be trusted, e.g. when the streaming export failed.              |
+    =====================================================================================
+    '''
+    def read_rows(self, col_limit: int) -> RowStore:
+        rows = RowStore()
+
+        for row_index, row in enumerate(self.get_rows()):
             row_data = []
 
-            col_count = 0
-            for cell in row.getElementsByType(TableCell):
-                # If the same cell is repeated x times, odf doesn't store the value x times, it only stores how often the cell is repeated.
-                # None means it's repeated 1 times.
-                repeat_cell = int(cell.getAttribute("numbercolumnsrepeated") or 1)
+            for cell in row.childNodes:
+                if len(row_data) >= col_limit:
+                    break
 
-                # If the col_limit is reached, only repeat the remaning cols up to col_limit.
-                col_remaining = col_limit - col_count
-                col_count += repeat_cell
-                
-                if col_count > col_limit:
-                    repeat_cell = col_remaining
+                if getattr(cell, "qname", None) != (TABLENS, "table-cell"):
+                    continue
+
+                # Only repeat the cell up to col_limit.
+                repeat_cell = int(cell.getAttribute("numbercolumnsrepeated") or 1)
+                repeat_cell = min(repeat_cell, col_limit - len(row_data))
 
                 # All numbers in ods are stored as float, but we only use integers.
                 if cell.getAttribute("valuetype") == "float":
-                    value = float(cell.getAttribute("value"))
-                    value = int(value)
-                
+                    value = int(float(cell.getAttribute("value")))
+
                 # Texts are stored as Type "P". There can be multiple paragraphs per cell.
                 else:
                     value = " ".join(str(p) for p in cell.getElementsByType(P))
@@ -99,14 +224,51 @@ class ODSHandler():
             while len(row_data) < col_limit:
                 row_data.append("")
 
-            # Populate the hashtable and use the MITRE-ID as key.
-            mitre_id = row_data[COL_MITREID]
-            rows[mitre_id] = {"row_data": row_data, "row_index": row_index}
-        
+            # Use the MITRE-ID as key.
+            rows.add(row_data[COL_MITREID], row_data, row_index)
+
         return rows
 
 
 
+    '''
+    =====================================================================================
+    | Reads the values of a row element from content.xml.                               |
+    =====================================================================================
+    '''
+    @staticmethod
+    def stream_row_values(row, col_limit: int) -> list:
+        row_data = []
+
+        for cell in row:
+            if len(row_data) >= col_limit:
+                break
+
+            if cell.tag != TAG_TABLE_CELL:
+                continue
+
+            # Only repeat the cell up to col_limit.
+            repeat_cell = int(cell.get(ATTR_COLUMNS_REPEATED) or 1)
+            repeat_cell = min(repeat_cell, col_limit - len(row_data))
+
+            # All numbers in ods are stored as float, but we only use integers.
+            if cell.get(ATTR_VALUE_TYPE) == "float":
+                value = int(float(cell.get(ATTR_VALUE)))
+
+            # Texts are stored as paragraphs. There can be multiple paragraphs per cell.
+            else:
+                value = " ".join("".join(p.itertext()) for p in cell.iter(TAG_P))
+
+            row_data.extend([value] * repeat_cell)
+
+        # Fill up to col_limit to avoid index errors.
+        while len(row_data) < col_limit:
+            row_data.append("")
+
+        return row_data
+
+
+
     '''
     =====================================================================================
     | Modifies an existing cell in the Worksheet by Row and Column Index.               |
@@ -114,6 +276,17 @@ class ODSHandler():
     =====================================================================================
     '''
     def set_cell(self, row_index: int, col_index: int, value: int|float|str) -> None:
+        self.set_cells(row_index, [(col_index, value)])
+
+
+
+    '''
+    =====================================================================================
+    | Modifies multiple cells of the same row at once. The values are given as a list   |
+    | of (column index, value) pairs.                                                   |
+    =====================================================================================
+    '''
+    def set_cells(self, row_index: int, values: list) -> None:
         rows = self.rows_ods
 
         # Automatically expand the document if row_index is out of bounds by adding rows to the document.
@@ -125,50 +298,148 @@ class ODSHandler():
         target_row = rows[row_index]
         target_row.setAttribute("numberrowsrepeated", 1)
 
-        # Automatically expand the document if col_index is out of bounds by addings cells to the row.
-        cells = target_row.getElementsByType(TableCell)
-        while len(cells) <= col_index:
+        # Automatically expand the document if a column index is out of bounds by addings cells to the row.
+        # The new cells are added to the cached list as well.
+        cells = self.get_row_cells(row_index)
+        col_limit = max(col_index for col_index, _ in values)
+        while len(cells) <= col_limit:
             new_cell = TableCell()
             target_row.addElement(new_cell)
             cells.append(new_cell)
-        
-        target_cell = cells[col_index]
-        target_cell.setAttribute("numbercolumnsrepeated", 1)
-        
+
+        for col_index, value in values:
+            self.write_cell(cells[col_index], value)
+
+
+
+    '''
+    =====================================================================================
+    | Returns the cells of a row. The cells of every row are only searched and          |
+    | expanded once (see expand_row_cells()) and are cached afterwards.                 |
+    =====================================================================================
+    '''
+    def get_row_cells(self, row_index: int) -> list:
+        cells = self.row_cells.get(row_index)
+
+        if cells is None:
+            cells = self.expand_row_cells(self.rows_ods[row_index], col_limit=25)
+            self.row_cells[row_index] = cells
+
+        return cells
+
+
+
+    '''
+    =====================================================================================
+    | Expands the first col_limit cells of a row that have "numbercolumnsrepeated" set  |
+    | to 2 or higher and returns these cells.                                           |
+    |                                                                                   |
+    | When x cells have the same value, ODS only creates one cell in the XML structure  |
+    | but sets "numbercolumnsrepeated" to x, so the Reader knows how often to display   |
+    | the same cell.                                                                    |
+    |                                                                                   |
+    | This leads to problems when using indices. For example: One cell does not have    |
+    | "numbercolumnsrepeated" but the second one has "numbercolumnsrepeated" set to     |
+    | two. This means there are two cells in the XML structure, but the ODS reader      |
+    | displays three cells. Because there are only two cells in the XML structure,      |
+    | calling cells[0] and cells[1] is valid, but cells[2] is not.                      |
+    |                                                                                   |
+    | This function fixes this by expanding repeated cells up to col_limit. Cells after |
+    | col_limit stay repeated, so rows never grow towards the column limit (~ 16.000).  |
+    | Only rows that are changed are expanded, the rest of the document stays as it is. |
+    =====================================================================================
+    '''
+    def expand_row_cells(self, row: TableRow, col_limit: int) -> list:
+        cells = []
+        children = []
+
+        for node in row.childNodes:
+            children.append(node)
+            if getattr(node, "qname", None) != (TABLENS, "table-cell") or len(cells) >= col_limit:
+                continue
+
+            cells.append(node)
+            repeat = int(node.attributes.get((TABLENS, "number-columns-repeated")) or 1)
+            if repeat == 1:
+                continue
+
+            # Split the repeated cell into single copies up to col_limit and keep the rest repeated.
+            single = min(repeat, col_limit - len(cells) + 1)
+            del node.attributes[(TABLENS, "number-columns-repeated")]
+
+            copies = [self.copy_element(node) for _ in range(single - 1)]
+            cells.extend(copies)
+            children.extend(copies)
+
+            if repeat > single:
+                rest = self.copy_element(node)
+                rest.attributes[(TABLENS, "number-columns-repeated")] = str(repeat - single)
+                children.append(rest)
+                copies.append(rest)
+
+            for new_cell in copies:
+                self.doc.rebuild_caches(new_cell)
+
+        if len(children) != len(row.childNodes):
+            self.replace_child_nodes(row, children)
+
+        return cells
+
+
+
+    '''
+    =====================================================================================
+    | Creates a copy of an element with all its attributes and child nodes.             |
+    =====================================================================================
+    '''
+    def copy_element(self, element: Element) -> Element:
+        new_element = Element(qname=element.qname, check_grammar=False)
+        new_element.attributes = dict(element.attributes)
+
+        for child in element.childNodes:
+            if child.nodeType == child.TEXT_NODE:
+                new_element.appendChild(Text(child.data))
+            else:
+                new_element.appendChild(self.copy_element(child))
+
+        return new_element
+
+
+
+    '''
+    =====================================================================================
+    | Replaces the content of a single cell. All previous content of the cell will be   |
+    | removed including the datatype and formulas.                                      |
+    =====================================================================================
+    '''
+    @staticmethod
+    def write_cell(target_cell: TableCell, value: int|float|str) -> None:
         # Remove all existing childnodes (e.g. P nodes for text).
         target_cell.childNodes[:] = []
 
-        # Remove all attributes that could contain values and datatypes. All previous content of the cell will be removed including the datatype.
-        for attr in ("value", "string-value", "date-value", "boolean-value", "time-value", "currency", "value-type"):
-            key = (OFFICENS, attr)
-            if key in target_cell.attributes:
-                del target_cell.attributes[key]
-        
-        # Delete all value and value-type keys from other namespaces (this typically happens when converting from xlsx to ods).
-        for key in list(target_cell.attributes):
-            ns, name = key
-            if name == "value-type":
-                del target_cell.attributes[key]
-        
-        # Remove formulas in the cell.
-        key = (TABLENS, "formula")
-        if key in target_cell.attributes:
-            del target_cell.attributes[key]
+        # Remove all attributes that could contain values, datatypes and formulas and the repetition of the cell in one go.
+        # This includes value-type keys from other namespaces (this typically happens when converting from xlsx to ods).
+        # The attributes are written directly, since setAttribute() and getAttribute() are slow for many cells.
+        attributes = {
+            key: attr for key, attr in target_cell.attributes.items()
+            if key not in VALUE_ATTRIBUTES and key[1] not in ("value-type", "number-columns-repeated")
+        }
 
         # ODS uses float for all numbers.
         if isinstance(value, (int, float)):
             # Set the attribute to float. This tells ODS how to display the value.
-            target_cell.setAttribute("valuetype", "float")
-            target_cell.setAttribute("value", float(value))
+            attributes[(OFFICENS, "value-type")] = "float"
+            attributes[(OFFICENS, "value")] = str(float(value))
 
-            # Even though it is a number, the text is stored as string. The valuetype attribute tells ODS however
-            # how to display this value. There's a difference between how it is stored and how it is displayed.
-            target_cell.addElement(P(text=str(value)))
-        
         # Treat all other values as string.
         else:
-            target_cell.setAttribute("valuetype", "string")
-            target_cell.addElement(P(text=str(value)))
+            attributes[(OFFICENS, "value-type")] = "string"
+
+        target_cell.attributes = attributes
+
+        # Even though it is a number, the text is stored as string. The valuetype attribute tells ODS however
+        # how to display this value. There's a difference between how it is stored and how it is displayed.
+        target_cell.addElement(P(text="" if value is None else str(value)))
     
 
     '''
@@ -227,93 +498,86 @@ class ODSHandler():
     =====================================================================================
     '''
     def remove_empty_rows(self):
-        # Remove from bottom to top, so there are no problems to remove rows while iterating over them.
-        for row in reversed(self.rows_ods):
-            if self.is_row_empty(row):
-                self.sheet.removeChild(row)
-        
-        # Update the variable by reading the updated rows.
-        self.rows_ods = self.sheet.getElementsByType(TableRow)
+        removed = self.remove_empty_child_rows(self.sheet)
+
+        if removed:
+            self.remove_from_caches(removed)
+
+        # Update the variable by reading the updated rows. The row indices have changed, so the cached cells are invalid.
+        self.rows_ods = self.get_rows()
+        self.row_cells = {}
+
 
-    
 
     '''
     =====================================================================================
-    | Removes empty cells in a document when they are repeated more than 10 times.      |
-    | This prevents lots of empty cells in a row.                                       |
-    |                                                                                   |
-    | Somehow our ODS file has so many empty cells that it reaches the column limit     |
-    | (~ 16.000).                                                                       |
-    |                                                                                   |
-    | If the column limit is reached no further columns can be added and the ODS file   |
-    | will be left in a corrupt state.                                                  |
+    | Removes the empty rows of the worksheet or of a group of rows and returns them.   |
+    | Groups of rows (e.g. header rows) are searched as well, the same as in            |
+    | get_rows().                                                                       |
     =====================================================================================
     '''
-    def remove_empty_cells(self):
-        for row in self.rows_ods:
-            cells_to_remove = []
-            cells = row.getElementsByType(TableCell)
-            for cell in cells:
-                repeated = int(cell.getAttribute("numbercolumnsrepeated") or 1)
+    def remove_empty_child_rows(self, parent: Element) -> list:
+        # Calling removeChild() for every empty row is very slow, because every call searches the row in the
+        # list of child nodes and in the caches of the document. Instead, all rows are checked first and the
+        # remaining child nodes are written back in one go.
+        kept, removed = [], []
+        for node in parent.childNodes:
+            qname = getattr(node, "qname", None)
+            if qname == (TABLENS, "table-row") and self.is_row_empty(node):
+                removed.append(node)
+            else:
+                kept.append(node)
 
-                # If more than 10 empty cells in a row.
-                if repeated > 10 and not cell.childNodes:
-                    cells_to_remove.append(cell)
-        
-            for cell in cells_to_remove:
-                row.removeChild(cell)
-        
-        # Update the variable.
-        self.rows_ods = self.sheet.getElementsByType(TableRow)
+            if qname in ROW_GROUPS:
+                removed.extend(self.remove_empty_child_rows(node))
+
+        if len(kept) != len(parent.childNodes):
+            self.replace_child_nodes(parent, kept)
+
+        return removed
 
 
 
     '''
     =====================================================================================
-    | Expand all cells that have "numbercolumnsrepeated" set to 2 or higher.            |
-    |                                                                                   |
-    | When x cells have the same value, ODS only creates one cell in the XML structure  |
-    | but sets "numbercolumnsrepeated" to x, so the Reader knows how often to display   |
-    | the same cell.                                                                    |
-    |                                                                                   |
-    | This leads to problems when using indices. For example: One cell does not have    |
-    | "numbercolumnsrepeated" but the second one has "numbercolumnsrepeated" set to     |
-    | two. This means there are two cells in the XML structure, but the ODS reader      |
-    | displays three cells. Because there are only two cells in the XML structure,      |
-    | calling cells[0] and cells[1] is valid, but cells[2] is not.                      |
-    |                                                                                   |
-    | This function fixes this by expanding repeated cells. This means for every cell   |
-    | in the ODS Reader there is one cell in the XML structure of the file.             |
+    | Replaces all child nodes of an element at once and links the remaining nodes      |
+    | with each other again.                                                            |
     =====================================================================================
     '''
-    def expand_cells(self):
-        for row in self.rows_ods:
-            cells = row.getElementsByType(TableCell)
-            new_cells = []
+    @staticmethod
+    def replace_child_nodes(parent, children: list) -> None:
+        for node in parent.childNodes:
+            node.parentNode = node.previousSibling = node.nextSibling = None
 
-            for cell in cells:
-                repeat = int(cell.getAttribute("numbercolumnsrepeated") or 1)
+        previous = None
+        for node in children:
+            node.parentNode = parent
+            node.previousSibling = previous
+            if previous is not None:
+                previous.nextSibling = node
+            previous = node
 
-                # Avoid expanding large cells (bigger than 10) and cells that are only repeated once.
-                new_cells.append(cell)
-                if repeat == 1 or repeat > 10:
-                    continue
-                
-                # Set repeat to 1.
-                cell.setAttribute("numbercolumnsrepeated", 1)
-
-                # Expand and copy all repeated cells. Leave the expanded cells empty.
-                for _ in range(repeat-1):
-                    new_cell = TableCell()
-                    new_cells.append(new_cell)
-
-            # Remove all cells that were there before...
-            for old_cell in cells:
-                row.removeChild(old_cell)
-            
-            # ...and add the copies and expanded cells.
-            for new_cell in new_cells:
-                row.addElement(new_cell)
+        parent.childNodes[:] = children
+
+
+
+    '''
+    =====================================================================================
+    | Removes elements (and all their child elements) from the element caches of the    |
+    | document. Otherwise they would still be found by getElementsByType().             |
+    =====================================================================================
+    '''
+    def remove_from_caches(self, elements: list) -> None:
+        removed = set()
+        stack = list(elements)
+        while stack:
+            element = stack.pop()
+            removed.add(id(element))
+            stack.extend(e for e in element.childNodes if e.nodeType == e.ELEMENT_NODE)
+
+        # Filter every cached list only once instead of once per removed element.
+        for qname, cached in self.doc.element_dict.items():
+            self.doc.element_dict[qname] = [e for e in cached if id(e) not in removed]
 
 
 
@@ -322,62 +586,86 @@ class ODSHandler():
     | Match all techniques in the change database against the ODS file. If a technique  |
     | from the database is found in the ods file, import it's values. If a technique    |
     | is not found, all values are set to default.                                      |
+    |                                                                                   |
+    | The values are not assigned to the ORM objects one by one. Instead, one mapping   |
+    | per technique is collected and all of them are written with a single bulk UPDATE  |
+    | (executemany) by change_id.                                                       |
     =====================================================================================
     '''
     def import_ods(self, changes: Sequence[MITREChange]):
+        mappings = []
+
         for c in changes:
-            # If a technique is not in the .ods file, set everything to their default value.
-            if c.mitre_id not in self.rows:
-                # Client scores.
-                c.client_criticality, c.client_criticality_sum = 0, 0
-                c.client_evaluation_status = "not evaluated"
-                c.client_reasoning, c.client_measures = "", ""
+            values = self.import_values(self.rows.get(c.mitre_id))
+            values["change_id"] = c.change_id
+            mappings.append(values)
 
-                # Infrastructures scores.
-                c.infra_criticality, c.infra_criticality_sum = 0, 0
-                c.infra_evaluation_status = "not evaluated"
-                c.client_reasoning, c.client_measures = "", ""
+        if mappings:
+            self.db.execute(update(MITREChange), mappings)
+        self.db.commit()
 
-                # Service scores.
-                c.service_criticality, c.service_criticality_sum = 0, 0
-                c.service_evaluation_status = "not evaluated"
-                c.client_reasoning, c.client_measures = "", ""
 
-                # CIA
-                c.confidentiality, c.integrity, c.availability = False, False, False
-            
-            # Else import the data from the row in the .ods file.
-            else:
-                row = self.rows[c.mitre_id].get("row_data")
 
-                # Client Scores.
-                c.client_criticality = 0 if row[COL_CLIENT_CRITICALITY] == "n.a." else row[COL_CLIENT_CRITICALITY]
-                c.client_criticality_sum = 0 if row[COL_CLIENT_CRITICALITY_SUM] == "n.a." else row[COL_CLIENT_CRITICALITY_SUM]
-                c.client_evaluation_status = "n.a." if c.client_criticality == 0 else row[COL_CLIENT_EVALUATION_STATUS]
-                c.client_reasoning = row[COL_CLIENT_REASONING]
-                c.client_measures = row[COL_CLIENT_MEASURES]
+    '''
+    =====================================================================================
+    | Returns the values of a row in the ODS file as a mapping of column name to value  |
+    | for the DB. If a technique is not in the .ods file (row is None), everything is   |
+    | set to their default value.                                                       |
+    | The criticality sums are not imported, see helper.recalculate_sums().             |
+    =====================================================================================
+    '''
+    @staticmethod
+    def import_values(row: StoredRow | None) -> dict:
+        if row is None:
+            return {
+                # Client scores.
+                "client_criticality": 0,
+                "client_evaluation_status": "not evaluated",
+                "client_reasoning": "", "client_measures": "",
 
                 # Infrastructure scores.
-                c.infra_criticality = 0 if row[COL_INFRASTRUCTURE_CRITICALITY] == "n.a." else row[COL_INFRASTRUCTURE_CRITICALITY]
-                c.infra_criticality_sum = 0 if row[COL_INFRASTRUCTURE_CRITICALITY_SUM] == "n.a." else row[COL_INFRASTRUCTURE_CRITICALITY_SUM]
-                c.infra_evaluation_status = "n.a." if c.infra_criticality == 0 else row[COL_INFRASTRUCTURE_EVALUATION_STATUS]
-                c.infra_reasoning = row[COL_INFRASTRUCTURE_REASONING]
-                c.infra_measures = row[COL_INFRASTRUCTURE_MEASURES]
+                "infra_criticality": 0,
+                "infra_evaluation_status": "not evaluated",
+                "infra_reasoning": "", "infra_measures": "",
 
                 # Service scores.
-                c.service_criticality = 0 if row[COL_SERVICE_CRITICALITY] == "n.a." else row[COL_SERVICE_CRITICALITY]
-                c.service_criticality_sum = 0 if row[COL_SERVICE_CRITICALITY_SUM] == "n.a." else row[COL_SERVICE_CRITICALITY_SUM]
-                c.service_evaluation_status = "n.a." if c.service_criticality == 0 else row[COL_SERVICE_EVALUATION_STATUS]
-                c.service_reasoning = row[COL_SERVICE_REASONING]
-                c.service_measures = row[COL_SERVICE_MEASURES]
+                "service_criticality": 0,
+                "service_evaluation_status": "not evaluated",
+                "service_reasoning": "", "service_measures": "",
 
                 # CIA
-                # If "x" then True, else False.
-                c.confidentiality = row[COL_CONFIDENTIALITY] == "x"
-                c.integrity = row[COL_INTEGRITY] == "x"
-                c.availability = row[COL_AVAILABILITY] == "x"
-        
-        self.db.commit()
+                "confidentiality": False, "integrity": False, "availability": False
+            }
+
+        client_criticality = 0 if row[COL_CLIENT_CRITICALITY] == "n.a." else row[COL_CLIENT_CRITICALITY]
+        infra_criticality = 0 if row[COL_INFRASTRUCTURE_CRITICALITY] == "n.a." else row[COL_INFRASTRUCTURE_CRITICALITY]
+        service_criticality = 0 if row[COL_SERVICE_CRITICALITY] == "n.a." else row[COL_SERVICE_CRITICALITY]
+
+        return {
+            # Client Scores.
+            "client_criticality": client_criticality,
+            "client_evaluation_status": "n.a." if client_criticality == 0 else row[COL_CLIENT_EVALUATION_STATUS],
+            "client_reasoning": row[COL_CLIENT_REASONING],
+            "client_measures": row[COL_CLIENT_MEASURES],
+
+            # Infrastructure scores.
+            "infra_criticality": infra_criticality,
+            "infra_evaluation_status": "n.a." if infra_criticality == 0 else row[COL_INFRASTRUCTURE_EVALUATION_STATUS],
+            "infra_reasoning": row[COL_INFRASTRUCTURE_REASONING],
+            "infra_measures": row[COL_INFRASTRUCTURE_MEASURES],
+
+            # Service scores.
+            "service_criticality": service_criticality,
+            "service_evaluation_status": "n.a." if service_criticality == 0 else row[COL_SERVICE_EVALUATION_STATUS],
+            "service_reasoning": row[COL_SERVICE_REASONING],
+            "service_measures": row[COL_SERVICE_MEASURES],
+
+            # CIA
+            # If "x" then True, else False.
+            "confidentiality": row[COL_CONFIDENTIALITY] == "x",
+            "integrity": row[COL_INTEGRITY] == "x",
+            "availability": row[COL_AVAILABILITY] == "x"
+        }
 
 
 
@@ -408,6 +696,67 @@ class ODSHandler():
 
 
 
+    '''
+    =====================================================================================
+    | Small helper function that returns all cells of a change that are exported into   |
+    | an existing row as (column index, value) pairs.                                   |
+    | Criticality Sums don't need to be exported since they are calculated by a formula |
+    | in the file.                                                                      |
+    =====================================================================================
+    '''
+    @staticmethod
+    def export_values(change: MITREChange) -> list:
+        return [
+            # Client Scores.
+            (COL_CLIENT_CRITICALITY, change.client_criticality),
+            (COL_CLIENT_EVALUATION_STATUS, change.client_evaluation_status),
+            (COL_CLIENT_REASONING, change.client_reasoning),
+            (COL_CLIENT_MEASURES, change.client_measures),
+
+            # Infrastructure Scores.
+            (COL_INFRASTRUCTURE_CRITICALITY, change.infra_criticality),
+            (COL_INFRASTRUCTURE_EVALUATION_STATUS, change.infra_evaluation_status),
+            (COL_INFRASTRUCTURE_REASONING, change.infra_reasoning),
+            (COL_INFRASTRUCTURE_MEASURES, change.infra_measures),
+
+            # Service Scores.
+            (COL_SERVICE_CRITICALITY, change.service_criticality),
+            (COL_SERVICE_EVALUATION_STATUS, change.service_evaluation_status),
+            (COL_SERVICE_REASONING, change.service_reasoning),
+            (COL_SERVICE_MEASURES, change.service_measures),
+
+            # CIA
+            (COL_CONFIDENTIALITY, "x" if change.confidentiality else ""),
+            (COL_INTEGRITY, "x" if change.integrity else ""),
+            (COL_AVAILABILITY, "x" if change.availability else "")
+        ]
+
+
+
+    '''
+    =====================================================================================
+    | Compares the export values of a change with the values of its row in the file and |
+    | returns only the cells that differ as (column index, old value, new value).       |
+    | A criticality of 0 is imported from "n.a.", so both are treated as equal.         |
+    =====================================================================================
+    '''
+    def diff_values(self, change: MITREChange) -> list:
+        row = self.rows[change.mitre_id]
+        diff = []
+
+        for col_index, value in self.export_values(change):
+            old_value = row[col_index]
+            new_value = "" if value is None else value
+
+            if old_value == new_value or (old_value == "n.a." and new_value == 0):
+                continue
+
+            diff.append((col_index, old_value, new_value))
+
+        return diff
+
+
+
     '''
     =====================================================================================
     | This function exports the SQLite database and all changes made during the upgrade |
@@ -416,36 +765,441 @@ class ODSHandler():
     | when new rows are added.                                                          |
     =====================================================================================
     '''
-    def export_ods(self, file_path: str, changes: Sequence[MITREChange]):
-        for c in changes:
-            # If a row doesn't exist append it (e.g. new techniques).
+    def export_ods(self, file_path: str, changes: Sequence[MITREChange], progress: Callable = None):
+        additions = []
+
+        for i, c in enumerate(changes):
+            # Report how many rows have been processed so far.
+            if progress:
+                progress(i, len(changes), "rows")
+
+            # If a row doesn't exist append it later (e.g. new techniques).
             if c.mitre_id not in self.rows:
-                self.append_row(self.create_row(c))
+                additions.append(self.create_row(c))
             
-            # Only export techniques with 0 sub-techniques.
+            # Only the cells that differ from the file are written.
             else:
-                row_index = self.rows[c.mitre_id].get("row_index")
-
-                self.set_cell(row_index, COL_CLIENT_CRITICALITY, c.client_criticality)
-                self.set_cell(row_index, COL_CLIENT_EVALUATION_STATUS, c.client_evaluation_status)
-                self.set_cell(row_index, COL_CLIENT_REASONING, c.client_reasoning)
-                self.set_cell(row_index, COL_CLIENT_MEASURES, c.client_measures)
+                values = [(col_index, value) for col_index, _, value in self.diff_values(c)]
+                if not values:
+                    continue
 
-                # Infrastructure Scores.
-                self.set_cell(row_index, COL_INFRASTRUCTURE_CRITICALITY, c.infra_criticality)
-                self.set_cell(row_index, COL_INFRASTRUCTURE_EVALUATION_STATUS, c.infra_evaluation_status)
-                self.set_cell(row_index, COL_INFRASTRUCTURE_REASONING, c.infra_reasoning)
-                self.set_cell(row_index, COL_INFRASTRUCTURE_MEASURES, c.infra_measures)
+                # All cells of the row are changed at once.
+                self.set_cells(self.rows.row_index(c.mitre_id), values)
 
-                # Service Scores.
-                self.set_cell(row_index, COL_SERVICE_CRITICALITY, c.service_criticality)
-                self.set_cell(row_index, COL_SERVICE_EVALUATION_STATUS, c.service_evaluation_status)
-                self.set_cell(row_index, COL_SERVICE_REASONING, c.service_reasoning)
-                self.set_cell(row_index, COL_SERVICE_MEASURES, c.service_measures)
+        # Empty rows are only removed if rows are added, so new rows come directly after the existing rows.
+        # This has to happen after changing the existing rows, because the row indices change.
+        if additions:
+            self.remove_empty_rows()
+            for values in additions:
+                self.append_row(values)
 
-                # CIA
-                self.set_cell(row_index, COL_CONFIDENTIALITY, "x" if c.confidentiality else "")
-                self.set_cell(row_index, COL_INTEGRITY, "x" if c.integrity else "")
-                self.set_cell(row_index, COL_AVAILABILITY, "x" if c.availability else "")
+        if progress:
+            progress(len(changes), len(changes), "saving")
         
-        self.doc.save(file_path)
\ No newline at end of file
+        self.doc.save(file_path)
+
+
+
+    '''
+    =====================================================================================
+    | Exports the changes like export_ods(), but without loading the whole document.    |
+    |                                                                                   |
+    | content.xml is streamed from the original file into the new file. Only the rows   |
+    | of changed techniques are rewritten, new techniques are added after the last      |
+    | non-empty row. All other files in the ODS file (styles, images, meta data, ...)   |
+    | are copied unchanged.                                                             |
+    |                                                                                   |
+    | Needs the rows from stream_rows(), so the handler can be created with             |
+    | read_only=True.                                                                   |
+    =====================================================================================
+    '''
+    def export_ods_streaming(self, file_path: str, changes: Sequence[MITREChange], progress: Callable = None):
+        # Cells to change per row index and rows to add.
+        patches = {}
+        additions = []
+        for c in changes:
+            if c.mitre_id not in self.rows:
+                additions.append(self.create_row(c))
+            else:
+                # Only the cells that differ from the file are patched. Rows without differences are copied unchanged.
+                values = [(col_index, value) for col_index, _, value in self.diff_values(c)]
+                if values:
+                    patches[self.rows.row_index(c.mitre_id)] = values
+
+        with zipfile.ZipFile(self.file_path) as source, zipfile.ZipFile(file_path, "w") as target:
+            # Keep the order of the files, because "mimetype" has to be the first file in the ODS file.
+            for info in source.infolist():
+                with source.open(info) as src, target.open(info, "w") as dst:
+                    if info.filename == "content.xml":
+                        ODSPatcher(self.sheet_name, patches, additions, progress).patch(src, dst)
+                    else:
+                        shutil.copyfileobj(src, dst)
+
+
+
+
+
+
+'''
+=====================================================================================
+| Helper class that streams content.xml of an ODS file and rewrites single rows of  |
+| a worksheet without parsing the whole document.                                   |
+|                                                                                   |
+| content.xml is split into rows and everything in between. Everything except the   |
+| rows that have to be changed is written to the new file unchanged.                |
+=====================================================================================
+'''
+class ODSPatcher():
+
+    # Size of the chunks that are read from content.xml.
+    CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, sheet_name: str, patches: dict, additions: list, progress: Callable = None):
+        self.sheet_name: str = sheet_name
+        self.patches: dict = patches # Row index -> list of (column index, value).
+        self.additions: list = additions # Rows that are added after the last non-empty row.
+        self.progress: Callable = progress # Called with (rows processed, total rows, phase).
+        self.rows_processed: int = 0
+
+
+
+    '''
+    =====================================================================================
+    | Reads the namespace prefixes from the root element of content.xml. All tags are   |
+    | searched and written with these prefixes (normally "table:", "office:", ...).     |
+    =====================================================================================
+    '''
+    def read_namespaces(self, root_tag: bytes) -> None:
+        self.namespaces: dict = {uri.decode(): prefix.decode() for prefix, uri in re.findall(rb'xmlns:([\w.-]+)="([^"]*)"', root_tag)}
+
+        if TABLENS not in self.namespaces or OFFICENS not in self.namespaces:
+            raise ODSException("content.xml cannot be patched, the namespaces are not declared in the root element.")
+
+        table = re.escape(self.namespaces[TABLENS].encode())
+        office = re.escape(self.namespaces[OFFICENS].encode())
+
+        # Start of a table, end of a table and start of a row. Other tags like "table:table-row-group" don't match.
+        self.tag_pattern = re.compile(rb"<(/?)" + table + rb":table(-row)?(?=[\s/>])")
+        self.row_end = b"</" + table + b":table-row>"
+        self.cell_end = b"</" + table + b":table-cell>"
+        self.value_pattern = re.compile(rb"\s" + office + rb":value=")
+        self.name_pattern = re.compile(rb"\s" + table + rb':name="([^"]*)"')
+
+        # Declarations for parsing single rows.
+        self.declarations = root_tag[root_tag.index(b" "):].rstrip(b">").rstrip()
+
+
+
+    '''
+    =====================================================================================
+    | Splits content.xml into parts: ("table", start tag of a table), ("table-end",     |
+    | end tag of a table), ("row", complete row) and ("other", everything else).        |
+    | Only a small part of the file is kept in memory at any time.                      |
+    =====================================================================================
+    '''
+    def iter_parts(self, src):
+        buffer = b""
+        eof = False
+
+        def read_more() -> bool:
+            nonlocal buffer, eof
+            chunk = src.read(self.CHUNK_SIZE)
+            eof = not chunk
+            buffer += chunk
+            return not eof
+
+        # The root element (the first tag after the XML declaration) contains all namespace declarations.
+        root_pattern = re.compile(rb"<[^?!][^>]*>")
+        while not (root := root_pattern.search(buffer)):
+            if not read_more():
+                raise ODSException("content.xml is not a valid ODS document.")
+
+        root_start, root_end = root.span()
+        self.read_namespaces(buffer[root_start:root_end])
+        yield "other", buffer[:root_end]
+        buffer = buffer[root_end:]
+
+        while True:
+            match = self.tag_pattern.search(buffer)
+
+            # No tag found. Keep the end of the buffer since it could contain the start of a tag.
+            if not match:
+                if eof:
+                    yield "other", buffer
+                    return
+
+                keep = 64
+                if len(buffer) > keep:
+                    yield "other", buffer[:-keep]
+                    buffer = buffer[-keep:]
+                read_more()
+                continue
+
+            end_tag, row = match.group(1), match.group(2)
+
+            # Find the end of the tag or the end of the row.
+            if row:
+                tag_end = buffer.find(b">", match.end())
+                if tag_end != -1 and buffer[tag_end - 1:tag_end] == b"/":
+                    part_end = tag_end + 1
+                else:
+                    part_end = buffer.find(self.row_end, match.end())
+                    part_end = part_end + len(self.row_end) if part_end != -1 else -1
+            else:
+                part_end = buffer.find(b">", match.end())
+                part_end = part_end + 1 if part_end != -1 else -1
+
+            if part_end == -1:
+                if eof:
+                    raise ODSException("content.xml is not a valid ODS document.")
+                read_more()
+                continue
+
+            if match.start():
+                yield "other", buffer[:match.start()]
+
+            kind = "row" if row else "table-end" if end_tag else "table"
+
+            # A row only contains the start tag of the row itself. Any other start tag belongs to a nested table.
+            if row and any(not m.group(1) for m in self.tag_pattern.finditer(buffer, match.end(), part_end)):
+                raise ODSException("content.xml cannot be patched, it contains nested tables.")
+
+            yield kind, buffer[match.start():part_end]
+            buffer = buffer[part_end:]
+
+
+
+    '''
+    =====================================================================================
+    | Streams content.xml from src to dst and changes the rows of the worksheet.        |
+    |                                                                                   |
+    | Like in ODSHandler.export_ods(), empty rows are only removed if rows are added,   |
+    | so new rows come directly after the existing rows. Otherwise the row limit        |
+    | (~ 1.000.000) could be reached, since our ODS file has lots of empty rows at the  |
+    | end (see remove_empty_rows()).                                                    |
+    |                                                                                   |
+    | Tables inside of tables (sub-tables in cells) can't be split into rows with the   |
+    | patterns, so an ODSException is raised for them and the DOM export is used.       |
+    =====================================================================================
+    '''
+    def patch(self, src, dst) -> None:
+        in_sheet = False
+        in_table = False
+        row_index = -1
+        compact = bool(self.additions)
+
+        for kind, data in self.iter_parts(src):
+            if kind == "table":
+                if in_table:
+                    raise ODSException("content.xml cannot be patched, it contains nested tables.")
+
+                name = self.name_pattern.search(data)
+                in_sheet = name is not None and html.unescape(name.group(1).decode()) == self.sheet_name
+                in_table = not data.endswith(b"/>")
+
+            elif kind == "row" and in_sheet:
+                row_index += 1
+                if row_index in self.patches:
+                    data = self.patch_row(data, self.patches[row_index])
+                    self.report_progress(1)
+
+                if compact and self.is_row_empty(data):
+                    continue
+
+            elif kind == "table-end":
+                if in_sheet:
+                    for values in self.additions:
+                        dst.write(self.serialize(self.create_row(values)))
+                        self.report_progress(1)
+
+                in_sheet = in_table = False
+
+            dst.write(data)
+
+        # All rows have been written, the rest of the ODS file is only copied.
+        if self.progress:
+            self.progress(self.rows_processed, len(self.patches) + len(self.additions), "saving")
+
+
+
+    '''
+    =====================================================================================
+    | Reports the number of processed rows, if a progress callback was given.           |
+    =====================================================================================
+    '''
+    def report_progress(self, rows: int) -> None:
+        self.rows_processed += rows
+
+        if self.progress:
+            self.progress(self.rows_processed, len(self.patches) + len(self.additions), "rows")
+
+
+
+    '''
+    =====================================================================================
+    | Checks if all cells of a row are empty, like ODSHandler.is_row_empty(). A cell    |
+    | with content always has an end tag, empty cells are written as <cell/>.           |
+    =====================================================================================
+    '''
+    def is_row_empty(self, row: bytes) -> bool:
+        return self.cell_end not in row and not self.value_pattern.search(row)
+
+
+
+    '''
+    =====================================================================================
+    | Changes the cells of a single row and returns the new XML of the row.             |
+    | Works like ODSHandler.set_cell(): repeated cells are split up, missing cells are  |
+    | added and all previous content of the changed cells is removed.                   |
+    =====================================================================================
+    '''
+    def patch_row(self, data: bytes, values: list) -> bytes:
+        wrapper = ElementTree.fromstring(b"<wrapper " + self.declarations + b">" + data + b"</wrapper>")
+        row = wrapper[0]
+
+        # A changed row is never repeated.
+        row.attrib.pop(ATTR_ROWS_REPEATED, None)
+
+        col_limit = max(col_index for col_index, _ in values) + 1
+        cells = self.expand_cells(row, col_limit)
+
+        for col_index, value in values:
+            self.set_cell(cells[col_index], value)
+
+        return self.serialize(row)
+
+
+
+    '''
+    =====================================================================================
+    | Makes sure the first col_limit cells of a row are single cells (not repeated) and |
+    | returns them as a list. Cells are added if the row is too short.                  |
+    =====================================================================================
+    '''
+    @staticmethod
+    def expand_cells(row, col_limit: int) -> list:
+        cells = []
+
+        for cell in list(row):
+            if len(cells) >= col_limit:
+                break
+
+            if cell.tag != TAG_TABLE_CELL:
+                continue
+
+            repeat = int(cell.get(ATTR_COLUMNS_REPEATED) or 1)
+            if repeat == 1:
+                cells.append(cell)
+                continue
+
+            # Split the repeated cell into single cells up to col_limit and keep the rest repeated.
+            single = min(repeat, col_limit - len(cells))
+            cell.attrib.pop(ATTR_COLUMNS_REPEATED)
+            copies = [cell] + [copy.deepcopy(cell) for _ in range(single - 1)]
+            cells.extend(copies)
+
+            if repeat > single:
+                rest = copy.deepcopy(cell)
+                rest.set(ATTR_COLUMNS_REPEATED, str(repeat - single))
+                copies.append(rest)
+
+            index = list(row).index(cell)
+            row[index:index + 1] = copies
+
+        while len(cells) < col_limit:
+            cell = ElementTree.SubElement(row, TAG_TABLE_CELL)
+            cells.append(cell)
+
+        return cells
+
+
+
+    '''
+    =====================================================================================
+    | Replaces the content of a cell with a new value, like ODSHandler.set_cell().      |
+    =====================================================================================
+    '''
+    @staticmethod
+    def set_cell(cell, value: int|float|str) -> None:
+        # Remove all existing childnodes (e.g. P nodes for text).
+        for child in list(cell):
+            cell.remove(child)
+        cell.text = None
+
+        # Remove all attributes that could contain values, datatypes and formulas.
+        for key in list(cell.attrib):
+            ns, _, name = key[1:].partition("}")
+            if name == "value-type" or (ns == OFFICENS and name in ("value", "string-value", "date-value", "boolean-value", "time-value", "currency")) or key == ATTR_FORMULA:
+                del cell.attrib[key]
+
+        # ODS uses float for all numbers. The text is stored as string nevertheless.
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            cell.set(ATTR_VALUE_TYPE, "float")
+            cell.set(ATTR_VALUE, str(float(value)))
+        else:
+            cell.set(ATTR_VALUE_TYPE, "string")
+
+        ElementTree.SubElement(cell, TAG_P).text = "" if value is None else str(value)
+
+
+
+    '''
+    =====================================================================================
+    | Creates a new row element with the values of ODSHandler.create_row().             |
+    =====================================================================================
+    '''
+    def create_row(self, values: list):
+        row = ElementTree.Element(TAG_TABLE_ROW)
+        for value in values:
+            self.set_cell(ElementTree.SubElement(row, TAG_TABLE_CELL), value)
+
+        return row
+
+
+
+    '''
+    =====================================================================================
+    | Writes an element as XML with the namespace prefixes of content.xml, so the       |
+    | changed rows look exactly like the rest of the file.                              |
+    =====================================================================================
+    '''
+    def serialize(self, element) -> bytes:
+        parts = []
+        self.serialize_element(element, parts)
+        return "".join(parts).encode("utf-8")
+
+
+
+    def serialize_element(self, element, parts: list) -> None:
+        parts.append(f"<{self.qualified_name(element.tag)}")
+        for key, value in element.attrib.items():
+            parts.append(f" {self.qualified_name(key)}={quoteattr(value, {chr(10): '&#10;', chr(9): '&#9;'})}")
+
+        if len(element) == 0 and not element.text:
+            parts.append("/>")
+        else:
+            parts.append(">")
+            parts.append(escape(element.text or ""))
+            for child in element:
+                self.serialize_element(child, parts)
+                parts.append(escape(child.tail or ""))
+            parts.append(f"</{self.qualified_name(element.tag)}>")
+
+
+
+    '''
+    =====================================================================================
+    | Returns the name of a tag or attribute with the prefix of its namespace. Only the |
+    | namespaces of the root element are known, so an ODSException is raised for        |
+    | namespaces that are declared further down and the DOM export is used instead.     |
+    =====================================================================================
+    '''
+    def qualified_name(self, name: str) -> str:
+        if not name.startswith("{"):
+            return name
+
+        ns, _, local = name[1:].partition("}")
+        if ns not in self.namespaces:
+            raise ODSException(f"content.xml cannot be patched, the namespace {ns} is not declared in the root element.")
+
+        return f"{self.namespaces[ns]}:{local}"
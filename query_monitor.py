@@ -0,0 +1,261 @@
+# Development/CI checks for the SQL queries of the tool: slow-query log, N+1 detection and query budgets.
+from flask import Flask, Response, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from contextlib import contextmanager
+import logging, os, re, threading, time
+
+# The checks are disabled by default. Enable them with ESE_QUERY_DEBUG=1.
+QUERY_DEBUG_ENABLED = os.environ.get("ESE_QUERY_DEBUG", "").lower() in ("1", "true", "yes")
+
+logger = logging.getLogger("ese.queries")
+
+
+
+'''
+=====================================================================================
+| Custom Exception that will be raised in strict mode if a request executes more    |
+| queries than its budget allows.                                                   |
+=====================================================================================
+'''
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+
+'''
+=====================================================================================
+| Parses query budgets in the format "endpoint=max_queries,endpoint=max_queries",   |
+| e.g. "links=3,upgrade=5".                                                         |
+=====================================================================================
+'''
+def parse_budgets(value: str) -> dict:
+    budgets = {}
+
+    for entry in value.split(","):
+        if "=" not in entry:
+            continue
+
+        endpoint, max_queries = entry.split("=", 1)
+        budgets[endpoint.strip()] = int(max_queries)
+
+    return budgets
+
+
+
+'''
+=====================================================================================
+| Watches all SQL statements of an engine.                                          |
+|                                                                                   |
+| - Statements that take longer than slow_query_ms are logged together with their   |
+|   EXPLAIN QUERY PLAN, so missing indexes are easy to spot.                        |
+| - Statements with the same shape (same SQL, different parameters) that are        |
+|   executed at least n_plus_one_threshold times in one request are logged as N+1   |
+|   candidates, e.g. a lazy loaded attribute that is accessed in a loop.            |
+| - If a budget is set for an endpoint, requests with more queries are logged. In   |
+|   strict mode QueryBudgetExceeded is raised instead, so tests fail.               |
+=====================================================================================
+'''
+class QueryMonitor():
+
+    def __init__(self, slow_query_ms: float, n_plus_one_threshold: int, budgets: dict, strict: bool):
+        self.slow_query_ms: float = slow_query_ms
+        self.n_plus_one_threshold: int = n_plus_one_threshold
+        self.budgets: dict = budgets # Endpoint -> maximum number of queries per request.
+        self.strict: bool = strict
+
+        # Statements of the current request per thread. None outside of a request.
+        self.local = threading.local()
+
+
+
+    '''
+    =====================================================================================
+    | Creates a monitor with the settings from the environment variables:               |
+    | ESE_SLOW_QUERY_MS, ESE_N_PLUS_ONE_THRESHOLD, ESE_QUERY_BUDGETS and                |
+    | ESE_QUERY_BUDGET_STRICT.                                                          |
+    =====================================================================================
+    '''
+    @staticmethod
+    def from_environment() -> "QueryMonitor":
+        return QueryMonitor(
+            slow_query_ms=float(os.environ.get("ESE_SLOW_QUERY_MS", 50)),
+            n_plus_one_threshold=int(os.environ.get("ESE_N_PLUS_ONE_THRESHOLD", 5)),
+            budgets=parse_budgets(os.environ.get("ESE_QUERY_BUDGETS", "")),
+            strict=os.environ.get("ESE_QUERY_BUDGET_STRICT", "").lower() in ("1", "true", "yes")
+        )
+
+
+
+    '''
+    =====================================================================================
+    | Starts recording the statements of a request in the current thread.               |
+    =====================================================================================
+    '''
+    def start(self) -> None:
+        self.local.statements = []
+
+
+
+    '''
+    =====================================================================================
+    | Stops recording and returns the recorded statements.                              |
+    =====================================================================================
+    '''
+    def stop(self) -> list:
+        statements = getattr(self.local, "statements", None) or []
+        self.local.statements = None
+        return statements
+
+
+
+    '''
+    =====================================================================================
+    | Returns the shape of a statement: the SQL with all whitespace collapsed. The      |
+    | parameters are already placeholders, so the shape is the same for every value.    |
+    =====================================================================================
+    '''
+    @staticmethod
+    def shape(statement: str) -> str:
+        return re.sub(r"\s+", " ", statement).strip()
+
+
+
+    '''
+    =====================================================================================
+    | Registers the engine events that time and record every statement.                 |
+    =====================================================================================
+    '''
+    def instrument_engine(self, engine: Engine) -> None:
+        @event.listens_for(engine, "before_cursor_execute")
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            conn.info.setdefault("monitor_start", []).append(time.perf_counter())
+
+        @event.listens_for(engine, "after_cursor_execute")
+        def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            milliseconds = (time.perf_counter() - conn.info["monitor_start"].pop()) * 1000
+
+            # The EXPLAIN statement itself is executed on the same connection and must not be recorded again.
+            if conn.info.get("monitor_explaining"):
+                return
+
+            shape = self.shape(statement)
+            statements = getattr(self.local, "statements", None)
+            if statements is not None:
+                statements.append(shape)
+
+            for recorder in getattr(self.local, "recorders", []):
+                recorder.append(shape)
+
+            if milliseconds >= self.slow_query_ms:
+                self.log_slow_query(conn, statement, parameters, executemany, milliseconds)
+
+
+
+    '''
+    =====================================================================================
+    | Logs a slow statement with its query plan. The plan is only determined for single |
+    | SELECT statements, since other statements would be executed again.                |
+    =====================================================================================
+    '''
+    def log_slow_query(self, conn, statement: str, parameters, executemany: bool, milliseconds: float) -> None:
+        plan = "(no plan)"
+
+        if not executemany and statement.lstrip().upper().startswith("SELECT"):
+            conn.info["monitor_explaining"] = True
+            try:
+                rows = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters).fetchall()
+                plan = "\n".join(f"    {row[-1]}" for row in rows)
+            except Exception as e:
+                plan = f"(EXPLAIN failed: {e})"
+            finally:
+                conn.info["monitor_explaining"] = False
+
+        logger.warning("Slow query (%.1f ms): %s\n%s", milliseconds, self.shape(statement), plan)
+
+
+
+    '''
+    =====================================================================================
+    | Checks the statements of a finished request for N+1 candidates and the budget of  |
+    | the endpoint.                                                                     |
+    =====================================================================================
+    '''
+    def check(self, endpoint: str, statements: list) -> None:
+        counts = {}
+        for statement in statements:
+            counts[statement] = counts.get(statement, 0) + 1
+
+        for statement, count in counts.items():
+            if count >= self.n_plus_one_threshold:
+                logger.warning("Possible N+1 in %s: %d identical queries: %s", endpoint, count, statement)
+
+        budget = self.budgets.get(endpoint)
+        if budget is not None and len(statements) > budget:
+            message = f"{endpoint} executed {len(statements)} queries, but the budget is {budget}."
+            if self.strict:
+                raise QueryBudgetExceeded(message)
+
+            logger.error(message)
+
+
+
+    '''
+    =====================================================================================
+    | Context manager for tests: fails if the code inside executes more than            |
+    | max_queries statements in the current thread, including the statements of test    |
+    | client requests, e.g.                                                             |
+    |     with query_monitor.expect_queries(3):                                         |
+    |         client.post("/api/links", json=...)                                       |
+    =====================================================================================
+    '''
+    @contextmanager
+    def expect_queries(self, max_queries: int):
+        recorder = []
+        self.local.recorders = getattr(self.local, "recorders", []) + [recorder]
+
+        try:
+            yield recorder
+        finally:
+            self.local.recorders.remove(recorder)
+
+        if len(recorder) > max_queries:
+            raise QueryBudgetExceeded(f"Expected at most {max_queries} queries, but {len(recorder)} were executed:\n" + "\n".join(recorder))
+
+
+
+    '''
+    =====================================================================================
+    | Registers the request hooks that check every request.                             |
+    =====================================================================================
+    '''
+    def instrument_app(self, app: Flask) -> None:
+        @app.before_request
+        def before_request():
+            self.start()
+
+        @app.after_request
+        def after_request(response: Response) -> Response:
+            statements = self.stop()
+            self.check(request.endpoint or "unknown", statements)
+            return response
+
+
+
+    '''
+    =====================================================================================
+    | Instruments the engine and the Flask app.                                         |
+    =====================================================================================
+    '''
+    def instrument(self, app: Flask, engine: Engine) -> None:
+        # Make sure the warnings are shown even if logging hasn't been configured.
+        if not logger.handlers and not logging.getLogger().handlers:
+            logging.basicConfig(level=logging.INFO)
+
+        self.instrument_engine(engine)
+        self.instrument_app(app)
+
+
+
+# Monitor that is used by the tool.
+query_monitor = QueryMonitor.from_environment()
@@ -0,0 +1,252 @@
+# Compact storage for the rows that are read from a spreadsheet file.
+from constants import *
+from array import array
+import sys
+
+# Columns that are kept from every row. All other columns (tactics, technique, ...) are never used.
+STORED_COLUMNS = [
+    COL_MITREID,
+    COL_CLIENT_CRITICALITY, COL_INFRASTRUCTURE_CRITICALITY, COL_SERVICE_CRITICALITY,
+    COL_CONFIDENTIALITY, COL_INTEGRITY, COL_AVAILABILITY,
+    COL_CLIENT_CRITICALITY_SUM, COL_CLIENT_EVALUATION_STATUS, COL_CLIENT_REASONING, COL_CLIENT_MEASURES,
+    COL_INFRASTRUCTURE_CRITICALITY_SUM, COL_INFRASTRUCTURE_EVALUATION_STATUS, COL_INFRASTRUCTURE_REASONING, COL_INFRASTRUCTURE_MEASURES,
+    COL_SERVICE_CRITICALITY_SUM, COL_SERVICE_EVALUATION_STATUS, COL_SERVICE_REASONING, COL_SERVICE_MEASURES
+]
+
+# Columns that (almost always) contain integers. They are stored in arrays instead of lists of int objects.
+INTEGER_COLUMNS = {
+    COL_CLIENT_CRITICALITY, COL_INFRASTRUCTURE_CRITICALITY, COL_SERVICE_CRITICALITY,
+    COL_CLIENT_CRITICALITY_SUM, COL_INFRASTRUCTURE_CRITICALITY_SUM, COL_SERVICE_CRITICALITY_SUM
+}
+
+# Common values in integer columns that are not integers. They are stored in the array as the smallest 64 bit
+# integers (SPECIAL_VALUES[0] is stored as -2**63, SPECIAL_VALUES[1] as -2**63 + 1, ...).
+SPECIAL_VALUES = [None, "", "n.a."]
+SPECIAL_MIN = -2**63
+SPECIAL_MAX = SPECIAL_MIN + len(SPECIAL_VALUES) - 1
+
+# Columns with only a few different values ("x", "partial", "not evaluated", ...). The strings are interned, so
+# every row points to the same string object.
+INTERNED_COLUMNS = {
+    COL_CONFIDENTIALITY, COL_INTEGRITY, COL_AVAILABILITY,
+    COL_CLIENT_EVALUATION_STATUS, COL_INFRASTRUCTURE_EVALUATION_STATUS, COL_SERVICE_EVALUATION_STATUS
+}
+
+
+
+'''
+=====================================================================================
+| Column-based storage for the rows of a worksheet, used by XLSXHandler and         |
+| ODSHandler.                                                                       |
+|                                                                                   |
+| Instead of one list (padded to 25 values) per row, every column in                |
+| STORED_COLUMNS is a single list or array. A row is only a position in these       |
+| columns. Integer columns are stored as arrays of 64 bit integers. Empty cells and |
+| "n.a." are stored as special integers (see SPECIAL_VALUES), any other value that  |
+| is not an integer is stored in a separate dictionary.                             |
+|                                                                                   |
+| Rows are looked up by MITRE ID in O(1), like the dictionaries used before. If a   |
+| MITRE ID appears more than once, the last row wins.                               |
+=====================================================================================
+'''
+class RowStore():
+
+    def __init__(self):
+        self.positions: dict = {} # MITRE ID -> position of the row in the columns.
+        self.columns: dict = {col_index: array("q") if col_index in INTEGER_COLUMNS else [] for col_index in STORED_COLUMNS}
+        self.other_values: dict = {} # (column index, position) -> value that is not an integer in an integer column.
+        self.row_indices: array = array("q") # Position of the row in the worksheet (only used for ODS files).
+
+
+
+    '''
+    =====================================================================================
+    | Adds a row. values is the list of all values of the row, row_index is the         |
+    | position of the row in the worksheet.                                             |
+    =====================================================================================
+    '''
+    def add(self, mitre_id, values: list, row_index: int = -1) -> None:
+        position = self.positions.get(mitre_id)
+
+        # New MITRE ID: add an empty slot to every column.
+        if position is None:
+            position = len(self.row_indices)
+            self.positions[mitre_id] = position
+            self.row_indices.append(row_index)
+            for col_index, column in self.columns.items():
+                column.append(SPECIAL_MIN if col_index in INTEGER_COLUMNS else None)
+        else:
+            self.row_indices[position] = row_index
+
+        for col_index, column in self.columns.items():
+            value = values[col_index] if col_index < len(values) else None
+            self.set_value(col_index, column, position, value)
+
+
+
+    '''
+    =====================================================================================
+    | Stores a single value in a column.                                                |
+    =====================================================================================
+    '''
+    def set_value(self, col_index: int, column, position: int, value) -> None:
+        if col_index in INTEGER_COLUMNS:
+            self.other_values.pop((col_index, position), None)
+
+            # bool is a subclass of int, but has to be returned as bool again. Integers that don't fit into
+            # 64 bits are stored like any other value.
+            if type(value) is int and SPECIAL_MAX < value < 2**63:
+                column[position] = value
+            elif type(value) is not int and value in SPECIAL_VALUES:
+                column[position] = SPECIAL_MIN + SPECIAL_VALUES.index(value)
+            else:
+                column[position] = SPECIAL_MIN
+                self.other_values[(col_index, position)] = value
+            return
+
+        if col_index in INTERNED_COLUMNS and type(value) is str:
+            value = sys.intern(value)
+
+        column[position] = value
+
+
+
+    '''
+    =====================================================================================
+    | Returns a single value of a row by position and column index. Columns that are    |
+    | not stored return None.                                                           |
+    =====================================================================================
+    '''
+    def get_value(self, position: int, col_index: int):
+        column = self.columns.get(col_index)
+        if column is None:
+            return None
+
+        value = column[position]
+
+        if col_index in INTEGER_COLUMNS and value <= SPECIAL_MAX:
+            if (col_index, position) in self.other_values:
+                return self.other_values[(col_index, position)]
+            return SPECIAL_VALUES[value - SPECIAL_MIN]
+
+        return value
+
+
+
+    '''
+    =====================================================================================
+    | Returns the row of a MITRE ID or None if the MITRE ID is not in the worksheet.    |
+    =====================================================================================
+    '''
+    def get(self, mitre_id):
+        position = self.positions.get(mitre_id)
+        return None if position is None else StoredRow(self, position)
+
+
+
+    '''
+    =====================================================================================
+    | Returns the row of a MITRE ID. Raises a KeyError if the MITRE ID doesn't exist.   |
+    =====================================================================================
+    '''
+    def __getitem__(self, mitre_id):
+        return StoredRow(self, self.positions[mitre_id])
+
+
+
+    '''
+    =====================================================================================
+    | Checks if a MITRE ID is in the worksheet.                                         |
+    =====================================================================================
+    '''
+    def __contains__(self, mitre_id) -> bool:
+        return mitre_id in self.positions
+
+
+
+    '''
+    =====================================================================================
+    | Returns the number of rows.                                                       |
+    =====================================================================================
+    '''
+    def __len__(self) -> int:
+        return len(self.positions)
+
+
+
+    '''
+    =====================================================================================
+    | Iterates over the MITRE IDs of all rows.                                          |
+    =====================================================================================
+    '''
+    def __iter__(self):
+        return iter(self.positions)
+
+
+
+    '''
+    =====================================================================================
+    | Returns the position of a row in the worksheet.                                   |
+    =====================================================================================
+    '''
+    def row_index(self, mitre_id) -> int:
+        return self.row_indices[self.positions[mitre_id]]
+
+
+
+    '''
+    =====================================================================================
+    | Returns the stored values of a row as a tuple (in the order of STORED_COLUMNS),   |
+    | e.g. for hashing.                                                                 |
+    =====================================================================================
+    '''
+    def values(self, mitre_id) -> tuple:
+        position = self.positions[mitre_id]
+        return tuple(self.get_value(position, col_index) for col_index in STORED_COLUMNS)
+
+
+
+    '''
+    =====================================================================================
+    | Estimates the memory used by the store.                                           |
+    =====================================================================================
+    '''
+    def estimate_size(self) -> int:
+        size = sys.getsizeof(self.positions) + sys.getsizeof(self.other_values) + sys.getsizeof(self.row_indices)
+        size += sum(sys.getsizeof(mitre_id) for mitre_id in self.positions)
+
+        for col_index, column in self.columns.items():
+            size += sys.getsizeof(column)
+
+            # Interned strings are shared between the rows and are only counted once.
+            if col_index in INTERNED_COLUMNS:
+                size += sum(sys.getsizeof(value) for value in set(column))
+            elif col_index not in INTEGER_COLUMNS:
+                size += sum(sys.getsizeof(value) for value in column)
+
+        return size
+
+
+
+'''
+=====================================================================================
+| A single row of a RowStore. The values are accessed by column index, just like a  |
+| list of all values of the row: row[COL_CLIENT_CRITICALITY].                       |
+=====================================================================================
+'''
+class StoredRow():
+    __slots__ = ("store", "position")
+
+    def __init__(self, store: RowStore, position: int):
+        self.store: RowStore = store
+        self.position: int = position
+
+
+
+    '''
+    =====================================================================================
+    | Returns the value of a column.                                                    |
+    =====================================================================================
+    '''
+    def __getitem__(self, col_index: int):
+        return self.store.get_value(self.position, col_index)
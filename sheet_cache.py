@@ -0,0 +1,157 @@
+# Cache for the parsed rows of spreadsheet files.
+from collections import OrderedDict
+from row_store import RowStore
+from os import path
+import hashlib, json, threading
+
+
+
+'''
+=====================================================================================
+| Calculates the SHA-256 hash of a file without reading the whole file into memory. |
+=====================================================================================
+'''
+def hash_file(file_path: str) -> str:
+    sha256 = hashlib.sha256()
+
+    with open(file_path, "rb") as f:
+        while chunk := f.read(1024 * 1024):
+            sha256.update(chunk)
+
+    return sha256.hexdigest()
+
+
+
+'''
+=====================================================================================
+| Calculates a hash for the values of every row, so rows that have changed between  |
+| two versions of a file can be found. The position of a row is not part of the     |
+| hash.                                                                             |
+=====================================================================================
+'''
+def hash_rows(rows: RowStore) -> dict:
+    row_hashes = {}
+
+    for mitre_id in rows:
+        # Empty rows don't have a MITRE ID.
+        if not mitre_id:
+            continue
+
+        data = json.dumps(rows.values(mitre_id), default=str, separators=(",", ":")).encode("utf-8")
+        row_hashes[str(mitre_id)] = hashlib.sha1(data).hexdigest()
+
+    return row_hashes
+
+
+
+'''
+=====================================================================================
+| Cache for the rows that XLSXHandler and ODSHandler read from a spreadsheet file.  |
+|                                                                                   |
+| Import and export read the same file in "sheets/" again and again. The parsed     |
+| rows are stored here, so the file only has to be parsed again if it has changed.  |
+| The key contains the path, the modification time, the size and the content hash   |
+| of the file, so a changed file never gets the rows of the old file.               |
+|                                                                                   |
+| The cache is limited to max_bytes (estimated). If the limit is reached, the       |
+| entries that have not been used for the longest time are removed first.           |
+=====================================================================================
+'''
+class SheetCache():
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes: int = max_bytes
+        self.size: int = 0
+        self.entries: OrderedDict = OrderedDict() # Key -> (rows, size).
+
+        # Flask handles requests in multiple threads.
+        self.lock = threading.Lock()
+
+
+
+    '''
+    =====================================================================================
+    | Returns the cache key of a worksheet in a file.                                   |
+    =====================================================================================
+    '''
+    @staticmethod
+    def key(file_path: str, sheet_name: str) -> tuple:
+        file_path = path.abspath(file_path)
+        stat = path.getmtime(file_path), path.getsize(file_path)
+
+        return (file_path, sheet_name, *stat, hash_file(file_path))
+
+
+
+    '''
+    =====================================================================================
+    | Returns the cached rows or None if the rows are not in the cache.                 |
+    | The rows must not be modified.                                                    |
+    =====================================================================================
+    '''
+    def get(self, key: tuple) -> RowStore | None:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+
+            # Mark as most recently used.
+            self.entries.move_to_end(key)
+            return entry[0]
+
+
+
+    '''
+    =====================================================================================
+    | Adds rows to the cache. Older versions of the same file are removed, since they   |
+    | can't be used anymore.                                                            |
+    =====================================================================================
+    '''
+    def put(self, key: tuple, rows: RowStore) -> None:
+        size = rows.estimate_size()
+
+        # Rows that are bigger than the whole cache are not cached at all.
+        if size > self.max_bytes:
+            return
+
+        with self.lock:
+            for old_key in [k for k in self.entries if k[:2] == key[:2] and k != key]:
+                self.remove(old_key)
+
+            if key in self.entries:
+                self.remove(key)
+
+            self.entries[key] = (rows, size)
+            self.size += size
+
+            # Remove the least recently used entries until the cache is small enough.
+            while self.size > self.max_bytes:
+                self.remove(next(iter(self.entries)))
+
+
+
+    '''
+    =====================================================================================
+    | Removes an entry from the cache. Must be called while holding the lock.           |
+    =====================================================================================
+    '''
+    def remove(self, key: tuple) -> None:
+        _, size = self.entries.pop(key)
+        self.size -= size
+
+
+
+    '''
+    =====================================================================================
+    | Removes all entries from the cache.                                               |
+    =====================================================================================
+    '''
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+
+
+# Cache that is shared by the import and the export.
+sheet_cache = SheetCache(max_bytes=64 * 1024 * 1024)
@@ -0,0 +1,186 @@
+# Compact snapshots of the review state of an upgrade, e.g. to move an upgrade that is in progress to another machine.
+#
+# A snapshot is a gzip compressed JSON Lines file:
+# - The first line is the header with the format, its version, the upgrade and the names of the stored columns.
+# - Every further line is one change as a JSON array with the values in the order of the columns.
+from table_definitions import *
+from sqlalchemy import delete
+from datetime import datetime
+from typing import Iterator, IO
+import gzip, json, zlib
+
+SNAPSHOT_FORMAT = "ese-snapshot"
+SNAPSHOT_VERSION = 1
+
+# All columns of a change except the ID, which is assigned again on import.
+SNAPSHOT_COLUMNS = [column.name for column in MITREChange.__table__.columns if column.name != "change_id"]
+
+# Columns that are stored as ISO 8601 strings in the snapshot.
+DATETIME_COLUMNS = {column.name for column in MITREChange.__table__.columns if isinstance(column.type, DateTime)}
+
+# Number of rows that are read from the DB and compressed at once.
+SNAPSHOT_CHUNK_SIZE = 500
+
+
+
+'''
+=====================================================================================
+| Custom Exception that will be raised if a snapshot can't be imported.             |
+=====================================================================================
+'''
+class SnapshotException(Exception):
+    pass
+
+
+
+'''
+=====================================================================================
+| Returns the file name of the snapshot of an upgrade.                              |
+=====================================================================================
+'''
+def get_snapshot_filename(from_version: str, to_version: str) -> str:
+    return f"ese_snapshot_{from_version}_{to_version}.jsonl.gz"
+
+
+
+'''
+=====================================================================================
+| Streams the snapshot of an upgrade as chunks of gzip compressed bytes. The rows   |
+| are read and compressed in chunks, so the snapshot is never completely in memory. |
+| Uses its own connection, since the generator runs after the request has ended.    |
+=====================================================================================
+'''
+def export_snapshot(from_version: str, to_version: str) -> Iterator[bytes]:
+    # wbits=31 writes a gzip header, so the snapshot can also be opened with gzip/zcat.
+    compressor = zlib.compressobj(9, zlib.DEFLATED, 31)
+
+    header = {
+        "format": SNAPSHOT_FORMAT,
+        "version": SNAPSHOT_VERSION,
+        "from_version": from_version,
+        "to_version": to_version,
+        "exported_at": datetime.now().isoformat(timespec="seconds"),
+        "columns": SNAPSHOT_COLUMNS
+    }
+    yield compressor.compress((json.dumps(header) + "\n").encode())
+
+    columns = [getattr(MITREChange, column) for column in SNAPSHOT_COLUMNS]
+    datetime_indexes = [SNAPSHOT_COLUMNS.index(column) for column in DATETIME_COLUMNS]
+
+    with engine.connect() as connection:
+        result = connection.execution_options(yield_per=SNAPSHOT_CHUNK_SIZE).execute(
+            select(*columns) \
+            .where(MITREChange.from_version == from_version, MITREChange.to_version == to_version) \
+            .order_by(MITREChange.change_id)
+        )
+
+        for rows in result.partitions():
+            lines = []
+            for row in rows:
+                row = list(row)
+                for index in datetime_indexes:
+                    if row[index] is not None:
+                        row[index] = row[index].isoformat()
+
+                lines.append(json.dumps(row, separators=(",", ":")))
+
+            chunk = compressor.compress(("\n".join(lines) + "\n").encode())
+            if chunk:
+                yield chunk
+
+    yield compressor.flush()
+
+
+
+'''
+=====================================================================================
+| Reads a snapshot file and returns its header and its changes as dictionaries      |
+| that can be inserted into mitre_changes. Columns that are unknown to this version |
+| of the tool are ignored, missing columns get their default values.                |
+=====================================================================================
+'''
+def read_snapshot(file: IO[bytes]) -> tuple[dict, list]:
+    try:
+        with gzip.open(file, "rt", encoding="utf-8") as f:
+            header = json.loads(f.readline() or "{}")
+
+            if header.get("format") != SNAPSHOT_FORMAT:
+                raise SnapshotException("The file is not an ESE snapshot.")
+
+            if not isinstance(header.get("version"), int) or header["version"] > SNAPSHOT_VERSION:
+                raise SnapshotException(f"Snapshot version {header.get('version')} is not supported. Please update the tool.")
+
+            columns = header.get("columns") or []
+            known = [(index, column) for index, column in enumerate(columns) if column in SNAPSHOT_COLUMNS]
+
+            changes = []
+            for line in f:
+                if not line.strip():
+                    continue
+
+                values = json.loads(line)
+                if len(values) != len(columns):
+                    raise SnapshotException(f"Line {len(changes) + 2} of the snapshot has {len(values)} values, but {len(columns)} columns.")
+
+                change = {column: values[index] for index, column in known}
+                for column in DATETIME_COLUMNS:
+                    if change.get(column):
+                        change[column] = datetime.fromisoformat(change[column])
+
+                changes.append(change)
+    except (OSError, EOFError, UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise SnapshotException(f"The snapshot file is damaged: {e}")
+
+    if not header.get("from_version") or not header.get("to_version"):
+        raise SnapshotException("The snapshot doesn't contain an upgrade.")
+
+    # All changes belong to the upgrade of the header.
+    for change in changes:
+        change["from_version"] = header["from_version"]
+        change["to_version"] = header["to_version"]
+
+    return header, changes
+
+
+
+'''
+=====================================================================================
+| Imports a snapshot. All changes are stored with one bulk INSERT in a single       |
+| transaction. An upgrade that already exists is only replaced if replace is True,  |
+| which also deletes the record of its last spreadsheet import.                     |
+| Returns the upgrade and the number of imported changes.                           |
+=====================================================================================
+'''
+def import_snapshot(file: IO[bytes], replace: bool = False) -> tuple[str, str, int]:
+    header, changes = read_snapshot(file)
+    from_version, to_version = header["from_version"], header["to_version"]
+
+    with engine.begin() as connection:
+        exists = connection.execute(
+            select(MITREChange.change_id) \
+            .where(MITREChange.from_version == from_version, MITREChange.to_version == to_version) \
+            .limit(1)
+        ).first()
+
+        if exists and not replace:
+            raise SnapshotException(f"The upgrade from {from_version} to {to_version} already exists.")
+
+        # The triggers remove the search index entries, tactics and platforms of the deleted changes. The hashes
+        # of the imported spreadsheet file belong to the deleted changes, so they are deleted as well.
+        if exists:
+            connection.execute(
+                delete(MITREChange) \
+                .where(MITREChange.from_version == from_version, MITREChange.to_version == to_version)
+            )
+            connection.execute(
+                delete(SpreadsheetImport) \
+                .where(SpreadsheetImport.from_version == from_version, SpreadsheetImport.to_version == to_version)
+            )
+
+        if changes:
+            connection.execute(insert(MITREChange), changes)
+
+    # The search index is filled by the insert trigger, the tactics and platforms have to be added.
+    fill_missing_facet_rows()
+
+    return from_version, to_version, len(changes)
@@ -51,8 +51,69 @@ function handleFileUpload() {
 
 /*
 =====================================================================================
-| This function calls the export function in the backend. The backend creates a     |
-| download URL that will be displayed for the user.                                 |
+| Shows a message in the message box. If error is true, the message is shown as an  |
+| error.                                                                            |
+=====================================================================================
+*/
+function showExportMessage(html, error) {
+    $("#message").removeClass(error ? "alert-primary" : "alert-danger");
+    $("#message").addClass(error ? "alert-danger" : "alert-primary");
+    $("#message").show();
+    $("#message-text").html(html);
+}
+
+
+
+/*
+=====================================================================================
+| Polls the status of an export job until the job is done or failed. While the job  |
+| is running, the progress is displayed for the user.                               |
+=====================================================================================
+*/
+function pollExportStatus(status_url) {
+    $.ajax({
+        url: status_url,
+        method: "GET",
+        dataType: "json",
+        success: function(job) {
+            if (job.status === "done") {
+                showExportMessage(`
+                    <p>
+                        ${job.message}
+                        <a href="${job.download_url}">Click here to download.</a>
+                        <a href="${job.report_url}" target="_blank">Show changed cells.</a>
+                    </p>
+                `, false);
+                return;
+            }
+
+            if (job.status === "failed") {
+                showExportMessage(`<p>Export failed: ${$("<div>").text(job.message).html()}</p>`, true);
+                return;
+            }
+
+            // Still running. Show the progress and check again in a second.
+            if (job.phase === "saving") {
+                showExportMessage(`<p>Exporting... Saving file.</p>`, false);
+            } else {
+                showExportMessage(`<p>Exporting... ${job.rows_processed} of ${job.rows_total} rows.</p>`, false);
+            }
+
+            setTimeout(function() { pollExportStatus(status_url); }, 1000);
+        },
+        error: function(xhr, status, error) {
+            showExportMessage(`<p>Could not get the status of the export.</p>`, true);
+        }
+    })
+}
+
+
+
+/*
+=====================================================================================
+| This function calls the export function in the backend. The backend starts the    |
+| export in the background. The progress is displayed until the export is done,     |
+| then the download URL will be displayed for the user.                             |
 =====================================================================================
 */
 function handleFileExport() {
@@ -73,15 +134,12 @@ function handleFileExport() {
             data: JSON.stringify(data),
             dataType: "json",
             success: function(response) {
-                $("#message").removeClass("alertDanger");
-                $("#message").addClass("alert-primary");
-                $("#message").show();
-                $("#message-text").html(`
-                    <p>
-                        ${response.message}
-                        <a href="${response.download_url}">Click here to download.</a>
-                    </p>
-                `);
+                showExportMessage(`<p>${response.message}</p>`, false);
+                pollExportStatus(response.status_url);
+            },
+            error: function(xhr, status, error) {
+                message = xhr.responseJSON.message;
+                showExportMessage($("<p>").text(message).prop("outerHTML"), true);
             }
         })
     });
@@ -0,0 +1,67 @@
+/*
+=====================================================================================
+| Facets of the overview: filter the changes by tactic, platform, domain and        |
+| criticality.                                                                      |
+| The matching changes and the number of changes per value are returned by the      |
+| backend, so large upgrades don't have to be filtered in the browser.              |
+=====================================================================================
+*/
+const facets_url = $("#data").data("url-facets");
+const facet_names = ["tactic", "platform", "domain", "criticality"];
+
+
+
+/*
+=====================================================================================
+| Fills a facet dropdown with all values and their counts. The selected value is    |
+| kept.                                                                             |
+=====================================================================================
+*/
+function fillFacet(facet, counts) {
+    const select = $(`#facet-${facet}`);
+    const selected = select.val();
+
+    select.empty();
+    select.append($("<option>").val("").text("All"));
+
+    for (const [value, count] of Object.entries(counts)) {
+        select.append($("<option>").val(value).text(`${value} (${count})`));
+    }
+
+    select.val(selected);
+}
+
+
+
+/*
+=====================================================================================
+| Gets the changes and the facet counts for the selected values and hides all rows  |
+| of changes that don't match. The status filter (filter.js) works independently.   |
+=====================================================================================
+*/
+function loadFacets() {
+    const params = new URLSearchParams();
+
+    for (const facet of facet_names) {
+        const value = $(`#facet-${facet}`).val();
+        if (value) {
+            params.append(facet, value);
+        }
+    }
+
+    $.getJSON(`${facets_url}?${params}`, function(response) {
+        for (const facet of facet_names) {
+            fillFacet(facet, response.facets[facet]);
+        }
+
+        const mitre_ids = new Set(response.changes.map(c => c.mitre_id));
+        $(".status-select").each(function() {
+            $(this).closest("tr").toggleClass("facet-hidden", !mitre_ids.has($(this).data("mitre-id")));
+        });
+    });
+}
+
+
+
+$(".facet-select").on("change", loadFacets);
+loadFacets();
@@ -1,5 +1,7 @@
-from sqlalchemy import Column, Integer, Text, Boolean, create_engine
-from sqlalchemy.orm import Session, declarative_base
+from sqlalchemy import Column, Integer, Text, Boolean, DateTime, ForeignKey, Index, case, cast, create_engine, event, func, insert, inspect, literal, select, text
+from sqlalchemy.orm import Session, declarative_base, scoped_session, sessionmaker
+from datetime import datetime
+import json
 
 Base = declarative_base()
 
@@ -50,6 +52,104 @@ class MITREChange(Base):
     service_reasoning = Column(Text)
     service_measures = Column(Text)
     service_evaluation_status = Column(Text, default="n.a.")
+    revision = Column(Integer, default=0) # Revision of the last change of one of the EVALUATION_COLUMNS (see set_revision()).
+    domain = Column(Text, default="enterprise-attack") # ATT&CK domain (see constants.DOMAINS).
+
+    # Changes are looked up by MITRE ID (history of a technique, a change of an upgrade, carrying evaluations forward).
+    # The changes of an upgrade can be filtered by domain.
+    __table_args__ = (
+        Index("ix_mitre_changes_mitre_id", "mitre_id", "from_version", "to_version"),
+        Index("ix_mitre_changes_domain", "domain", "from_version", "to_version"),
+        Index("ix_mitre_changes_revision", "revision"),
+    )
+
+
+
+# Columns that are exported to the spreadsheet file. If one of them changes, the revision is updated.
+EVALUATION_COLUMNS = [
+    "client_criticality", "client_evaluation_status", "client_reasoning", "client_measures",
+    "infra_criticality", "infra_evaluation_status", "infra_reasoning", "infra_measures",
+    "service_criticality", "service_evaluation_status", "service_reasoning", "service_measures",
+    "confidentiality", "integrity", "availability"
+]
+
+
+
+'''
+=====================================================================================
+| Updates the revision of a change before it is written to the DB, but only if an   |
+| evaluation column has changed. This way the export knows which changes have been  |
+| modified since the spreadsheet file was imported.                                 |
+|                                                                                   |
+| The revision is one more than the highest revision of all changes and is          |
+| calculated by the UPDATE itself. SQLite runs one write transaction at a time, so  |
+| revisions only increase. Unlike timestamps they don't depend on the clock, which  |
+| can go back (DST, NTP corrections, another machine after a snapshot).             |
+=====================================================================================
+'''
+@event.listens_for(MITREChange, "before_update")
+def set_revision(mapper, connection, target: MITREChange) -> None:
+    state = inspect(target)
+
+    if any(state.attrs[column].history.has_changes() for column in EVALUATION_COLUMNS):
+        latest = MITREChange.__table__.alias("latest")
+        target.revision = select(func.coalesce(func.max(latest.c.revision), 0) + 1).scalar_subquery()
+
+
+
+'''
+=====================================================================================
+| Returns the highest revision of all changes.                                      |
+=====================================================================================
+'''
+def get_latest_revision(db: Session) -> int:
+    return db.scalar(select(func.coalesce(func.max(MITREChange.revision), 0)))
+
+
+
+'''
+=====================================================================================
+| SQL expression for a criticality sum: 0 if the criticality is 0, else the         |
+| criticality plus one for each of confidentiality, integrity and availability.     |
+| Values that are not numbers (e.g. "n.a." from a spreadsheet) count as 0.          |
+=====================================================================================
+'''
+def criticality_sum(criticality: Column):
+    criticality = func.coalesce(cast(criticality, Integer), 0)
+    cia = func.coalesce(MITREChange.confidentiality, 0) + func.coalesce(MITREChange.integrity, 0) + func.coalesce(MITREChange.availability, 0)
+
+    return case((criticality == 0, 0), else_=criticality + cia)
+
+
+
+# The criticality sums are only calculated in the DB with these expressions (see helper.recalculate_sums()).
+CRITICALITY_SUMS = {
+    "client_criticality_sum": criticality_sum(MITREChange.client_criticality),
+    "infra_criticality_sum": criticality_sum(MITREChange.infra_criticality),
+    "service_criticality_sum": criticality_sum(MITREChange.service_criticality)
+}
+
+
+
+# The highest client, infrastructure or service criticality of a change (used as facet in the overview).
+MAX_CRITICALITY = func.max(
+    func.coalesce(cast(MITREChange.client_criticality, Integer), 0),
+    func.coalesce(cast(MITREChange.infra_criticality, Integer), 0),
+    func.coalesce(cast(MITREChange.service_criticality, Integer), 0)
+)
+
+
+
+# Columns that are copied to a new upgrade if the evaluations of the previous upgrade are carried forward.
+CARRIED_FORWARD_COLUMNS = EVALUATION_COLUMNS + ["client_criticality_sum", "infra_criticality_sum", "service_criticality_sum"]
+
+
+
+# Columns of mitre_changes that are indexed for the full-text search.
+SEARCH_COLUMNS = [
+    "mitre_id", "technique", "sub_technique", "new_description", "old_description",
+    "client_reasoning", "client_measures", "infra_reasoning", "infra_measures", "service_reasoning", "service_measures"
+]
 
 
 
@@ -66,6 +166,81 @@ class MITREVersion(Base):
 
 
 
+'''
+=====================================================================================
+| Table for the tactics of each change, one row per tactic. MITREChange.tactics is  |
+| kept for displaying, this table is used for filtering and for the facet counts of |
+| the overview.                                                                     |
+=====================================================================================
+'''
+class ChangeTactic(Base):
+    __tablename__ = "change_tactics"
+    change_id = Column(Integer, ForeignKey("mitre_changes.change_id", ondelete="CASCADE"), primary_key=True)
+    tactic = Column(Text, primary_key=True)
+
+    __table_args__ = (
+        Index("ix_change_tactics_tactic", "tactic", "change_id"),
+    )
+
+
+
+'''
+=====================================================================================
+| Table for the platforms of each change, one row per platform (see ChangeTactic).  |
+=====================================================================================
+'''
+class ChangePlatform(Base):
+    __tablename__ = "change_platforms"
+    change_id = Column(Integer, ForeignKey("mitre_changes.change_id", ondelete="CASCADE"), primary_key=True)
+    platform = Column(Text, primary_key=True)
+
+    __table_args__ = (
+        Index("ix_change_platforms_platform", "platform", "change_id"),
+    )
+
+
+
+'''
+=====================================================================================
+| Returns the rows of the tactics and platforms tables for a change.                |
+| Tactics are stored as "Defense Evasion, Execution", platforms as a JSON list.     |
+=====================================================================================
+'''
+def get_facet_rows(change_id: int, tactics: str | None, platforms: str | None) -> tuple[list, list]:
+    tactic_rows = [{"change_id": change_id, "tactic": t} for t in dict.fromkeys(t.strip() for t in (tactics or "").split(",")) if t]
+
+    try:
+        platform_list = json.loads(platforms) if platforms else []
+    except ValueError:
+        platform_list = []
+
+    platform_rows = [{"change_id": change_id, "platform": p} for p in dict.fromkeys(platform_list or []) if p]
+
+    return tactic_rows, platform_rows
+
+
+
+'''
+=====================================================================================
+| Table for the imported spreadsheet file of each upgrade. revision is the highest  |
+| revision of all changes at the time of the import: only changes with a higher     |
+| revision have to be written to the file.                                          |
+| The hashes of the file and its rows are used to skip uploads that haven't changed |
+| (see helper.import_file()).                                                       |
+=====================================================================================
+'''
+class SpreadsheetImport(Base):
+    __tablename__ = "spreadsheet_imports"
+    from_version = Column(Text, primary_key=True)
+    to_version = Column(Text, primary_key=True)
+    file_name = Column(Text)
+    imported_at = Column(DateTime)
+    revision = Column(Integer) # Highest revision of all changes when the file was imported.
+    file_hash = Column(Text) # SHA-256 of the imported file.
+    row_hashes = Column(Text) # JSON: MITRE ID -> hash of the row values.
+
+
+
 '''
 =====================================================================================
 | Returns a Session object that can be used to query the database.                  |
@@ -76,10 +251,165 @@ def get_db_connection():
 
 
 
+'''
+=====================================================================================
+| Returns a session that can be shared by all request threads of the Flask server.  |
+| Every thread gets its own Session object, since a Session must not be used by     |
+| several threads at the same time. Call remove() at the end of a request.          |
+=====================================================================================
+'''
+def get_scoped_db_connection():
+    return scoped_session(sessionmaker(engine))
+
+
+
 '''
 =====================================================================================
 | Creates all tables, if they don't already exist.                                  |
 =====================================================================================
 '''
 def create_tables():
-    Base.metadata.create_all(engine)
\ No newline at end of file
+    Base.metadata.create_all(engine)
+    add_missing_columns()
+    add_missing_indexes()
+    create_search_index()
+    create_facet_rows()
+
+
+
+'''
+=====================================================================================
+| Adds columns that have been added to a table definition to an existing DB.        |
+| create_all() only creates missing tables, but doesn't change existing tables.     |
+| Existing rows get the default value of the column (e.g. the domain of changes     |
+| that were stored before there were several domains).                              |
+=====================================================================================
+'''
+def add_missing_columns():
+    with engine.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            existing_columns = {column["name"] for column in inspect(connection).get_columns(table.name)}
+
+            for column in table.columns:
+                if column.name not in existing_columns:
+                    column_type = column.type.compile(engine.dialect)
+
+                    if column.default is not None and column.default.is_scalar:
+                        default = literal(column.default.arg, column.type).compile(engine, compile_kwargs={"literal_binds": True})
+                        column_type += f" DEFAULT {default}"
+
+                    connection.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+
+
+
+'''
+=====================================================================================
+| Adds indexes that have been added to a table definition to an existing DB.        |
+=====================================================================================
+'''
+def add_missing_indexes():
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+
+
+
+'''
+=====================================================================================
+| Creates the FTS5 table for the full-text search (mitre_changes_fts) and the       |
+| triggers that keep it in sync with mitre_changes. The FTS5 table only stores the  |
+| index, the text itself is read from mitre_changes (external content table).       |
+| If the table doesn't exist yet, the index is built from all existing changes.     |
+| Returns False if SQLite has been built without FTS5.                              |
+=====================================================================================
+'''
+def create_search_index() -> bool:
+    columns = ", ".join(SEARCH_COLUMNS)
+    new_values = ", ".join(f"new.{column}" for column in SEARCH_COLUMNS)
+    old_values = ", ".join(f"old.{column}" for column in SEARCH_COLUMNS)
+
+    with engine.begin() as connection:
+        if connection.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'mitre_changes_fts'")).first():
+            return True
+
+        try:
+            connection.execute(text(
+                f"CREATE VIRTUAL TABLE mitre_changes_fts USING fts5({columns}, content='mitre_changes', content_rowid='change_id')"
+            ))
+        except Exception as e:
+            print(f"Full-text search is not available: {e}")
+            return False
+
+        # An update of the index is a delete of the old values and an insert of the new values.
+        # The update trigger only fires if an indexed column changes, not e.g. for status changes.
+        connection.execute(text(f"""
+            CREATE TRIGGER mitre_changes_fts_insert AFTER INSERT ON mitre_changes BEGIN
+                INSERT INTO mitre_changes_fts(rowid, {columns}) VALUES (new.change_id, {new_values});
+            END
+        """))
+        connection.execute(text(f"""
+            CREATE TRIGGER mitre_changes_fts_delete AFTER DELETE ON mitre_changes BEGIN
+                INSERT INTO mitre_changes_fts(mitre_changes_fts, rowid, {columns}) VALUES ('delete', old.change_id, {old_values});
+            END
+        """))
+        connection.execute(text(f"""
+            CREATE TRIGGER mitre_changes_fts_update AFTER UPDATE OF {columns} ON mitre_changes BEGIN
+                INSERT INTO mitre_changes_fts(mitre_changes_fts, rowid, {columns}) VALUES ('delete', old.change_id, {old_values});
+                INSERT INTO mitre_changes_fts(rowid, {columns}) VALUES (new.change_id, {new_values});
+            END
+        """))
+
+        # Index all changes that were stored before the full-text search existed.
+        connection.execute(text("INSERT INTO mitre_changes_fts(mitre_changes_fts) VALUES ('rebuild')"))
+
+    return True
+
+
+
+'''
+=====================================================================================
+| Creates the trigger that deletes the tactics and platforms of deleted changes     |
+| (SQLite doesn't enforce foreign keys by default) and fills the tactics and        |
+| platforms tables for changes that were stored before the tables existed.          |
+=====================================================================================
+'''
+def create_facet_rows():
+    with engine.begin() as connection:
+        connection.execute(text("""
+            CREATE TRIGGER IF NOT EXISTS mitre_changes_facets_delete AFTER DELETE ON mitre_changes BEGIN
+                DELETE FROM change_tactics WHERE change_id = old.change_id;
+                DELETE FROM change_platforms WHERE change_id = old.change_id;
+            END
+        """))
+
+    fill_missing_facet_rows()
+
+
+
+'''
+=====================================================================================
+| Fills the tactics and platforms tables for all changes that don't have any rows   |
+| yet. Has to be called after new changes have been stored, e.g. when an upgrade is |
+| initiated. All rows are inserted with one bulk INSERT per table.                  |
+=====================================================================================
+'''
+def fill_missing_facet_rows():
+    with engine.begin() as connection:
+        missing = connection.execute(
+            select(MITREChange.change_id, MITREChange.tactics, MITREChange.platforms) \
+            .where(
+                MITREChange.change_id.not_in(select(ChangeTactic.change_id)) &
+                MITREChange.change_id.not_in(select(ChangePlatform.change_id))
+            )
+        ).all()
+
+        tactic_rows, platform_rows = [], []
+        for change_id, tactics, platforms in missing:
+            change_tactic_rows, change_platform_rows = get_facet_rows(change_id, tactics, platforms)
+            tactic_rows += change_tactic_rows
+            platform_rows += change_platform_rows
+
+        if tactic_rows:
+            connection.execute(insert(ChangeTactic), tactic_rows)
+        if platform_rows:
+            connection.execute(insert(ChangePlatform), platform_rows)
@@ -1,9 +1,15 @@
-import re
+import openpyxl, re
 from constants import *
-from sqlalchemy import Sequence
+from sqlalchemy import Sequence, update
+from typing import Callable
 from table_definitions import *
 from openpyxl import load_workbook, Workbook
+from openpyxl.formula.translate import Translator, TranslatorError
+from row_store import RowStore, StoredRow
 
+# The MITRE ID cell does not contain the MITRE ID directly, but a formula that contains the MITRE ID.
+# Example: =HYPERLINK("https://attack.mitre.org/techniques/T1027/003";"T1027.003")
+HYPERLINK_PATTERN = re.compile(r'HYPERLINK\([^,;]+[,;]\s*"([^"]+)"\)')
 
 
 '''
@@ -23,31 +29,44 @@ class XLSXException(Exception):
 '''
 class XLSXHandler():
 
-    def __init__(self, file_path: str, sheet_name: str, db: Session):
+    def __init__(self, file_path: str, sheet_name: str, db: Session, read_only: bool = False, rows: RowStore = None):
         self.file_path: str = file_path
-        self.doc_values: Workbook = load_workbook(file_path, data_only=True) # One workbook for the values...
-        self.doc_formulas: Workbook = load_workbook(file_path, data_only=False) # ... and one workbook for the formulas.
         self.sheet_name: str = sheet_name
-        self.rows: dict = self.read_rows() # Only for reading the values, not for manipulating.
         self.db: Session = db
+
+        # Only for reading the values, not for manipulating.
+        # Rows that have already been read (e.g. from the cache) can be passed, so the file doesn't have to be read again.
+        self.rows: RowStore = rows if rows is not None else self.read_rows()
+
+        # For imports the file is only read, so the workbook with the formulas is not needed.
+        if read_only:
+            return
+
+        self.doc_formulas: Workbook = load_workbook(file_path, data_only=False) # The workbook with the formulas for manipulating.
         
         # Remove all empty rows so new rows come directly after non-empty rows. This way there are no big empty gaps.
         self.remove_empty_rows()
 
+        # Row numbers of all MITRE IDs in the worksheet with the formulas. Must be built after removing the empty rows.
+        self.row_index: dict = self.index_rows()
+
 
 
     '''
     =====================================================================================
-    | Reads all rows from the worksheet and returns it as a list of lists.              |
+    | Reads all rows from the worksheet and returns them as a RowStore.                 |
     =====================================================================================
     '''
-    def read_rows(self) -> list:
-        rows = {}
+    def read_rows(self) -> RowStore:
+        rows = RowStore()
+
+        # Open a workbook with the values (not the formulas) for reading. In read-only mode the worksheet is read row by row.
+        doc_values = load_workbook(self.file_path, read_only=True, data_only=True)
 
-        # Get the worksheet with values (not the formulas) for reading.
         try:
-            sheet = self.doc_values[self.sheet_name]
+            sheet = doc_values[self.sheet_name]
         except:
+            doc_values.close()
             raise XLSXException(f"Worksheet \"{self.sheet_name}\" not found.")
 
         for row in sheet.iter_rows(min_row=2):
@@ -55,75 +74,121 @@ class XLSXHandler():
             for cell in row:
                 row_data.append(cell.value)
             
-            # Use the MITREID as key in the hashtable.
-            key = row[COL_MITREID].value
-            rows[key] = row_data
+            # Use the MITREID as key.
+            rows.add(row[COL_MITREID].value, row_data)
         
+        doc_values.close()
         return rows
     
 
 
+    '''
+    =====================================================================================
+    | Builds a hashtable that maps every MITRE ID to its row number in the worksheet    |
+    | with the formulas. The MITRE ID is either extracted from the HYPERLINK formula or |
+    | taken directly from the cell if it contains a plain value.                        |
+    =====================================================================================
+    '''
+    def index_rows(self) -> dict:
+        row_index = {}
+        sheet = self.doc_formulas[self.sheet_name]
+
+        # Only iterate over the MITRE ID column.
+        for (cell,) in sheet.iter_rows(min_row=2, min_col=COL_MITREID + 1, max_col=COL_MITREID + 1):
+            value = cell.value
+            if not value:
+                continue
+
+            # Extract the MITRE ID from the formula. If there is no formula, use the plain value.
+            match = HYPERLINK_PATTERN.search(str(value))
+            mitre_id = match.group(1) if match else str(value).strip()
+
+            row_index[mitre_id] = cell.row
+
+        return row_index
+
+
+
     '''
     =====================================================================================
     | Match all techniques in the change database against the XLSX file. If a technique |
     | from the database is found in the XLSX file, import it's values. If a technique   |
     | is not found, all values are set to default.                                      |
+    |                                                                                   |
+    | The values are not assigned to the ORM objects one by one. Instead, one mapping   |
+    | per technique is collected and all of them are written with a single bulk UPDATE  |
+    | (executemany) by change_id.                                                       |
     =====================================================================================
     '''
     def import_xlsx(self, changes: Sequence[MITREChange]) -> None:
         rows = self.rows
+        mappings = []
 
         for c in changes:
-            # If a technique is not in the xlsx file, set everything to their default value.
-            if c.mitre_id not in rows:
-                # Client scores.
-                c.client_criticality, c.client_criticality_sum = 0, 0
-                c.client_evaluation_status = "not evaluated"
-                c.client_reasoning, c.client_measures = "", ""
+            values = self.import_values(rows.get(c.mitre_id))
+            values["change_id"] = c.change_id
+            mappings.append(values)
 
-                # Infrastructure scores.
-                c.infra_criticality, c.infra_criticality_sum = 0, 0
-                c.infra_evaluation_status = "not evaluated"
-                c.infra_reasoning, c.infra_measures = "", ""
+        if mappings:
+            self.db.execute(update(MITREChange), mappings)
+        self.db.commit()
 
-                # Service scores.
-                c.service_criticality, c.service_criticality_sum = 0, 0
-                c.service_evaluation_status = "not evaluated"
-                c.infra_reasoning, c.infra_measures = "", ""
 
-                c.confidentiality, c.integrity, c.availability = False, False, False
 
-            # Else, search for the row and import the values into the DB.
-            else:
-                row = rows[c.mitre_id]
-                
+    '''
+    =====================================================================================
+    | Returns the values of a row in the XLSX file as a mapping of column name to value |
+    | for the DB. If a technique is not in the XLSX file (row is None), everything is   |
+    | set to their default value.                                                       |
+    | The criticality sums are not imported, see helper.recalculate_sums().             |
+    =====================================================================================
+    '''
+    @staticmethod
+    def import_values(row: StoredRow | None) -> dict:
+        if row is None:
+            return {
                 # Client scores.
-                c.client_criticality = 0 if row[COL_CLIENT_CRITICALITY] == "n.a." else row[COL_CLIENT_CRITICALITY]
-                c.client_criticality_sum = 0 if row[COL_CLIENT_CRITICALITY_SUM] == "n.a." else row[COL_CLIENT_CRITICALITY_SUM]
-                c.client_evaluation_status = row[COL_CLIENT_EVALUATION_STATUS]
-                c.client_reasoning = row[COL_CLIENT_REASONING]
-                c.client_measures = row[COL_CLIENT_MEASURES]
+                "client_criticality": 0,
+                "client_evaluation_status": "not evaluated",
+                "client_reasoning": "", "client_measures": "",
 
                 # Infrastructure scores.
-                c.infra_criticality = 0 if row[COL_INFRASTRUCTURE_CRITICALITY] == "n.a." else row[COL_INFRASTRUCTURE_CRITICALITY]
-                c.infra_criticality_sum = 0 if row[COL_INFRASTRUCTURE_CRITICALITY_SUM] == "n.a." else row[COL_INFRASTRUCTURE_CRITICALITY_SUM]
-                c.infra_evaluation_status = row[COL_INFRASTRUCTURE_EVALUATION_STATUS]
-                c.infra_reasoning = row[COL_INFRASTRUCTURE_REASONING]
-                c.infra_measures = row[COL_INFRASTRUCTURE_MEASURES]
+                "infra_criticality": 0,
+                "infra_evaluation_status": "not evaluated",
+                "infra_reasoning": "", "infra_measures": "",
 
                 # Service scores.
-                c.service_criticality = 0 if row[COL_SERVICE_CRITICALITY] == "n.a." else row[COL_SERVICE_CRITICALITY]
-                c.service_criticality_sum = 0 if row[COL_SERVICE_CRITICALITY_SUM] == "n.a." else row[COL_SERVICE_CRITICALITY_SUM]
-                c.service_evaluation_status = row[COL_SERVICE_EVALUATION_STATUS]
-                c.service_reasoning = row[COL_SERVICE_REASONING]
-                c.service_measures = row[COL_SERVICE_MEASURES]
-
-                # If "x" then True, else False.
-                c.confidentiality = row[COL_CONFIDENTIALITY] == "x"
-                c.integrity = row[COL_INTEGRITY] == "x"
-                c.availability = row[COL_AVAILABILITY] == "x"
-            
-        self.db.commit()
+                "service_criticality": 0,
+                "service_evaluation_status": "not evaluated",
+                "service_reasoning": "", "service_measures": "",
+
+                "confidentiality": False, "integrity": False, "availability": False
+            }
+
+        return {
+            # Client scores.
+            "client_criticality": 0 if row[COL_CLIENT_CRITICALITY] == "n.a." else row[COL_CLIENT_CRITICALITY],
+            "client_evaluation_status": row[COL_CLIENT_EVALUATION_STATUS],
+            "client_reasoning": row[COL_CLIENT_REASONING],
+            "client_measures": row[COL_CLIENT_MEASURES],
+
+            # Infrastructure scores.
+            "infra_criticality": 0 if row[COL_INFRASTRUCTURE_CRITICALITY] == "n.a." else row[COL_INFRASTRUCTURE_CRITICALITY],
+            "infra_evaluation_status": row[COL_INFRASTRUCTURE_EVALUATION_STATUS],
+            "infra_reasoning": row[COL_INFRASTRUCTURE_REASONING],
+            "infra_measures": row[COL_INFRASTRUCTURE_MEASURES],
+
+            # Service scores.
+            "service_criticality": 0 if row[COL_SERVICE_CRITICALITY] == "n.a." else row[COL_SERVICE_CRITICALITY],
+            "service_evaluation_status": row[COL_SERVICE_EVALUATION_STATUS],
+            "service_reasoning": row[COL_SERVICE_REASONING],
+            "service_measures": row[COL_SERVICE_MEASURES],
+
+            # If "x" then True, else False.
+            "confidentiality": row[COL_CONFIDENTIALITY] == "x",
+            "integrity": row[COL_INTEGRITY] == "x",
+            "availability": row[COL_AVAILABILITY] == "x"
+        }
 
 
 
@@ -146,34 +211,173 @@ class XLSXHandler():
     
     '''
     =====================================================================================
-    | This function detects if a row in the worksheet is completely empty.              |
+    | Delete all rows that are completely empty so there are no big gaps in the         |
+    | document.                                                                         |
+    |                                                                                   |
+    | Calling sheet.delete_rows() once per empty row moves every row below it each      |
+    | time, which is very slow for sheets with thousands of empty rows. Instead, all    |
+    | rows that are not empty are moved up in a single pass (see compact_cells()).      |
+    | The cells keep their styles. Formulas of moved cells are translated like when the |
+    | row is copied to its new position in Excel: relative references are shifted by    |
+    | the same number of rows (=E12+F12 in row 12 becomes =E11+F11 in row 11), absolute |
+    | references ($E$12) stay. This fits the formulas of our sheet, which only refer to |
+    | their own row. A formula that would refer to a row above the first row is kept    |
+    | unchanged.                                                                        |
     =====================================================================================
     '''
-    def is_empty_row(self, row) -> bool:
-        for cell in row:
-            if cell.value not in (None, ""):
-                return False
-                    
-        return True
-    
+    def remove_empty_rows(self):
+        sheet = self.doc_formulas[self.sheet_name]
+        new_row_numbers, moved_cells = self.compact_cells(sheet)
+
+        for cell, old_row in moved_cells:
+            if cell.data_type != "f" or not isinstance(cell.value, str):
+                continue
+
+            try:
+                cell.value = Translator(cell.value, origin=f"{cell.column_letter}{old_row}").translate_formula(cell.coordinate)
+            except TranslatorError:
+                pass
+
+        # Move the row heights and row styles along with the cells.
+        row_dimensions = {new_row_numbers[row]: dim for row, dim in sheet.row_dimensions.items() if row in new_row_numbers}
+        sheet.row_dimensions.clear()
+        for row, dim in row_dimensions.items():
+            dim.index = row
+            sheet.row_dimensions[row] = dim
+
 
 
     '''
     =====================================================================================
-    | Delete all rows that are completely empty so there are no big gaps in the         |
-    | document.                                                                         |
+    | Moves the cells of all rows that are not empty up, so there are no empty rows in  |
+    | between, and drops the cells of the empty rows. The header row stays in place.    |
+    | Returns the new row number of every kept row and the moved cells with their old   |
+    | row number.                                                                       |
+    |                                                                                   |
+    | openpyxl has no way to move many rows at once, so this is the only place that     |
+    | uses private attributes of the worksheet. Written against openpyxl 3.1:           |
+    | - sheet._cells maps (row, column) to the cells that actually exist.               |
+    | - sheet._current_row is the row after which sheet.append() adds new rows.         |
+    | - cell.row is the row of a cell (the cell is not told when it is moved).          |
     =====================================================================================
     '''
-    def remove_empty_rows(self):
-        sheet = self.doc_formulas[self.sheet_name]
+    @staticmethod
+    def compact_cells(sheet) -> tuple[dict, list]:
+        if not isinstance(getattr(sheet, "_cells", None), dict) or not isinstance(getattr(sheet, "_current_row", None), int):
+            raise XLSXException(f"Empty rows can't be removed, openpyxl {openpyxl.__version__} is not supported (written for openpyxl 3.1).")
+
+        # Only look at cells that actually exist. Using iter_rows() would create a cell for every
+        # position up to the last row and column, even for the empty ones.
+        non_empty_rows = {row for (row, _), cell in sheet._cells.items() if row >= 2 and cell.value not in (None, "")}
+
+        # New row number for every row that is kept.
+        new_row_numbers = {row: new_row for new_row, row in enumerate(sorted(non_empty_rows), start=2)}
+        new_row_numbers[1] = 1
+
+        # Move all cells of the remaining rows and drop the cells of the empty rows.
+        cells = {}
+        moved_cells = []
+        for (row, col), cell in sheet._cells.items():
+            new_row = new_row_numbers.get(row)
+            if new_row is None:
+                continue
+
+            if new_row != row:
+                cell.row = new_row
+                moved_cells.append((cell, row))
+
+            cells[(new_row, col)] = cell
+
+        sheet._cells = cells
+
+        # sheet.append() adds new rows after the highest row that ever contained a cell, so this has to be updated as well.
+        sheet._current_row = max(new_row_numbers.values())
+
+        return new_row_numbers, moved_cells
+
+
+
+    '''
+    =====================================================================================
+    | Modifies a cell in the worksheet by row number and column index.                  |
+    | Row numbers start at 1 (like in the worksheet), column indices start at 0 (like   |
+    | the constants in constants.py).                                                   |
+    =====================================================================================
+    '''
+    @staticmethod
+    def set_cell(sheet, row: int, col_index: int, value) -> None:
+        sheet.cell(row=row, column=col_index + 1).value = value
+
+
+
+    '''
+    =====================================================================================
+    | Returns the exported values of a change as (column index, value) pairs.           |
+    | Criticality Sums don't need to be exported since they are calculated by a formula |
+    | in the file.                                                                      |
+    =====================================================================================
+    '''
+    @staticmethod
+    def export_values(change: MITREChange) -> list:
+        return [
+            # Client Scores.
+            (COL_CLIENT_CRITICALITY, change.client_criticality),
+            (COL_CLIENT_EVALUATION_STATUS, change.client_evaluation_status),
+            (COL_CLIENT_REASONING, change.client_reasoning),
+            (COL_CLIENT_MEASURES, change.client_measures),
+
+            # Infrastructure Scores.
+            (COL_INFRASTRUCTURE_CRITICALITY, change.infra_criticality),
+            (COL_INFRASTRUCTURE_EVALUATION_STATUS, change.infra_evaluation_status),
+            (COL_INFRASTRUCTURE_REASONING, change.infra_reasoning),
+            (COL_INFRASTRUCTURE_MEASURES, change.infra_measures),
+
+            # Service Scores.
+            (COL_SERVICE_CRITICALITY, change.service_criticality),
+            (COL_SERVICE_EVALUATION_STATUS, change.service_evaluation_status),
+            (COL_SERVICE_REASONING, change.service_reasoning),
+            (COL_SERVICE_MEASURES, change.service_measures),
+
+            # CIA
+            (COL_CONFIDENTIALITY, "x" if change.confidentiality else None),
+            (COL_INTEGRITY, "x" if change.integrity else None),
+            (COL_AVAILABILITY, "x" if change.availability else None)
+        ]
 
-        # Delete all empty rows from bottom to top, else there will
-        # be a problem when removing rows while iterating over them.
-        for row in reversed(list(sheet.iter_rows(min_row=2))):
-            if self.is_empty_row(row):
-                # Every cell contains the index of the row they are in.
-                row_index = row[0].row
-                sheet.delete_rows(row_index)
+
+
+    '''
+    =====================================================================================
+    | Compares the export values of a change with the values of its row in the file and |
+    | returns only the cells that differ as (column index, old value, new value).       |
+    | A criticality of 0 is imported from "n.a.", so both are treated as equal.         |
+    =====================================================================================
+    '''
+    def diff_values(self, change: MITREChange) -> list:
+        row = self.rows[change.mitre_id]
+        diff = []
+
+        for col_index, value in self.export_values(change):
+            old_value = row[col_index]
+
+            if self.normalize(old_value) == self.normalize(value) or (old_value == "n.a." and value == 0):
+                continue
+
+            diff.append((col_index, old_value, value))
+
+        return diff
+
+
+
+    '''
+    =====================================================================================
+    | Empty cells are read as None, but empty texts in the DB are "". Both are compared |
+    | as "".                                                                            |
+    =====================================================================================
+    '''
+    @staticmethod
+    def normalize(value):
+        return "" if value is None else value
 
 
 
@@ -185,53 +389,30 @@ class XLSXHandler():
     | supported.                                                                        |
     =====================================================================================
     '''
-    def export_xlsx(self, file_path: str, changes: Sequence[MITREChange]):
+    def export_xlsx(self, file_path: str, changes: Sequence[MITREChange], progress: Callable = None):
         sheet = self.doc_formulas[self.sheet_name]
 
-        for c in changes:
+        for i, c in enumerate(changes):
+            # Report how many rows have been processed so far.
+            if progress:
+                progress(i, len(changes), "rows")
+
             # Append to the sheet if it's a new addition.
             if c.mitre_id not in self.rows:
                 sheet.append(self.create_row(c))
                 continue
             
             # Else, export the values of the tool into the xlsx file.
-            # Iterate over all rows of the xlsx to find the correct one.
-            for row in sheet.iter_rows(min_row=2):
-                # Get the MITREID cell. This cell does not contain the MITREID directly, but a formula that contains the MITREID.
-                # Example: =HYPERLINK("https://attack.mitre.org/techniques/T1027/003";"T1027.003")
-                mitre_id = row[COL_MITREID].value
-                if not mitre_id:
-                    continue
-
-                # Extract the MITREID from the formula.
-                pattern = r'HYPERLINK\([^,;]+[,;]\s*"([^"]+)"\)'
-                match = re.search(pattern, mitre_id)
-                mitre_id = match.group(1) if match else None
-
-                # If MITRE ID matches, change the row.
-                if mitre_id == c.mitre_id:
-                    # Client Scores.
-                    # Criticality Sums don't need to be exported since they are calculated by a formula in the file.
-                    row[COL_CLIENT_CRITICALITY].value = c.client_criticality
-                    row[COL_CLIENT_EVALUATION_STATUS].value = c.client_evaluation_status
-                    row[COL_CLIENT_REASONING].value = c.client_reasoning
-                    row[COL_CLIENT_MEASURES].value = c.client_measures
-
-                    # Infrastructure Scores.
-                    row[COL_INFRASTRUCTURE_CRITICALITY].value = c.infra_criticality
-                    row[COL_INFRASTRUCTURE_EVALUATION_STATUS].value = c.infra_evaluation_status
-                    row[COL_INFRASTRUCTURE_REASONING].value = c.infra_reasoning
-                    row[COL_INFRASTRUCTURE_MEASURES].value = c.infra_measures
-
-                    # Service Scores.
-                    row[COL_SERVICE_CRITICALITY].value = c.service_criticality
-                    row[COL_SERVICE_EVALUATION_STATUS].value = c.service_evaluation_status
-                    row[COL_SERVICE_REASONING].value = c.service_reasoning
-                    row[COL_SERVICE_MEASURES].value = c.service_measures
-
-                    # CIA
-                    row[COL_CONFIDENTIALITY].value = "x" if c.confidentiality else None
-                    row[COL_INTEGRITY].value = "x" if c.integrity else None
-                    row[COL_AVAILABILITY].value = "x" if c.availability else None
+            # The row is accessed directly by its row number, so there's no need to search the whole worksheet.
+            row = self.row_index.get(c.mitre_id)
+            if row is None:
+                continue
+
+            # Only the cells that differ from the file are written.
+            for col_index, _, value in self.diff_values(c):
+                self.set_cell(sheet, row, col_index, value)
+
+        if progress:
+            progress(len(changes), len(changes), "saving")
 
         self.doc_formulas.save(file_path)
\ No newline at end of file